@@ -1,91 +1,338 @@
 import os
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import Response, FileResponse
-from twilio.twiml.voice_response import VoiceResponse
+import time
+import asyncio
+from fastapi import Depends, FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, Response
+from starlette.datastructures import FormData
+from twilio.twiml.voice_response import VoiceResponse, Connect
 from twilio.request_validator import RequestValidator
 from twilio.rest import Client
 from dotenv import load_dotenv
-import requests, time
-from io import BytesIO
 
-# --- Import Customer Data ---
-# Assuming your customer data is in 'utils/customer_data.py'
-from api.utils.customer_data import customer_id_map, customer_security_map, customer_account_id_map
+# --- Customer Directory ---
+from api.utils.customer_directory import customer_directory
 
 # Assuming your services are in an 'api/services' directory
-from api.services.elevenlabs_service import elevenlabs_service
-from api.services.gemini_service import gemini_service
+from api.services.http_client import http_clients
+from api.services.elevenlabs_service import async_elevenlabs_service
+from api.services.gemini_service import async_gemini_service, GEMINI_STREAMING, ERROR_REPLY, ReplyInterrupted
+from api.services.nessie_service import async_nessie_service
+from api.services.tts_cache import tts_cache
+from api.services.audio_artifacts import call_audio_store
+from api.services.account_cache import account_cache
+from api.services.intent_router import intent_router
+from api.services.response_cache import response_cache
+from api.services.session_store import session_store, CallSession
+from api.services.turn_tasks import turn_tasks, TURN_RESULT_TTL_SECONDS
+from api.services.media_stream import MediaStreamSession
+from api.services.streaming_stt import StreamingTranscriber
+from api.utils.timing import StageTimer, turn_timings
+from api.utils.metrics import MetricsMiddleware, bind_call, registry as metrics_registry, track
+from api.utils.sentence_stream import SentenceSplitter
+from api.utils.audio_codec import audio_content_type
 
 load_dotenv()
 os.makedirs("./audio", exist_ok=True)
 
 app = FastAPI()
+# Latency, in-flight and error metrics for every route, served at /metrics
+app.add_middleware(MetricsMiddleware, routes=app.routes)
 
 # --- Configuration ---
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
-# IMPORTANT: Use 'https' for your public URL when working with Twilio
-PUBLIC_BASE_URL = 'https://relaxatory-unsanguinely-delisa.ngrok-free.dev'
+# IMPORTANT: Use 'https' for your public URL when working with Twilio. Twilio signs webhooks
+# with this URL, so it must match the webhook URLs configured for the number.
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', 'https://relaxatory-unsanguinely-delisa.ngrok-free.dev').rstrip('/')
+# Only turn this off for local testing with unsigned requests
+TWILIO_VALIDATE_SIGNATURES = os.getenv('TWILIO_VALIDATE_SIGNATURES', 'true').lower() in ('1', 'true', 'yes')
+# 'record' plays each AI reply as a synthesized file; 'stream' streams it over a Twilio Media Stream;
+# 'duplex' also transcribes the caller live from that stream instead of recording each turn
+VOICE_MODE = os.getenv('VOICE_MODE', 'record')
+MEDIA_STREAM_URL = PUBLIC_BASE_URL.replace('https://', 'wss://', 1).replace('http://', 'ws://', 1) + '/media-stream'
 MAX_SECURITY_ATTEMPTS = 3 # Number of attempts for security questions
+SECURITY_ANSWER_ACTION = "/handle-security-answer"
+# Play a short filler prompt when a turn takes longer than FILLER_AFTER_MS, and collect the
+# reply from /turn-result instead of keeping Twilio's webhook waiting
+FILLER_AUDIO = os.getenv('FILLER_AUDIO', 'false').lower() in ('1', 'true', 'yes')
+FILLER_AFTER_MS = int(os.getenv('FILLER_AFTER_MS', '1200'))
+# How long each /turn-result request waits for the reply; Twilio gives up on webhooks after 15 seconds
+TURN_RESULT_WAIT_SECONDS = float(os.getenv('TURN_RESULT_WAIT_SECONDS', '8'))
+TURN_RESULT_ACTION = "/turn-result"
+# How often a worker that didn't start a turn checks the session for its result
+TURN_RESULT_POLL_SECONDS = 0.25
+
+# --- Fixed Prompts ---
+# These never change between calls, so they are synthesized once and served from the TTS cache.
+# Anything else spoken on a call is synthesized into an artifact scoped to that call.
+GREETING_PROMPT = "Welcome to Capital One. I'm Mr. Monopoly, your virtual banking assistant. To get started, may I have your first name?"
+ANYTHING_ELSE_PROMPT = "Is there anything else you would like assistance with?"
+ERROR_GOODBYE_PROMPT = "I apologize, but I encountered an error. Please try again later. Goodbye."
+LOST_TURN_PROMPT = "I'm sorry, I lost track of that. Could you please say it again?"
+FILLER_PROMPTS = [
+    "One moment while I look into that.",
+    "Let me check that for you.",
+    "Give me just a second.",
+]
+FIXED_PROMPTS = [
+    GREETING_PROMPT,
+    ANYTHING_ELSE_PROMPT,
+    ERROR_GOODBYE_PROMPT,
+    LOST_TURN_PROMPT,
+    *FILLER_PROMPTS,
+    "I didn't hear a name. Please say your first name.",
+    "I'm sorry, I couldn't find a customer with that name. Goodbye.",
+    "I encountered an error. Please call back later.",
+    "I didn't hear an answer. Please try again.",
+    "That is not correct. Let's try again.",
+    "I'm sorry, you have exceeded the maximum number of attempts.",
+    "I didn't hear anything. Could you please repeat that?",
+    "I'm sorry, I couldn't verify your identity on this call. Goodbye.",
+    "I found your account, but there are no security questions set up. Please contact support.",
+]
+CACHEABLE_PROMPTS = frozenset(FIXED_PROMPTS)
 
 # --- Twilio Client and Validator Initialization ---
 twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 twilio_validator = RequestValidator(TWILIO_AUTH_TOKEN)
 
 
-curr_user_name = ""
-curr_user_id = ""
-curr_account_id = ""
+def is_cacheable(text: str) -> bool:
+    """Fixed prompts and security questions, which are shared by every customer who has them."""
+    return text in CACHEABLE_PROMPTS or text in customer_directory.security_questions()
 
-"""
- audio_content = elevenlabs_service.text_to_speech(initial_greeting)
-    audio_file_path = "./audio/greeting.mp3"
-    with open(audio_file_path, "wb") as f:
-        f.write(audio_content)
-    
-    response.play(f"{PUBLIC_BASE_URL}/audio/greeting.mp3")
-"""
-def speak_string(text: str, response: VoiceResponse) :
-    audio_content = elevenlabs_service.text_to_speech(text)
-    audio_file_path = "./audio/recording.mp3"
-    with open(audio_file_path, "wb") as f:
-        f.write(audio_content)
-    
-    response.play(f"{PUBLIC_BASE_URL}/audio/recording.mp3")
-
-async def validate_twilio_request(request: Request) -> bool:
-    """Validate that a request is genuinely from Twilio."""
+async def synthesize_strings(texts: list[str], call_sid: str) -> list[str]:
+    """
+    Synthesize several utterances concurrently and return their audio filenames in order.
+    Fixed prompts come from the shared TTS cache; everything else gets its own audio
+    file scoped to the call. Only cache misses are sent to ElevenLabs, as one batch.
+    """
+    filenames = [None] * len(texts)
+    for i, text in enumerate(texts):
+        if is_cacheable(text):
+            filenames[i] = await tts_cache.lookup_async(text, async_elevenlabs_service)
+
+    pending = [i for i, filename in enumerate(filenames) if filename is None]
+    audio_contents = await async_elevenlabs_service.text_to_speech_batch([texts[i] for i in pending])
+    for i, audio_content in zip(pending, audio_contents):
+        if is_cacheable(texts[i]):
+            filenames[i] = await tts_cache.store_async(texts[i], async_elevenlabs_service, audio_content)
+        else:
+            filenames[i] = await call_audio_store.save_async(call_sid, audio_content)
+    return filenames
+
+def play_files(filenames: list[str], response: VoiceResponse):
+    for filename in filenames:
+        response.play(f"{PUBLIC_BASE_URL}/audio/{filename}")
+
+async def speak_strings(texts: list[str], response: VoiceResponse, call_sid: str):
+    """Synthesize several utterances concurrently and queue them for playback in order."""
+    play_files(await synthesize_strings(texts, call_sid), response)
+
+async def speak_string(text: str, response: VoiceResponse, call_sid: str) :
+    """Synthesize a single utterance (or reuse cached audio) and queue it for playback."""
+    await speak_strings([text], response, call_sid)
+
+def connect_media_stream(response: VoiceResponse, session: CallSession, reply: str, **parameters):
+    """Park a reply on the session and hand the call to /media-stream, which streams it."""
+    session.pending_reply = reply
+    session_store.save(session)
+    connect = Connect()
+    stream = connect.stream(url=MEDIA_STREAM_URL)
+    for name, value in parameters.items():
+        stream.parameter(name=name, value=value)
+    response.append(connect)
+
+async def play_reply(text: str, response: VoiceResponse, session: CallSession, final: bool = False):
+    """
+    Queue an AI reply. In stream mode the reply is parked on the session and streamed
+    to the caller over a media stream as it is synthesized; otherwise it is played as a file.
+    """
+    if VOICE_MODE == 'stream':
+        connect_media_stream(response, session, text, final='1' if final else '0')
+    else:
+        await speak_string(text, response, session.call_sid)
+
+async def run_ai_turn(session: CallSession, user_text: str, transactions: dict = None,
+                      timer: StageTimer = None) -> str:
+    """Get the assistant's reply to one caller utterance and record both in the session."""
+    timer = timer or StageTimer(f"turn {session.call_sid}")
+    ai_response_text = await timer.run('gemini', async_gemini_service.run_conversation(user_text, session, transactions))
+    record_turn(session, user_text, ai_response_text)
+    return ai_response_text
+
+def record_turn(session: CallSession, user_text: str, ai_response_text: str):
+    """Add one exchange to the session's history."""
+    print(f"AI Response: '{ai_response_text}'")
+    session.add_turn('user', user_text)
+    session.add_turn('assistant', ai_response_text)
+    session_store.save(session)
+
+async def stream_ai_turn(session: CallSession, user_text: str, splitter: SentenceSplitter,
+                         transactions: dict = None, timer: StageTimer = None):
+    """
+    Yield the assistant's reply sentence by sentence while Gemini is still generating it,
+    and record the whole exchange in the session once it is done. splitter.hangup tells
+    the caller whether the reply ended the call. If Gemini fails part-way, the unfinished
+    sentence is dropped, only the apology is recorded and ReplyInterrupted is raised.
+    """
+    timer = timer or StageTimer(f"turn {session.call_sid}")
+    pieces = []
     try:
-        signature = request.headers.get('X-TWILIO-SIGNATURE', '')
-        # The URL must match what Twilio sees, including query parameters if any.
-        url = str(request.url)
-        # For POST requests, Twilio requires the POST parameters in the validation.
-        post_data = await request.form()
-        return twilio_validator.validate(url, post_data, signature)
-    except Exception:
+        with timer.stage('gemini'):
+            async for piece in async_gemini_service.stream_conversation(user_text, session, transactions):
+                pieces.append(piece)
+                for sentence in splitter.feed(piece):
+                    timer.mark('first_sentence')
+                    yield sentence
+            for sentence in splitter.close():
+                timer.mark('first_sentence')
+                yield sentence
+    except ReplyInterrupted:
+        record_turn(session, user_text, ERROR_REPLY)
+        raise
+    record_turn(session, user_text, ''.join(pieces))
+
+async def speak_ai_turn(session: CallSession, user_text: str, response: VoiceResponse,
+                        transactions: dict = None, timer: StageTimer = None) -> bool:
+    """
+    Queue the assistant's reply as one audio file per sentence. Each sentence is synthesized
+    as soon as Gemini finishes it, overlapping TTS with the rest of the generation.
+    Returns whether the reply ended the call.
+    """
+    timer = timer or StageTimer(f"turn {session.call_sid}")
+    splitter = SentenceSplitter()
+    synthesis = []
+    try:
+        async for sentence in stream_ai_turn(session, user_text, splitter, transactions, timer):
+            synthesis.append(asyncio.create_task(synthesize_strings([sentence], session.call_sid)))
+        with timer.stage('tts'):
+            for filenames in await asyncio.gather(*synthesis):
+                play_files(filenames, response)
+    except ReplyInterrupted:
+        # Nothing has played yet, so the caller only hears the apology
+        for task in synthesis:
+            task.cancel()
+        await speak_string(ERROR_REPLY, response, session.call_sid)
         return False
+    except Exception:
+        for task in synthesis:
+            task.cancel()
+        raise
+    return splitter.hangup
+
+def end_call(call_sid: str):
+    """Forget everything held for a call once it is over, stopping any turn still running."""
+    turn_tasks.cancel(call_sid)
+    session_store.delete(call_sid)
+    async_gemini_service.end_chat(call_sid)
+
+async def download_recording(recording_url: str) -> bytes:
+    """Fetch a caller's recording from Twilio without blocking the event loop."""
+    # Pooled keep-alive client shared by every recording download
+    recording_client = http_clients.async_client(
+        'twilio',
+        auth=(TWILIO_ACCOUNT_SID or '', TWILIO_AUTH_TOKEN or ''),
+        follow_redirects=True
+    )
+    with track('recording_download') as span:
+        recording_response = await recording_client.get(recording_url)
+        recording_response.raise_for_status()
+        span.add_bytes(received=len(recording_response.content))
+    return recording_response.content
+
+async def warm_tts_cache():
+    """Synthesize every fixed prompt that is not cached yet."""
+    questions = await asyncio.to_thread(customer_directory.security_questions)
+    for prompt in FIXED_PROMPTS + sorted(questions):
+        try:
+            await tts_cache.get_or_synthesize_async(prompt, async_elevenlabs_service)
+        except Exception as e:
+            print(f"Error warming TTS cache for '{prompt}': {e}")
+            return
+
+background_tasks = set()
+
+def run_in_background(coro) -> asyncio.Task:
+    """Run a coroutine detached from the request, keeping a reference so it isn't garbage collected."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def prefetch_account_data(account_id: str):
+    """
+    Load an identified caller's balance and recent purchases into the account cache
+    while they answer the security question, so their first AI turn doesn't wait on Nessie.
+    """
+    try:
+        await asyncio.gather(
+            async_gemini_service.fetch_account_data(account_id),
+            async_nessie_service.get_account_balance(account_id)
+        )
+    except Exception as e:
+        print(f"Error prefetching account data for {account_id}: {e}")
+
+@app.on_event("startup")
+async def load_customer_directory():
+    """Index the customers before the first call, off the event loop, instead of inside a webhook."""
+    await asyncio.to_thread(customer_directory.reload)
+
+@app.on_event("startup")
+async def start_tts_cache_warmup():
+    """Fill the TTS cache in the background so the first callers don't pay for synthesis."""
+    run_in_background(warm_tts_cache())
+
+@app.on_event("startup")
+async def start_session_purger():
+    """Evict sessions of calls that ended without us hearing about it."""
+    run_in_background(session_store.run_purger())
+
+@app.on_event("startup")
+async def start_audio_sweeper():
+    """Periodically delete per-call audio that Twilio has long since fetched."""
+    run_in_background(call_audio_store.run_sweeper())
+
+@app.on_event("shutdown")
+async def close_http_clients():
+    """Release pooled connections to Twilio, ElevenLabs and Nessie."""
+    for task in list(background_tasks):
+        task.cancel()
+    await http_clients.aclose()
+
+async def twilio_form(request: Request) -> FormData:
+    """
+    Parse a webhook's form once and check its Twilio signature, before the handler starts any
+    STT or TTS work. The form is kept on request.state, so the handler never parses it again.
+    """
+    form = getattr(request.state, 'twilio_form', None)
+    if form is not None:
+        return form
+    form = await request.form()
+    if TWILIO_VALIDATE_SIGNATURES:
+        # Twilio signs the public URL it called, not the one the tunnel or proxy forwards to us
+        url = PUBLIC_BASE_URL + request.url.path + (f"?{request.url.query}" if request.url.query else '')
+        if not twilio_validator.validate(url, form, request.headers.get('X-Twilio-Signature', '')):
+            print(f"[Twilio] Rejected {request.url.path}: invalid signature")
+            raise HTTPException(status_code=403, detail="Invalid Twilio signature")
+    request.state.twilio_form = form
+    return form
+
+def valid_media_stream_signature(websocket: WebSocket) -> bool:
+    """Twilio signs the media stream's WebSocket handshake like a webhook to MEDIA_STREAM_URL with no form."""
+    if not TWILIO_VALIDATE_SIGNATURES:
+        return True
+    return twilio_validator.validate(MEDIA_STREAM_URL, {}, websocket.headers.get('X-Twilio-Signature', ''))
 
 @app.post("/voice")
-async def handle_incoming_call(request: Request):
+async def handle_incoming_call(form_data: FormData = Depends(twilio_form)):
     """Handle an incoming Twilio voice call and start the verification process."""
-    # Twilio validation can be skipped on the initial inbound call if not needed,
-    # but it's good practice for all webhooks. The validator might fail on the
-    # very first inbound POST if the URL has no params and form is empty,
-    # so we can be more lenient here or adjust validation logic.
-    # For simplicity, let's assume it's a valid call to start.
-
+    call_sid = form_data.get('CallSid', '')
+    bind_call(call_sid)
     response = VoiceResponse()
     # Greet the user and ask for their first name to start verification.
-    initial_greeting = "Welcome to Capital One. I'm Mr. Monopoly, your virtual banking assistant. To get started, may I have your first name?"
-    # initial_greeting = "first name"
-    
     # We will generate the audio for the greeting to have a consistent voice
-    audio_content = elevenlabs_service.text_to_speech(initial_greeting)
-    audio_file_path = "./audio/greeting.mp3"
-    with open(audio_file_path, "wb") as f:
-        f.write(audio_content)
-    
-    response.play(f"{PUBLIC_BASE_URL}/audio/greeting.mp3")
+    await speak_string(GREETING_PROMPT, response, call_sid)
     
     # Start recording their name.
     response.record(
@@ -98,163 +345,232 @@ async def handle_incoming_call(request: Request):
     return Response(content=str(response), media_type="application/xml")
 
 @app.post("/handle-name-recording")
-async def handle_name_recording(request: Request):
+async def handle_name_recording(form_data: FormData = Depends(twilio_form)):
     """Handle the user's spoken name and ask a security question."""
-    if not validate_twilio_request(request):
-        raise HTTPException(status_code=403, detail="Invalid Twilio signature")
-
-    form_data = await request.form()
     recording_url = form_data.get('RecordingUrl')
+    call_sid = form_data.get('CallSid', '')
+    bind_call(call_sid)
     response = VoiceResponse()
 
     if not recording_url:
-        speak_string("I didn't hear a name. Please say your first name.", response)
+        await speak_string("I didn't hear a name. Please say your first name.", response, call_sid)
         response.record(action="/handle-name-recording", maxLength=10, playBeep=False, timeout=3)
         return Response(content=str(response), media_type="application/xml")
 
     try:
         # Transcribe the user's name
-        rec_response = requests.get(recording_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
-        audio_file = BytesIO(rec_response.content)
-        user_name = elevenlabs_service.speech_to_text(audio_file).strip().capitalize()
-        print(f"Transcribed Name: '{user_name}'")
-        print(f"Transcribed Name (Filtered): '{''.join(filter(str.isalpha, user_name))}'")
-        ## print customer_id map for debugging
-        print(f"Customer ID Map Keys: {list(customer_id_map.keys())}")
-        user_name = ''.join(filter(str.isalpha, user_name)).lower()
-        global curr_user_name, curr_account_id, curr_user_id
-        curr_user_name = user_name
-        curr_account_id = customer_account_id_map.get(user_name, "")
-        curr_user_id = customer_id_map.get(user_name, "")
-        if user_name in customer_id_map:
+        recording = await download_recording(recording_url)
+        heard_name = (await async_elevenlabs_service.speech_to_text(recording)).strip()
+        print(f"Transcribed Name: '{heard_name}'")
+        match = customer_directory.match(heard_name)
+        if match is not None:
+            customer = match.customer
+            user_name = customer.name
+            if match.method != 'exact':
+                print(f"Matched '{match.heard}' to customer '{user_name}' ({match.method}, {match.distance} edits)")
+            # Remember who is on this call; later webhooks only see the CallSid
+            session = session_store.get_or_create(call_sid)
+            session.user_name = user_name
+            session.user_id = customer.customer_id
+            session.account_id = customer.account_id
+            session.verified = False
+            session.security_attempts = 0
+            session_store.save(session)
+            if session.account_id:
+                # Warm the account cache while the security question is asked and answered
+                run_in_background(prefetch_account_data(session.account_id))
+
             # Customer found, ask the first security question
-            security_questions = customer_security_map.get(user_name, {})
-            print(f"Security Questions for {user_name}: {security_questions}")
+            security_questions = customer.security
             first_question = list(security_questions.keys())[0] if security_questions else None
 
             if first_question:
                 print(f"Asking security question for {user_name}: {first_question}")
-                speak_string(f"Hello {user_name}, I will now verify your identity with a security question.", response)
-                speak_string(first_question, response)
-                # Record their answer, passing the name in the action URL and starting at attempt 1
-                response.record(action=f"/handle-security-answer/{user_name}/1", maxLength=15, playBeep=False, timeout=4)
+                await speak_strings([
+                    f"Hello {user_name}, I will now verify your identity with a security question.",
+                    first_question
+                ], response, call_sid)
+                # Record their answer; the session tracks who they claim to be and their attempts
+                response.record(action=SECURITY_ANSWER_ACTION, maxLength=15, playBeep=False, timeout=4)
             else:
-                speak_string("I found your account, but there are no security questions set up. Please contact support.", response)
+                await speak_string("I found your account, but there are no security questions set up. Please contact support.", response, call_sid)
                 response.hangup()
         else:
-            print(f"Customer '{user_name}' not found.")
-            speak_string("I'm sorry, I couldn't find a customer with that name. Goodbye.", response)
+            print(f"Customer '{heard_name}' not found.")
+            await speak_string("I'm sorry, I couldn't find a customer with that name. Goodbye.", response, call_sid)
             response.hangup()
 
     except Exception as e:
         print(f"Error handling name recording: {e}")
-        speak_string("I encountered an error. Please call back later.", response)
+        await speak_string("I encountered an error. Please call back later.", response, call_sid)
         response.hangup()
 
     return Response(content=str(response), media_type="application/xml")
 
 
-@app.post("/handle-security-answer/{name}/{attempt}")
-async def handle_security_answer(name: str, attempt: int, request: Request):
+@app.post(SECURITY_ANSWER_ACTION)
+async def handle_security_answer(form_data: FormData = Depends(twilio_form)):
     """
     Handle the security question answer, check correctness, and provide retries.
     """
-    if not validate_twilio_request(request):
-        raise HTTPException(status_code=403, detail="Invalid Twilio signature")
-
     response = VoiceResponse()
-    form_data = await request.form()
     recording_url = form_data.get('RecordingUrl')
+    call_sid = form_data.get('CallSid', '')
+    bind_call(call_sid)
 
-    security_questions = customer_security_map.get(name, {})
+    session = session_store.get(call_sid)
+    if session is None or not session.user_name:
+        await speak_string("I'm sorry, I couldn't verify your identity on this call. Goodbye.", response, call_sid)
+        response.hangup()
+        return Response(content=str(response), media_type="application/xml")
+
+    name = session.user_name
+    customer = customer_directory.get(name)
+    security_questions = customer.security if customer is not None else {}
     first_question = list(security_questions.keys())[0]
 
     if not recording_url:
-        speak_string("I didn't hear an answer. Please try again.", response)
-        speak_string(first_question, response)
-        response.record(action=f"/handle-security-answer/{name}/{attempt}", maxLength=15, playBeep=False, timeout=4)
+        await speak_strings(["I didn't hear an answer. Please try again.", first_question], response, call_sid)
+        response.record(action=SECURITY_ANSWER_ACTION, maxLength=15, playBeep=False, timeout=4)
         return Response(content=str(response), media_type="application/xml")
 
     try:
         # Transcribe the user's answer
-        rec_response = requests.get(recording_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
-        audio_file = BytesIO(rec_response.content)
+        recording = await download_recording(recording_url)
         ## filter user_answer to remove punctuation and keep only letters
         
-        user_answer = elevenlabs_service.speech_to_text(audio_file).strip().lower()
+        user_answer = (await async_elevenlabs_service.speech_to_text(recording)).strip().lower()
         user_answer = ''.join(filter(str.isalpha, user_answer)).lower()
 
         # Get the correct answer for comparison
         correct_answer = security_questions.get(first_question, "").lower()
+        session.security_attempts += 1
+        attempt = session.security_attempts
         print(f"Attempt {attempt}: User '{name}' Answered: '{user_answer}'. Correct: '{correct_answer}'")
 
-        if user_answer == correct_answer:
+        session.verified = user_answer == correct_answer
+        session_store.save(session)
+
+        if session.verified:
             # If verification is successful:
             verified_prompt = f"Thank you for verifying your identity, {name}. How can I help you today?"
 
-            speak_string(verified_prompt, response)
-            # Now, direct to the main AI conversation handler
-            response.record(action="/handle-recording", maxLength=30, playBeep=False, timeout=3)
+            if VOICE_MODE == 'duplex':
+                # The rest of the call runs over one media stream; the call ends when it closes
+                connect_media_stream(response, session, verified_prompt, converse='1')
+                response.hangup()
+            else:
+                await speak_string(verified_prompt, response, call_sid)
+                # Now, direct to the main AI conversation handler
+                response.record(action="/handle-recording", maxLength=30, playBeep=False, timeout=3)
         else:
             # If the answer is incorrect
             if attempt < MAX_SECURITY_ATTEMPTS:
-                next_attempt = attempt + 1
-                speak_string("That is not correct. Let's try again.", response)
-                speak_string(first_question, response)
-                response.record(action=f"/handle-security-answer/{name}/{next_attempt}", maxLength=15, playBeep=False, timeout=4)
+                await speak_strings(["That is not correct. Let's try again.", first_question], response, call_sid)
+                response.record(action=SECURITY_ANSWER_ACTION, maxLength=15, playBeep=False, timeout=4)
             else:
-                speak_string("I'm sorry, you have exceeded the maximum number of attempts.", response)
+                await speak_string("I'm sorry, you have exceeded the maximum number of attempts.", response, call_sid)
                 response.hangup()
 
     except Exception as e:
         print(f"Error handling security answer: {e}")
-        speak_string("I apologize, but I encountered an error. Please try again later. Goodbye.", response)
+        await speak_string(ERROR_GOODBYE_PROMPT, response, call_sid)
         response.hangup()
 
     return Response(content=str(response), media_type="application/xml")
 
 
+# Twilio's final call statuses; set /call-status as the number's status callback URL
+CALL_ENDED_STATUSES = {'completed', 'busy', 'failed', 'no-answer', 'canceled'}
+
+@app.post("/call-status")
+async def call_status(form_data: FormData = Depends(twilio_form)):
+    """Twilio's status callback. When the caller hangs up mid-turn, this is the only sign the call is over."""
+    call_sid = form_data.get('CallSid', '')
+    bind_call(call_sid)
+    if form_data.get('CallStatus') in CALL_ENDED_STATUSES:
+        print(f"Call {call_sid} ended ({form_data.get('CallStatus')})")
+        end_call(call_sid)
+    return Response(status_code=204)
+
 @app.get("/audio/{filename}")
 async def serve_audio(filename: str):
-    """Serve audio files stored locally."""
-    file_path = f"./audio/{filename}"
-    if os.path.exists(file_path):
-        return FileResponse(file_path, media_type="audio/mp3")
+    """Serve cached audio by its content hash, or a call's audio artifact by name."""
+    audio_content = await tts_cache.read_async(filename)
+    if audio_content is None:
+        audio_content = await call_audio_store.read_async(filename)
+    if audio_content is not None:
+        return Response(content=audio_content, media_type=audio_content_type(filename))
     raise HTTPException(status_code=404, detail="File not found")
 
 @app.post("/handle-recording")
-async def handle_recording(request: Request):
+async def handle_recording(form_data: FormData = Depends(twilio_form)):
     """
     Process a user's recording, get a response from an AI,
     and continue the conversation or hang up.
     """
-    if not validate_twilio_request(request):
-        raise HTTPException(status_code=403, detail="Invalid Twilio signature")
-
-    form_data = await request.form()
     recording_url = form_data.get('RecordingUrl')
+    call_sid = form_data.get('CallSid', '')
+    bind_call(call_sid)
+
+    # Only callers who passed the security question on this call may reach the assistant
+    session = session_store.get(call_sid)
+    if session is None or not session.verified:
+        response = VoiceResponse()
+        await speak_string("I'm sorry, I couldn't verify your identity on this call. Goodbye.", response, call_sid)
+        response.hangup()
+        return Response(content=str(response), media_type="application/xml")
     
     # If the user was silent, prompt them to speak again.
     if not recording_url:
         response = VoiceResponse()
-        speak_string(("I didn't hear anything. Could you please repeat that?"), response)
+        await speak_string(("I didn't hear anything. Could you please repeat that?"), response, call_sid)
         response.record(action="/handle-recording", maxLength=30, playBeep=False, timeout=3)
         return Response(content=str(response), media_type="application/xml")
 
-    try:
-        # Download the recording from Twilio
-        recording_response = requests.get(recording_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
-        recording_response.raise_for_status()
+    if FILLER_AUDIO:
+        # Answer Twilio straight away if the turn is slow; /turn-result collects the reply
+        session.turn_started_at, session.turn_result = time.time(), ""
+        session_store.save(session)
+        turn_tasks.start(call_sid, process_background_turn(session, recording_url))
+        return await collect_turn(call_sid, FILLER_AFTER_MS / 1000, filler=filler_prompt(session))
+    return Response(content=await process_turn(session, recording_url), media_type="application/xml")
+
+async def process_turn(session: CallSession, recording_url: str) -> str:
+    """Run one conversation turn for a caller's recording and return the TwiML that continues the call."""
+    call_sid = session.call_sid
+    # The turn is a small DAG: download -> STT on one branch, the account data Gemini
+    # needs on the other. The account fetch doesn't depend on the transcript, so both
+    # branches run concurrently and Gemini starts as soon as the slower one finishes.
+    timer = StageTimer(f"turn {call_sid}")
+    prefetch = asyncio.create_task(timer.run('account_data', async_gemini_service.fetch_account_data(session.account_id)))
+
+    async def transcribe() -> str:
+        recording = await timer.run('download', download_recording(recording_url))
+        return await timer.run('stt', async_elevenlabs_service.speech_to_text(recording))
 
+    try:
         # --- Start AI Processing ---
-        # 1. Convert user's speech to text
-        audio_file = BytesIO(recording_response.content)
-        user_text = elevenlabs_service.speech_to_text(audio_file)
+        # 1. Download and transcribe the caller's speech while their account data loads
+        user_text, transactions = await asyncio.gather(transcribe(), prefetch)
         print(f"Transcribed text: '{user_text}'")
         
+        if GEMINI_STREAMING and VOICE_MODE != 'stream':
+            # 2-3. Speak each sentence of the reply as soon as Gemini has generated it
+            response = VoiceResponse()
+            if await speak_ai_turn(session, user_text, response, transactions, timer):
+                print("Hanging up after the final message")
+                response.hangup()
+                end_call(call_sid)
+            else:
+                print("Continuing conversation...")
+                await speak_string(ANYTHING_ELSE_PROMPT, response, call_sid)
+                response.record(action="/handle-recording", maxLength=30, playBeep=False, timeout=3)
+            turn_timings.record(timer)
+            return str(response)
+
         # 2. Get a text response from the Gemini AI
-        ai_response_text = gemini_service.run_conversation(user_text, curr_user_name, curr_user_id, curr_account_id)
-        print(f"AI Response: '{ai_response_text}'")
+        ai_response_text = await run_ai_turn(session, user_text, transactions, timer)
         
         response = VoiceResponse()
 
@@ -265,27 +581,22 @@ async def handle_recording(request: Request):
             print(f"Hanging up with final message: '{final_message}'")
             
             if final_message:
-                audio_content = elevenlabs_service.text_to_speech(final_message)
-                audio_file_path = "./audio/response.mp3"
-                with open(audio_file_path, "wb") as f:
-                    f.write(audio_content)
-                response.play(f"{PUBLIC_BASE_URL}/audio/response.mp3")
+                await timer.run('tts', play_reply(final_message, response, session, final=True))
             
             response.hangup()
+            if VOICE_MODE != 'stream' or not final_message:
+                # In stream mode the media stream ends the call once the goodbye has played
+                end_call(call_sid)
         else:
             # 4. If the conversation should continue
             print("Continuing conversation...")
             
-            audio_content = elevenlabs_service.text_to_speech(ai_response_text)
-            audio_file_path = "./audio/response.mp3"
-            with open(audio_file_path, "wb") as f:
-                f.write(audio_content)
-            
-            response.play(f"{PUBLIC_BASE_URL}/audio/response.mp3")
-
-            # time.sleep(3)
-            speak_string("Is there anything else you would like assistance with?", response)
-            # time.sleep(1)
+            with timer.stage('tts'):
+                if VOICE_MODE == 'stream':
+                    await play_reply(ai_response_text, response, session)
+                    await speak_string(ANYTHING_ELSE_PROMPT, response, call_sid)
+                else:
+                    await speak_strings([ai_response_text, ANYTHING_ELSE_PROMPT], response, call_sid)
             
             response.record(
                 action="/handle-recording",
@@ -294,14 +605,256 @@ async def handle_recording(request: Request):
                 timeout=3
             )
 
-        return Response(content=str(response), media_type="application/xml")
+        turn_timings.record(timer)
+        return str(response)
 
     except Exception as e:
         print(f"Error processing recording: {e}")
+        prefetch.cancel()
         response = VoiceResponse()
-        speak_string("I apologize, but I encountered an error. Please try again later. Goodbye.", response)
+        await speak_string(ERROR_GOODBYE_PROMPT, response, call_sid)
         response.hangup()
-        return Response(content=str(response), media_type="application/xml")
+        return str(response)
+
+async def process_background_turn(session: CallSession, recording_url: str) -> str:
+    """process_turn for FILLER_AUDIO, also leaving the TwiML in the session for other workers."""
+    twiml = await process_turn(session, recording_url)
+    # A turn that ended the call has deleted its session; don't bring it back
+    if session_store.get(session.call_sid) is not None:
+        session.turn_result = twiml
+        session_store.save(session)
+    return twiml
+
+async def wait_for_session_turn(call_sid: str, timeout: float) -> tuple[str, bool]:
+    """
+    Collect a turn another worker is running from the call's session. Returns its TwiML (None
+    if not finished within timeout) and whether the turn is still expected to finish.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        session = session_store.get(call_sid)
+        if session is None:
+            # The turn ended the call
+            response = VoiceResponse()
+            response.hangup()
+            return str(response), False
+        if session.turn_result:
+            return session.turn_result, False
+        if not session.turn_started_at or time.time() - session.turn_started_at > TURN_RESULT_TTL_SECONDS:
+            return None, False
+        if time.monotonic() >= deadline:
+            return None, True
+        await asyncio.sleep(TURN_RESULT_POLL_SECONDS)
+
+def filler_prompt(session: CallSession) -> str:
+    """A short cached prompt to play while a turn is in flight, varied from turn to turn."""
+    return FILLER_PROMPTS[len(session.history) // 2 % len(FILLER_PROMPTS)]
+
+async def collect_turn(call_sid: str, timeout: float, filler: str = None) -> Response:
+    """
+    Return the call's background turn if it finishes within timeout. Otherwise play the
+    filler (or a short pause) and redirect Twilio to /turn-result to keep waiting, well
+    within Twilio's webhook timeout.
+    """
+    if turn_tasks.has_turn(call_sid):
+        twiml = await turn_tasks.wait(call_sid, timeout)
+        running = twiml is None and turn_tasks.has_turn(call_sid)
+    else:
+        # Started on another worker, which leaves the result in the session
+        twiml, running = await wait_for_session_turn(call_sid, timeout)
+    if twiml is not None:
+        return Response(content=twiml, media_type="application/xml")
+
+    response = VoiceResponse()
+    if not running:
+        # e.g. the server restarted while the turn was running
+        await speak_string(LOST_TURN_PROMPT, response, call_sid)
+        response.record(action="/handle-recording", maxLength=30, playBeep=False, timeout=3)
+    else:
+        if filler:
+            await speak_string(filler, response, call_sid)
+        else:
+            response.pause(length=1)
+        response.redirect(TURN_RESULT_ACTION)
+    return Response(content=str(response), media_type="application/xml")
+
+@app.post(TURN_RESULT_ACTION)
+async def turn_result(form_data: FormData = Depends(twilio_form)):
+    """Twilio comes back here after a filler prompt to collect the reply of the call's background turn."""
+    call_sid = form_data.get('CallSid', '')
+    bind_call(call_sid)
+    return await collect_turn(call_sid, TURN_RESULT_WAIT_SECONDS)
+
+async def converse_over_stream(stream: MediaStreamSession, session: CallSession):
+    """
+    Full-duplex conversation for VOICE_MODE=duplex. The caller is transcribed live;
+    as soon as they stop talking the final transcript goes to Gemini and the reply
+    is streamed back, with no recording to finish, upload and download in between.
+    """
+    async def log_partial(text: str):
+        print(f"[STT] Partial transcript for call {session.call_sid}: '{text}'")
+
+    transcriber = StreamingTranscriber(async_elevenlabs_service, on_partial=log_partial)
+    stream.on_media = transcriber.feed
+    # Wake the loop below when the caller hangs up
+    watcher = asyncio.create_task(stream.stopped.wait())
+    watcher.add_done_callback(lambda _: transcriber.close())
+    try:
+        while True:
+            user_text = await transcriber.next_final()
+            if user_text is None:
+                return
+            print(f"Transcribed text: '{user_text}'")
+            # Don't transcribe the caller's line while the assistant is talking
+            transcriber.paused = True
+
+            timer = StageTimer(f"turn {session.call_sid}")
+            if GEMINI_STREAMING:
+                try:
+                    if await stream_reply(stream, session, user_text, timer, follow_up=ANYTHING_ELSE_PROMPT):
+                        return
+                except Exception as e:
+                    print(f"Error processing utterance for call {session.call_sid}: {e}")
+                    await stream.play_text(ERROR_GOODBYE_PROMPT)
+                    return
+                turn_timings.record(timer)
+                transcriber.reset()
+                transcriber.paused = stream.stopped.is_set()
+                continue
+
+            try:
+                ai_response_text = await run_ai_turn(session, user_text, timer=timer)
+            except Exception as e:
+                print(f"Error processing utterance for call {session.call_sid}: {e}")
+                await stream.play_text(ERROR_GOODBYE_PROMPT)
+                return
+
+            if "[HANGUP]" in ai_response_text:
+                final_message = ai_response_text.replace("[HANGUP]", "").strip()
+                print(f"Hanging up with final message: '{final_message}'")
+                if final_message:
+                    await stream.play_text(final_message)
+                return
+
+            # The prompt is queued right behind the reply, so the line never goes quiet while it is
+            # synthesized; a caller taking that silence as their turn would be talking to a paused
+            # transcriber. Includes playback, since play_text waits until the caller has heard both.
+            with timer.stage('reply'):
+                await stream.play_text(ai_response_text, wait=False)
+                await stream.play_text(ANYTHING_ELSE_PROMPT)
+            turn_timings.record(timer)
+            transcriber.reset()
+            transcriber.paused = stream.stopped.is_set()
+    finally:
+        watcher.cancel()
+
+async def stream_reply(stream: MediaStreamSession, session: CallSession, user_text: str, timer: StageTimer,
+                       follow_up: str = None) -> bool:
+    """
+    Stream the assistant's reply to the caller sentence by sentence while Gemini is still
+    generating it. Each sentence's audio is sent as soon as it is synthesized and Twilio
+    queues it behind the previous one, as is follow_up unless the reply ended the call.
+    Returns once the caller has heard it all, and whether the reply ended the call.
+    """
+    splitter = SentenceSplitter()
+    with timer.stage('reply'):
+        try:
+            async for sentence in stream_ai_turn(session, user_text, splitter, timer=timer):
+                if stream.stopped.is_set():
+                    break
+                await stream.play_text(sentence, wait=False)
+        except ReplyInterrupted:
+            # Whole sentences already sent have been heard; the unfinished one is replaced by the apology
+            if not stream.stopped.is_set():
+                await stream.play_text(ERROR_REPLY, wait=False)
+        if follow_up and not splitter.hangup and not stream.stopped.is_set():
+            await stream.play_text(follow_up, wait=False)
+        # Includes playback, so the caller isn't transcribed while the reply is still playing
+        if not stream.stopped.is_set():
+            await stream.wait_for_mark(await stream.mark())
+    if splitter.hangup:
+        print(f"Call {session.call_sid} ended by the assistant")
+    return splitter.hangup
+
+@app.websocket("/media-stream")
+async def media_stream(websocket: WebSocket):
+    """
+    Twilio Media Stream for VOICE_MODE=stream and duplex. Streams the call's pending
+    AI reply to the caller as ElevenLabs produces it. In stream mode it then closes so
+    Twilio moves on to the next TwiML verb; in duplex mode it carries the rest of the call.
+    Unsigned handshakes and streams for calls without a session are refused.
+    """
+    if not valid_media_stream_signature(websocket):
+        print("[Twilio] Rejected /media-stream: invalid signature")
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    stream = MediaStreamSession(websocket, async_elevenlabs_service)
+    receiver = None
+    try:
+        await stream.wait_for_start()
+        bind_call(stream.call_sid)
+        session = session_store.get(stream.call_sid)
+        if session is None:
+            print(f"[Twilio] Rejected media stream for unknown call {stream.call_sid}")
+            return
+        receiver = asyncio.create_task(stream.receive_loop())
+
+        if session.pending_reply:
+            reply, session.pending_reply = session.pending_reply, ""
+            session_store.save(session)
+            await stream.play_text(reply)
+
+        if stream.parameters.get('converse') == '1':
+            if session.verified:
+                await converse_over_stream(stream, session)
+            end_call(stream.call_sid)
+        elif stream.parameters.get('final') == '1':
+            end_call(stream.call_sid)
+    except (WebSocketDisconnect, ConnectionError):
+        print(f"Media stream for call {stream.call_sid} disconnected")
+    except Exception as e:
+        print(f"Error streaming reply for call {stream.call_sid}: {e}")
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        if not stream.stopped.is_set():
+            try:
+                await websocket.close()
+            except RuntimeError:
+                # Twilio already closed the socket
+                pass
+
+@app.get("/stats/turns")
+async def turn_stage_timings():
+    """Per-stage timings of the most recent conversation turns, oldest first."""
+    return turn_timings.recent()
+
+@app.get("/stats/accounts")
+async def account_cache_stats():
+    """Hit/miss counters of the per-account Nessie cache."""
+    return account_cache.stats()
+
+@app.get("/stats/intents")
+async def intent_router_stats():
+    """How many turns were answered locally instead of by Gemini."""
+    return intent_router.stats()
+
+@app.get("/stats/responses")
+async def response_cache_stats():
+    """Hit/miss counters of the Gemini response cache."""
+    return response_cache.stats()
+
+@app.get("/stats/http")
+async def http_pool_stats():
+    """Connection pool and per-host request statistics for every upstream service."""
+    return http_clients.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, in-flight gauges, byte counts and errors"""
+    # Starlette appends the charset itself
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health_check():
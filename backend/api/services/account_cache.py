@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# How long each kind of Nessie data may be served from the cache, in seconds
+ACCOUNT_CACHE_TTLS = {
+    # The account document: balance plus metadata such as nickname and type
+    'account': int(os.getenv('ACCOUNT_CACHE_ACCOUNT_TTL', '30')),
+    'purchases': int(os.getenv('ACCOUNT_CACHE_PURCHASES_TTL', '120')),
+}
+ACCOUNT_CACHE_MAX_ENTRIES = int(os.getenv('ACCOUNT_CACHE_MAX_ENTRIES', '2000'))
+
+
+class AccountCache:
+    """
+    Per-account cache of Nessie responses with a TTL per kind of data.
+
+    Concurrent misses for the same entry share one upstream request (single flight),
+    and writes such as transfers invalidate everything cached for the accounts involved.
+    Only successful results should be stored, so errors are always retried.
+    """
+
+    def __init__(self, ttls: Dict[str, int] = None, max_entries: int = ACCOUNT_CACHE_MAX_ENTRIES):
+        self.ttls = dict(ttls or ACCOUNT_CACHE_TTLS)
+        self.max_entries = max_entries
+        # (kind, account_id, *variant) -> (value, expires_at), least recently used first
+        self._entries: "OrderedDict[tuple, tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[tuple, threading.Lock] = {}
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        # Bumped on every invalidation, so loads that started before a write are not stored
+        self._generations: Dict[str, int] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, kind: str, counter: str):
+        kind_stats = self._stats.setdefault(kind, {'hits': 0, 'misses': 0, 'shared_loads': 0, 'invalidations': 0})
+        kind_stats[counter] += 1
+
+    def _get(self, key: tuple) -> tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def _put(self, key: tuple, value: Any, generation: int):
+        with self._lock:
+            if self._generations.get(key[1], 0) != generation:
+                return
+            self._entries[key] = (value, time.time() + self.ttls.get(key[0], 0))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _key(kind: str, account_id: str, variant: Hashable) -> tuple:
+        return (kind, account_id, variant)
+
+    def get_or_load(self, kind: str, account_id: str, loader: Callable[[], Dict[str, Any]],
+                    variant: Hashable = None) -> Dict[str, Any]:
+        """Return a cached result or call loader once, even if several threads miss together."""
+        key = self._key(kind, account_id, variant)
+        found, value = self._get(key)
+        if found:
+            self._count(kind, 'hits')
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # Another thread may have loaded it while we waited
+                found, value = self._get(key)
+                if found:
+                    self._count(kind, 'shared_loads')
+                    return value
+                self._count(kind, 'misses')
+                generation = self._generations.get(account_id, 0)
+                value = loader()
+                if value.get('success'):
+                    self._put(key, value, generation)
+                return value
+        finally:
+            with self._lock:
+                if self._key_locks.get(key) is key_lock:
+                    del self._key_locks[key]
+
+    async def get_or_load_async(self, kind: str, account_id: str, loader: Callable[[], Awaitable[Dict[str, Any]]],
+                                variant: Hashable = None) -> Dict[str, Any]:
+        """Return a cached result or await loader once, sharing it with concurrent callers."""
+        key = self._key(kind, account_id, variant)
+        found, value = self._get(key)
+        if found:
+            self._count(kind, 'hits')
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._count(kind, 'shared_loads')
+            return await asyncio.shield(inflight)
+
+        self._count(kind, 'misses')
+        generation = self._generations.get(account_id, 0)
+        inflight = asyncio.ensure_future(loader())
+        self._inflight[key] = inflight
+        try:
+            value = await asyncio.shield(inflight)
+        finally:
+            if self._inflight.get(key) is inflight:
+                del self._inflight[key]
+        if value.get('success'):
+            self._put(key, value, generation)
+        return value
+
+    def invalidate(self, account_id: str, kind: Optional[str] = None):
+        """Drop every cached entry for an account, or only one kind of them."""
+        with self._lock:
+            self._generations[account_id] = self._generations.get(account_id, 0) + 1
+            stale = [key for key in self._entries if key[1] == account_id and (kind is None or key[0] == kind)]
+            for key in stale:
+                del self._entries[key]
+                self._count(key[0], 'invalidations')
+        # Results still in flight were requested before the write, so don't let them be shared
+        for key in [key for key in self._inflight if key[1] == account_id and (kind is None or key[0] == kind)]:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttls': dict(self.ttls),
+                'kinds': {kind: dict(counts) for kind, counts in self._stats.items()}
+            }
+
+
+account_cache = AccountCache()
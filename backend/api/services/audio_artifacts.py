@@ -0,0 +1,92 @@
+import os
+import re
+import time
+import uuid
+import asyncio
+from typing import Optional
+from dotenv import load_dotenv
+from .elevenlabs_service import AUDIO_FILE_EXTENSION
+
+load_dotenv()
+
+AUDIO_ARTIFACT_DIR = os.getenv('AUDIO_ARTIFACT_DIR', './audio')
+AUDIO_RETENTION_SECONDS = int(os.getenv('AUDIO_RETENTION_SECONDS', '600'))
+AUDIO_SWEEP_INTERVAL_SECONDS = int(os.getenv('AUDIO_SWEEP_INTERVAL_SECONDS', '60'))
+
+ARTIFACT_FILENAME_RE = re.compile(r'^call-[A-Za-z0-9]+-[0-9a-f]{32}\.[a-z0-9]+$')
+
+
+class CallAudioStore:
+    """
+    Stores one-off synthesized utterances under names scoped to a call.
+
+    Every utterance gets its own file (call-<CallSid>-<uuid>.<ext>), so concurrent
+    calls, or several utterances within one TwiML response, never overwrite each
+    other. Files only need to live until Twilio has fetched them, so a sweeper
+    deletes anything older than the retention window.
+    """
+
+    def __init__(self, directory: str = AUDIO_ARTIFACT_DIR, retention_seconds: int = AUDIO_RETENTION_SECONDS,
+                 extension: str = 'mp3'):
+        self.directory = directory
+        self.retention_seconds = retention_seconds
+        self.extension = extension
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def save(self, call_sid: str, audio: bytes) -> str:
+        """Write audio for a call and return its unique filename."""
+        safe_sid = ''.join(filter(str.isalnum, call_sid or '')) or 'unknown'
+        filename = f"call-{safe_sid}-{uuid.uuid4().hex}.{self.extension}"
+        with open(self._path(filename), 'wb') as f:
+            f.write(audio)
+        return filename
+
+    async def save_async(self, call_sid: str, audio: bytes) -> str:
+        """Like save, but the file is written off the event loop."""
+        return await asyncio.to_thread(self.save, call_sid, audio)
+
+    def read(self, filename: str) -> Optional[bytes]:
+        if not ARTIFACT_FILENAME_RE.match(filename):
+            return None
+        try:
+            with open(self._path(filename), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def read_async(self, filename: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self.read, filename)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Delete artifacts older than the retention window. Returns the number removed."""
+        cutoff = (now or time.time()) - self.retention_seconds
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not ARTIFACT_FILENAME_RE.match(entry.name):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    # Another worker swept it first
+                    continue
+        return removed
+
+    async def run_sweeper(self, interval_seconds: int = AUDIO_SWEEP_INTERVAL_SECONDS):
+        """Sweep expired artifacts forever. Meant to run as a background task."""
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.sweep)
+                if removed:
+                    print(f"[Audio] Swept {removed} expired call audio files")
+            except Exception as e:
+                print(f"[Audio] Error sweeping call audio: {e}")
+            await asyncio.sleep(interval_seconds)
+
+
+call_audio_store = CallAudioStore(extension=AUDIO_FILE_EXTENSION)
@@ -1,84 +1,244 @@
 import os
-from typing import BinaryIO
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, BinaryIO, List, Union
+import httpx
 import requests
 from dotenv import load_dotenv
+from api.utils.audio_codec import audio_file_extension, playable_audio
+from api.utils.metrics import observe_stage, track
+from .http_client import http_clients
 
 load_dotenv()
 
 ELEVENLABS_API_KEY = os.getenv('ELEVENLABS_API_KEY')
 ELEVENLABS_VOICE_ID = os.getenv('ELEVENLABS_VOICE_ID')
+ELEVENLABS_MODEL_ID = os.getenv('ELEVENLABS_MODEL_ID', 'eleven_multilingual_v2')
+ELEVENLABS_VOICE_SETTINGS = {
+    'stability': 0.5,
+    'similarity_boost': 0.75
+}
+# Format of audio played with <Play>: mp3_* is served as MP3; ulaw_8000 and pcm_* are what the phone
+# line carries, so they are served as WAV and Twilio doesn't have to transcode them
+ELEVENLABS_OUTPUT_FORMAT = os.getenv('ELEVENLABS_OUTPUT_FORMAT', 'mp3_44100_128')
+# File extension of audio synthesized in ELEVENLABS_OUTPUT_FORMAT; also validates the setting
+AUDIO_FILE_EXTENSION = audio_file_extension(ELEVENLABS_OUTPUT_FORMAT)
+
+# STANDINS_URL points every service at the local stand-in servers in standins/
+STANDINS_URL = os.getenv('STANDINS_URL', '').rstrip('/')
+ELEVENLABS_BASE_URL = os.getenv('ELEVENLABS_BASE_URL', f"{STANDINS_URL}/elevenlabs" if STANDINS_URL else 'https://api.elevenlabs.io')
+
+TTS_URL = f"{ELEVENLABS_BASE_URL}/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
+STS_URL = f"{ELEVENLABS_BASE_URL}/v1/speech-to-text"
+
+# Most ElevenLabs plans cap concurrent requests, so batches never exceed this many in flight
+ELEVENLABS_TTS_CONCURRENCY = int(os.getenv('ELEVENLABS_TTS_CONCURRENCY', '4'))
+
+# The FIX is to add the model_id in the 'data' payload
+STS_DATA = {
+    "model_id": "scribe_v1"
+}
+
+
+def _require_api_key():
+    if not ELEVENLABS_API_KEY:
+        raise ValueError("ElevenLabs API key is not configured.")
+
+
+def _tts_payload(text: str) -> dict:
+    return {
+        'text': text,
+        'model_id': ELEVENLABS_MODEL_ID,
+        'voice_settings': ELEVENLABS_VOICE_SETTINGS
+    }
+
+
+def _audio_size(audio) -> int:
+    """Bytes of audio sent for transcription; 0 for file objects, which are streamed."""
+    return len(audio) if isinstance(audio, (bytes, bytearray)) else 0
+
+
+def _parse_stt_result(result: dict) -> str:
+    if not isinstance(result.get('text'), str):
+        raise Exception('ElevenLabs STS Error: Invalid response format.')
+    return result['text']
 
-TTS_URL = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
-STS_URL = f"https://api.elevenlabs.io/v1/speech-to-text"
 
 class ElevenLabsService:
-    @staticmethod
-    def speech_to_text(audio_file: BinaryIO) -> str:
+    def __init__(self, session: requests.Session = None):
+        # Synthesis is safe to repeat, so POSTs are retried on transient failures
+        self.session = session or http_clients.session('elevenlabs', retry_post=True)
+
+    def speech_to_text(self, audio_file: BinaryIO) -> str:
         """Convert speech to text using ElevenLabs API"""
-        if not ELEVENLABS_API_KEY:
-            raise ValueError("ElevenLabs API key is not configured.")
+        _require_api_key()
 
         files = {
             'file': ('audio.mp3', audio_file, 'audio/mp3')
         }
-        
+
         headers = {
             'xi-api-key': ELEVENLABS_API_KEY
         }
-        
-        # The FIX is to add the model_id in the 'data' payload
-        data = {
-            "model_id": "scribe_v1" 
-        }
 
-        response = requests.post(
-            STS_URL,
-            headers=headers,
-            files=files,
-            data=data
-        )
+        with track('stt') as span:
+            response = self.session.post(
+                STS_URL,
+                headers=headers,
+                files=files,
+                data=STS_DATA
+            )
+            span.add_bytes(sent=_audio_size(audio_file), received=len(response.content))
 
-        if not response.ok:
-            error_text = response.text
-            print(f"ElevenLabs STS Error: {error_text}")
-            raise Exception(f"ElevenLabs Speech-to-Text Error: {response.status_code} {error_text}")
+            if not response.ok:
+                error_text = response.text
+                print(f"ElevenLabs STS Error: {error_text}")
+                raise Exception(f"ElevenLabs Speech-to-Text Error: {response.status_code} {error_text}")
 
-        result = response.json()
-        if not isinstance(result.get('text'), str):
-            raise Exception('ElevenLabs STS Error: Invalid response format.')
-        
-        return result['text']
+        return _parse_stt_result(response.json())
 
     @staticmethod
-    def text_to_speech(text: str) -> bytes:
-        """Convert text to speech using ElevenLabs API"""
-        if not ELEVENLABS_API_KEY:
-            raise ValueError("ElevenLabs API key is not configured.")
+    def synthesis_params() -> dict:
+        """Every parameter that affects synthesized audio, used as part of the TTS cache key"""
+        return {
+            'voice_id': ELEVENLABS_VOICE_ID,
+            'model_id': ELEVENLABS_MODEL_ID,
+            'voice_settings': ELEVENLABS_VOICE_SETTINGS,
+            'output_format': ELEVENLABS_OUTPUT_FORMAT
+        }
+
+    def text_to_speech(self, text: str, output_format: str = ELEVENLABS_OUTPUT_FORMAT) -> bytes:
+        """Convert text to speech using ElevenLabs API, in a playable container"""
+        _require_api_key()
 
         headers = {
             'xi-api-key': ELEVENLABS_API_KEY,
             'Content-Type': 'application/json'
         }
 
-        data = {
-            'text': text,
-            'model_id': 'eleven_multilingual_v2',
-            'voice_settings': {
-                'stability': 0.5,
-                'similarity_boost': 0.75
-            }
+        with track('tts') as span:
+            response = self.session.post(
+                TTS_URL,
+                params={'output_format': output_format},
+                headers=headers,
+                json=_tts_payload(text)
+            )
+            span.add_bytes(sent=len(text.encode()), received=len(response.content))
+
+            if not response.ok:
+                error_text = response.text
+                raise Exception(f"ElevenLabs TTS Error: {response.status_code} {error_text}")
+
+        return playable_audio(response.content, output_format)
+
+    def text_to_speech_batch(self, texts: List[str]) -> List[bytes]:
+        """Synthesize several texts concurrently, returning audio in the same order as texts"""
+        if len(texts) <= 1:
+            return [self.text_to_speech(text) for text in texts]
+        with ThreadPoolExecutor(max_workers=min(len(texts), ELEVENLABS_TTS_CONCURRENCY)) as executor:
+            return list(executor.map(self.text_to_speech, texts))
+
+
+class AsyncElevenLabsService:
+    """
+    Non-blocking variant of ElevenLabsService for use from async request handlers.
+    Requests share one pooled client, so connections are reused across calls.
+    """
+
+    def __init__(self, client: httpx.AsyncClient = None, concurrency: int = ELEVENLABS_TTS_CONCURRENCY):
+        self._client = client
+        self.concurrency = concurrency
+        self._tts_slots = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Synthesis is safe to repeat, so POSTs are retried on transient failures
+        return self._client or http_clients.async_client('elevenlabs', retry_post=True)
+
+    synthesis_params = staticmethod(ElevenLabsService.synthesis_params)
+
+    def _synthesis_slots(self) -> asyncio.Semaphore:
+        # Created lazily so it belongs to the running event loop
+        if self._tts_slots is None:
+            self._tts_slots = asyncio.Semaphore(self.concurrency)
+        return self._tts_slots
+
+    async def speech_to_text(self, audio: Union[bytes, BinaryIO], filename: str = 'audio.mp3',
+                             content_type: str = 'audio/mp3') -> str:
+        """Convert speech to text using ElevenLabs API"""
+        _require_api_key()
+
+        files = {
+            'file': (filename, audio, content_type)
         }
 
-        response = requests.post(
-            TTS_URL,
-            headers=headers,
-            json=data
-        )
+        with track('stt') as span:
+            response = await self.client.post(
+                STS_URL,
+                headers={'xi-api-key': ELEVENLABS_API_KEY},
+                files=files,
+                data=STS_DATA
+            )
+            span.add_bytes(sent=_audio_size(audio), received=len(response.content))
+
+            if not response.is_success:
+                error_text = response.text
+                print(f"ElevenLabs STS Error: {error_text}")
+                raise Exception(f"ElevenLabs Speech-to-Text Error: {response.status_code} {error_text}")
+
+        return _parse_stt_result(response.json())
+
+    async def text_to_speech(self, text: str, output_format: str = ELEVENLABS_OUTPUT_FORMAT) -> bytes:
+        """Convert text to speech using ElevenLabs API, in a playable container"""
+        _require_api_key()
 
-        if not response.ok:
+        async with self._synthesis_slots():
+            with track('tts') as span:
+                response = await self.client.post(
+                    TTS_URL,
+                    params={'output_format': output_format},
+                    headers={'xi-api-key': ELEVENLABS_API_KEY},
+                    json=_tts_payload(text)
+                )
+                span.add_bytes(sent=len(text.encode()), received=len(response.content))
+                span.error = not response.is_success
+
+        if not response.is_success:
             error_text = response.text
             raise Exception(f"ElevenLabs TTS Error: {response.status_code} {error_text}")
 
-        return response.content
+        return playable_audio(response.content, output_format)
+
+    async def text_to_speech_stream(self, text: str, output_format: str = 'ulaw_8000') -> AsyncIterator[bytes]:
+        """Yield synthesized audio chunks in output_format as ElevenLabs produces them"""
+        _require_api_key()
+
+        async with self._synthesis_slots():
+            # Covers the whole stream; the time to its first audio is recorded separately
+            with track('tts_stream') as span:
+                started = time.perf_counter()
+                async with self.client.stream(
+                    'POST',
+                    f"{TTS_URL}/stream",
+                    params={'output_format': output_format},
+                    headers={'xi-api-key': ELEVENLABS_API_KEY},
+                    json=_tts_payload(text)
+                ) as response:
+                    if not response.is_success:
+                        error_text = (await response.aread()).decode(errors='replace')
+                        raise Exception(f"ElevenLabs TTS Error: {response.status_code} {error_text}")
+                    span.add_bytes(sent=len(text.encode()))
+                    async for chunk in response.aiter_bytes():
+                        if started is not None:
+                            observe_stage('tts_stream_first_audio', time.perf_counter() - started)
+                            started = None
+                        span.add_bytes(received=len(chunk))
+                        yield chunk
+
+    async def text_to_speech_batch(self, texts: List[str]) -> List[bytes]:
+        """Synthesize several texts concurrently, returning audio in the same order as texts"""
+        return list(await asyncio.gather(*(self.text_to_speech(text) for text in texts)))
 
 elevenlabs_service = ElevenLabsService()
+async_elevenlabs_service = AsyncElevenLabsService()
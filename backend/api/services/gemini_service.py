@@ -1,100 +1,316 @@
 import os
-from typing import Dict, Any, Optional
+import json
+import time
+import asyncio
+from datetime import date
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Any, List, Optional
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
 from dotenv import load_dotenv
-from .nessie_service import NessieBankService
+from .nessie_service import AsyncNessieBankService, async_nessie_service
+from .intent_router import Intent, IntentRouter, INTENT_ROUTER_ENABLED, intent_router
+from .session_store import CallSession
+from .response_cache import (ResponseCache, GENERIC_SCOPE, RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_TTL_SECONDS,
+                             RESPONSE_CACHE_ACCOUNT_TTL_SECONDS, account_scope, response_cache)
+from api.utils.transaction_summary import transactions_for_prompt, merchant_names
+from api.utils.metrics import track
 
 load_dotenv()
 
 # Configure the Gemini API
 genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+# 'google' for the real API; 'fake' for the in-process stand-in in standins/ (the default with STANDINS_URL)
+GEMINI_BACKEND = os.getenv('GEMINI_BACKEND', 'fake' if os.getenv('STANDINS_URL') else 'google')
+
+# Number of most recent user/model exchanges each chat keeps besides the system instruction
+GEMINI_HISTORY_TURNS = int(os.getenv('GEMINI_HISTORY_TURNS', '6'))
+# Chats unused for this long are dropped from the pool
+GEMINI_CHAT_IDLE_SECONDS = int(os.getenv('GEMINI_CHAT_IDLE_SECONDS', '900'))
+# Upper bound on concurrently pooled chats; the least recently used is dropped beyond it
+GEMINI_MAX_CHATS = int(os.getenv('GEMINI_MAX_CHATS', '500'))
+# Recent transactions summarized for Gemini, either in every message or when it asks for them
+RECENT_TRANSACTION_COUNT = int(os.getenv('GEMINI_TRANSACTION_COUNT', '100'))
+# Let Gemini fetch account data through function calls instead of sending it with every message
+GEMINI_FUNCTION_CALLING = os.getenv('GEMINI_FUNCTION_CALLING', 'true').lower() in ('1', 'true', 'yes')
+# Most rounds of function calls answered for one caller message
+GEMINI_MAX_TOOL_ROUNDS = int(os.getenv('GEMINI_MAX_TOOL_ROUNDS', '4'))
+# Stream replies from Gemini so speech can start with the first sentence
+GEMINI_STREAMING = os.getenv('GEMINI_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+# Most individual transactions listed in a get_recent_transactions result
+TOOL_MAX_LISTED_TRANSACTIONS = 25
 
 SYSTEM_INSTRUCTION = """You are a helpful and professional banking assistant for 'Nessie Bank'.
 - Your primary goal is to help users by calling the available functions based on their requests.
-- When you need information like an account ID, ask the user for it clearly.
-- CRITICAL: User account IDs are numbers, but they may speak them as words (e.g., "one two three four"). You MUST convert these words to digits.
-- CRITICAL: The banking system requires account IDs to have the prefix 'acc-'. After converting words to digits, you must prepend 'acc-' to the ID before calling any function.
+- The caller has already been verified. Functions always act on the caller's own account, so never ask for their account ID.
+- For a transfer, ask for the destination account ID and the amount, and confirm both with the caller before calling transfer_funds.
+- CRITICAL: Account IDs may be spoken as words (e.g., "one two three four"). You MUST convert these words to digits.
 - Be concise and clear in your responses."""
 
-class GeminiService:
-    def __init__(self):
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
-        self.nessie_service = NessieBankService()
-        self.chat = None
-        self.start_chat()
+# Functions Gemini may call. They are bound to the caller's account, so none of them takes the caller's account ID.
+BANKING_TOOLS = [{
+    'function_declarations': [
+        {
+            'name': 'get_account_balance',
+            'description': "Get the caller's current account balance and account nickname."
+        },
+        {
+            'name': 'get_recent_transactions',
+            'description': "Get a spending summary of the caller's recent purchases (totals by category and merchant, "
+                           "spend over time, unusual charges) and the most recent purchases themselves.",
+            'parameters': {
+                'type_': 'OBJECT',
+                'properties': {
+                    'count': {'type_': 'INTEGER', 'description': 'How many of the most recent purchases to list.'},
+                    'since': {'type_': 'STRING', 'description': 'Only purchases on or after this date (YYYY-MM-DD).'},
+                    'until': {'type_': 'STRING', 'description': 'Only purchases on or before this date (YYYY-MM-DD).'}
+                }
+            }
+        },
+        {
+            'name': 'transfer_funds',
+            'description': "Transfer money from the caller's account to another account. Only call this after the "
+                           "caller has confirmed the destination and amount.",
+            'parameters': {
+                'type_': 'OBJECT',
+                'properties': {
+                    'to_account_id': {'type_': 'STRING', 'description': 'Destination account ID.'},
+                    'amount': {'type_': 'NUMBER', 'description': 'Amount in US dollars.'}
+                },
+                'required': ['to_account_id', 'amount']
+            }
+        }
+    ]
+}]
+
+# Said when a turn fails; the caller can simply ask again
+ERROR_REPLY = "I apologize, but I encountered an error processing your request. Could you please try again?"
+
+# Reply to callers who are done; [HANGUP] ends the call
+GOODBYE_REPLY = "Thank you for calling. Have a great day. Goodbye! [HANGUP]"
+
+# Every chat starts from this history, so the system instruction costs no extra round trip
+SEED_HISTORY = [
+    {'role': 'user', 'parts': [SYSTEM_INSTRUCTION]},
+    {'role': 'model', 'parts': ["Understood. I'm ready to help Nessie Bank customers."]}
+]
+
+class ReplyInterrupted(Exception):
+    """Gemini failed after part of a streamed reply was yielded; that part should not be kept"""
+
+
+class AsyncGeminiService:
+    """
+    Gemini conversations for call sessions, for use from async request handlers.
+    Account data comes from AsyncNessieBankService and Gemini is called with send_message_async.
+    """
+
+    def __init__(self, nessie_service: AsyncNessieBankService = None, intent_router: IntentRouter = None,
+                 response_cache: ResponseCache = None, history_turns: int = GEMINI_HISTORY_TURNS,
+                 idle_seconds: int = GEMINI_CHAT_IDLE_SECONDS, max_chats: int = GEMINI_MAX_CHATS,
+                 function_calling: bool = GEMINI_FUNCTION_CALLING):
+        self.function_calling = function_calling
+        self.model = genai.GenerativeModel('gemini-2.5-flash', tools=BANKING_TOOLS if function_calling else None)
+        if GEMINI_BACKEND == 'fake':
+            # Requests, streaming and chat history still go through genai; only the API calls are faked
+            from standins.fake_gemini import use_fake_gemini
+            use_fake_gemini(self.model)
+        self.nessie_service = nessie_service or AsyncNessieBankService()
+        # Answers simple requests straight from Nessie; None sends everything to Gemini
+        self.intent_router = intent_router
+        # Replays earlier Gemini answers to repeated questions; None disables it
+        self.response_cache = response_cache
+        self.history_turns = history_turns
+        self.idle_seconds = idle_seconds
+        self.max_chats = max_chats
+        # session_id -> (chat, last used); ordered from least to most recently used. A cache of
+        # CallSession.history, which is what survives a call moving to another worker
+        self.chats: "OrderedDict[str, tuple[Any, float]]" = OrderedDict()
+        # session_id -> {(function name, arguments): result}; lives and dies with the session's chat
+        self.tool_results: Dict[str, Dict[tuple, Dict[str, Any]]] = {}
+        self._chats_lock = threading.Lock()
 
     def start_chat(self):
-        """Initialize a new chat session"""
-        self.chat = self.model.start_chat(history=[])
-        # Send system instruction
-        self.chat.send_message(SYSTEM_INSTRUCTION)
+        """Create a new chat seeded with the system instruction"""
+        return self.model.start_chat(history=SEED_HISTORY)
 
-    def run_conversation(self, user_input: str, curr_user_name: str, curr_user_id: str, curr_account_id: str) -> str:
-        """Process user input and return the response"""
+    def get_chat(self, session: CallSession):
+        """
+        Return the chat for a call session. A chat this worker doesn't hold, or one that missed
+        turns another worker answered, is rebuilt from the session's recorded history.
+        """
+        now = time.time()
+        with self._chats_lock:
+            self._expire_idle_chats(now)
+            entry = self.chats.pop(session.call_sid, None)
+            chat = entry[0] if entry and self._in_step(entry[0], session) else self._restore_chat(session)
+            self.chats[session.call_sid] = (chat, now)
+            while len(self.chats) > self.max_chats:
+                evicted_id, _ = self.chats.popitem(last=False)
+                self.tool_results.pop(evicted_id, None)
+            return chat
+
+    def _restore_chat(self, session: CallSession):
+        """A chat holding the session's recorded turns, as text only"""
+        history = [
+            {'role': 'model' if turn['role'] == 'assistant' else 'user', 'parts': [turn['text']]}
+            for turn in session.history if turn.get('text')
+        ]
+        if history:
+            print(f"[Gemini] Rebuilt the chat for session {session.call_sid} from {len(history)} recorded turns")
+        chat = self.model.start_chat(history=SEED_HISTORY + history)
+        self._trim_history(chat)
+        return chat
+
+    @staticmethod
+    def _in_step(chat, session: CallSession) -> bool:
+        """Whether a pooled chat ends with the session's last recorded reply"""
         try:
-            # Send user message and get response
-            transactions = self.nessie_service.get_recent_transactions(curr_account_id, 10)
-            print(f"Recent Transactions for Account {curr_account_id}: {transactions}")
-            system_prompt = """
-            System prompt: Please analyse the following recent transactions for the user and predict
-            to their spending habits, categorizing expenses and identifying any unusual activity. 
-            Please respond in 3 sentences.
-            """
-
-            # Give them advice on managing their finances based on these transactions.
-            # Question 1: please analyze my recent trasnactions from the past month
-            # Question 2: do you have any budgeting tips for me (maybe some category).
-            
-            print("Message sent to Gemini")
-            print(system_prompt + " User Input: " + user_input + f" (User: {curr_user_name}, UserID: {curr_user_id}, AccountID: {curr_account_id}), Recent Transactions: {transactions}")
-            response = self.chat.send_message(system_prompt + " User Input: " + user_input + f" (User: {curr_user_name}, UserID: {curr_user_id}, AccountID: {curr_account_id}), Recent Transactions: {transactions}")
-            
-
-            # Check if we need to call any banking functions
-            # This is a simplified version - in practice, you'd need to implement
-            # function calling based on the response content
-            
-            # For now, we'll use basic keyword matching
-            response_text = response.text.lower()
-            
-            
-            
-            # if 'balance' in response_text:
-            #     # Extract account ID from response
-            #     # This is a simplified example - you'd need more robust parsing
-            #     account_id = self._extract_account_id(response_text)
-            #     if account_id:
-            #         balance_info = self.nessie_service.get_account_balance(account_id)
-            #         return self._format_balance_response(balance_info)
-                    
-            # elif 'transfer' in response_text:
-            #     # Handle transfer logic
-            #     # This is a simplified example
-            #     from_account, to_account, amount = self._extract_transfer_details(response_text)
-            #     if all([from_account, to_account, amount]):
-            #         transfer_result = self.nessie_service.transfer_funds(
-            #             from_account, to_account, float(amount)
-            #         )
-            #         return self._format_transfer_response(transfer_result)
-            
-            return response_text
+            history = chat.history
+        except Exception:
+            return False
+        for content in reversed(history[len(SEED_HISTORY):]):
+            if getattr(content, 'role', None) == 'model':
+                text = ''.join(getattr(part, 'text', '') for part in content.parts)
+                if text:
+                    return text == session.last_reply()
+        return session.last_reply() is None
 
-        except Exception as e:
-            print(f"Error in conversation: {str(e)}")
-            return "I apologize, but I encountered an error processing your request. Could you please try again?"
+    def end_chat(self, session_id: str):
+        """Drop a session's chat, e.g. when the call hangs up"""
+        with self._chats_lock:
+            self.chats.pop(session_id, None)
+            self.tool_results.pop(session_id, None)
+
+    def _rewind_chat(self, session_id: str, history: list):
+        """
+        Replace a chat left inconsistent by a failed turn (e.g. a broken stream, after which every
+        history access raises) with one holding only the turns before it.
+        """
+        with self._chats_lock:
+            if session_id in self.chats:
+                self.chats[session_id] = (self.model.start_chat(history=history), time.time())
 
-    def _extract_account_id(self, text: str) -> Optional[str]:
-        """Extract account ID from text - simplified example"""
-        # This would need more sophisticated parsing in practice
-        import re
-        match = re.search(r'acc-(\d+)', text)
-        return match.group(0) if match else None
+    def _expire_idle_chats(self, now: float):
+        """Drop chats idle for longer than idle_seconds. Caller holds the lock."""
+        while self.chats:
+            oldest_id, (_, last_used) = next(iter(self.chats.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            del self.chats[oldest_id]
+            self.tool_results.pop(oldest_id, None)
 
-    def _extract_transfer_details(self, text: str) -> tuple[Optional[str], Optional[str], Optional[float]]:
-        """Extract transfer details from text - simplified example"""
-        # This would need more sophisticated parsing in practice
-        # Returns (from_account, to_account, amount)
-        return None, None, None
+    def record_exchange(self, session: CallSession, user_input: str, reply: str):
+        """
+        Add a turn answered without Gemini to the session's chat, so later turns keep its context.
+        Such replies (intent answers, cached answers) may carry account data.
+        """
+        chat = self.get_chat(session)
+        session.has_account_data = True
+        chat.history = list(chat.history) + [
+            {'role': 'user', 'parts': [user_input]},
+            {'role': 'model', 'parts': [reply]}
+        ]
+        self._trim_history(chat)
+
+    def _trim_history(self, chat):
+        """Keep the seed plus the last history_turns exchanges so prompt size stays flat per turn"""
+        seed_length = len(SEED_HISTORY)
+        window = 2 * self.history_turns
+        history = chat.history
+        if len(history) > seed_length + window:
+            tail = history[-window:] if window else []
+            # Never start the window inside a function call exchange
+            while tail and not self._starts_exchange(tail[0]):
+                tail = tail[1:]
+            chat.history = history[:seed_length] + tail
+
+    @staticmethod
+    def _starts_exchange(content) -> bool:
+        role = getattr(content, 'role', None)
+        if role is None:
+            return True
+        return role == 'user' and not any('function_response' in part for part in content.parts)
+
+    @staticmethod
+    def _function_calls(response) -> List[Any]:
+        """Function calls requested in a Gemini response, in order"""
+        try:
+            parts = response.candidates[0].content.parts
+        except (AttributeError, IndexError):
+            return []
+        return [part.function_call for part in parts if 'function_call' in part]
+
+    @staticmethod
+    def _function_responses(calls: List[Any], results: List[Dict[str, Any]]):
+        """One message answering every function call of a round"""
+        return glm.Content(role='user', parts=[
+            glm.Part(function_response=glm.FunctionResponse(name=call.name, response=result))
+            for call, result in zip(calls, results)
+        ])
+
+    @staticmethod
+    def _tool_key(call) -> tuple:
+        args = dict(call.args)
+        return call.name, json.dumps(args, sort_keys=True, default=str)
+
+    def _cached_tool_result(self, session_id: str, key: tuple) -> Optional[Dict[str, Any]]:
+        with self._chats_lock:
+            return self.tool_results.get(session_id, {}).get(key)
+
+    def _store_tool_result(self, session_id: str, key: tuple, result: Dict[str, Any]):
+        """Cache a successful read for the rest of the session; a transfer makes every cached read stale"""
+        with self._chats_lock:
+            if key[0] == 'transfer_funds':
+                if result.get('success'):
+                    self.tool_results.pop(session_id, None)
+            elif result.get('success'):
+                self.tool_results.setdefault(session_id, {})[key] = result
+
+    @staticmethod
+    def _transactions_tool_result(result: Dict[str, Any], count: int) -> Dict[str, Any]:
+        if not result.get('success'):
+            return {'success': False, 'error': result.get('error', 'Unknown error')}
+        listed = result['transactions'][:max(0, min(count, TOOL_MAX_LISTED_TRANSACTIONS))]
+        return {
+            'success': True,
+            'summary': transactions_for_prompt(result),
+            'transactions': [
+                {
+                    'date': t['date'],
+                    'merchant': merchant_names.get(t.get('merchantId')) or t['description'],
+                    'amount': -t['amount']
+                }
+                for t in listed
+            ]
+        }
+
+    @staticmethod
+    def _build_message(user_input: str, curr_user_name: str, curr_user_id: str, curr_account_id: str,
+                       transactions: Optional[Dict[str, Any]]) -> str:
+        """
+        Combine the analysis instructions, the caller's words and their account data into one message.
+        Without account data, Gemini is told to fetch what it needs through function calls.
+        """
+        if transactions is None:
+            system_prompt = """
+        System prompt: Use the banking functions to look up the caller's balance or transactions, or to
+        make a transfer, only when their request needs it. When they ask about their spending, categorize
+        expenses and point out any unusual activity. Please respond in 3 sentences.
+        """
+            return system_prompt + " User Input: " + user_input + f" (User: {curr_user_name}, UserID: {curr_user_id})"
+
+        system_prompt = """
+        System prompt: Please analyse the following recent transactions for the user and predict
+        to their spending habits, categorizing expenses and identifying any unusual activity. 
+        Please respond in 3 sentences.
+        """
+
+        # Give them advice on managing their finances based on these transactions.
+        # Question 1: please analyze my recent trasnactions from the past month
+        # Question 2: do you have any budgeting tips for me (maybe some category).
+        return system_prompt + " User Input: " + user_input + f" (User: {curr_user_name}, UserID: {curr_user_id}, AccountID: {curr_account_id}), Recent Transactions:\n{transactions_for_prompt(transactions)}"
 
     def _format_balance_response(self, balance_info: Dict[str, Any]) -> str:
         """Format balance information into a response"""
@@ -102,10 +318,254 @@ class GeminiService:
             return f"Your account balance is ${balance_info['balance']:.2f}"
         return "I'm sorry, I couldn't retrieve your balance at this time."
 
-    def _format_transfer_response(self, transfer_result: Dict[str, Any]) -> str:
-        """Format transfer result into a response"""
-        if transfer_result.get('success'):
-            return "The transfer was completed successfully."
-        return f"I'm sorry, the transfer couldn't be completed: {transfer_result.get('error', 'Unknown error')}"
+    def _format_transactions_response(self, transactions: List[Dict[str, Any]]) -> str:
+        """Format recent transactions, newest first, into a spoken response"""
+        if not transactions:
+            return "I don't see any recent purchases on your account."
+        spoken = []
+        for transaction in transactions:
+            merchant = merchant_names.get(transaction.get('merchantId')) or transaction.get('description', 'a merchant')
+            item = f"${-transaction['amount']:.2f} at {merchant}"
+            try:
+                day = date.fromisoformat(transaction['date'][:10])
+                item += f" on {day:%B} {day.day}"
+            except (KeyError, TypeError, ValueError):
+                pass
+            spoken.append(item)
+        if len(spoken) == 1:
+            return f"Your last purchase was {spoken[0]}."
+        return f"Your last {len(spoken)} purchases were {', '.join(spoken[:-1])}, and {spoken[-1]}."
+
+    async def fetch_account_data(self, account_id: str) -> Dict[str, Any]:
+        """
+        Fetch the account data a turn needs. It doesn't depend on what the caller said,
+        so handlers can start it before the transcript is ready and pass it to run_conversation.
+        """
+        try:
+            return await self.nessie_service.get_recent_transactions(account_id, RECENT_TRANSACTION_COUNT)
+        except Exception as e:
+            print(f"Error fetching account data: {str(e)}")
+            return {'success': False, 'error': str(e)}
+
+    async def run_conversation(self, user_input: str, session: CallSession,
+                               transactions: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Process user input within a call session's chat and return the response. The session
+        is updated in place; the caller saves it along with the turn.
+        """
+        history = None
+        try:
+            reply, cache_scopes, transactions = await self._answer_without_gemini(user_input, session, transactions)
+            if reply is not None:
+                return reply
+
+            chat, message = await self._gemini_request(user_input, session, transactions)
+            history = list(chat.history)
+            with track('gemini'):
+                response = await chat.send_message_async(message)
+            tools_used = set()
+            for _ in range(GEMINI_MAX_TOOL_ROUNDS):
+                calls = self._function_calls(response)
+                if not calls:
+                    break
+                results = await self._run_tools(session, calls, tools_used)
+                with track('gemini'):
+                    response = await chat.send_message_async(self._function_responses(calls, results))
+            # Keep the original case so control tokens like [HANGUP] survive
+            response_text = response.text
+            if cache_scopes is not None:
+                self._cache_reply(user_input, session, cache_scopes, tools_used, response_text)
+            return response_text
+
+        except Exception as e:
+            print(f"Error in conversation: {str(e)}")
+            if history is not None:
+                self._rewind_chat(session.call_sid, history)
+            return ERROR_REPLY
+
+    async def stream_conversation(self, user_input: str, session: CallSession,
+                                  transactions: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Like run_conversation, but yields the reply in pieces as Gemini generates it, so speech
+        can start before the answer is complete. Pieces are raw text and may split words or the
+        [HANGUP] token; replies answered without Gemini arrive as a single piece. If Gemini fails
+        before anything was yielded the apology is yielded instead; after that, ReplyInterrupted
+        is raised so the caller can drop what it has not spoken yet. Either way the chat is
+        rewound to before the turn.
+        """
+        history = None
+        pieces = []
+        try:
+            reply, cache_scopes, transactions = await self._answer_without_gemini(user_input, session, transactions)
+            if reply is not None:
+                yield reply
+                return
+
+            chat, message = await self._gemini_request(user_input, session, transactions)
+            history = list(chat.history)
+            tools_used = set()
+            for round_number in range(GEMINI_MAX_TOOL_ROUNDS + 1):
+                # Streamed requests return with the first chunk, so this is Gemini's time to first token
+                with track('gemini_stream'):
+                    response = await chat.send_message_async(message, stream=True)
+                async for chunk in response:
+                    text = self._chunk_text(chunk)
+                    if text:
+                        pieces.append(text)
+                        yield text
+                calls = self._function_calls(response)
+                if not calls or round_number == GEMINI_MAX_TOOL_ROUNDS:
+                    break
+                results = await self._run_tools(session, calls, tools_used)
+                message = self._function_responses(calls, results)
+            if cache_scopes is not None:
+                self._cache_reply(user_input, session, cache_scopes, tools_used, ''.join(pieces))
+
+        except Exception as e:
+            print(f"Error in conversation: {str(e)}")
+            if history is not None:
+                self._rewind_chat(session.call_sid, history)
+            if pieces:
+                raise ReplyInterrupted(str(e)) from e
+            yield ERROR_REPLY
+
+    async def _answer_without_gemini(self, user_input: str, session: CallSession,
+                                     transactions: Optional[Dict[str, Any]]) -> tuple:
+        """
+        Answer from the intent router or the response cache if possible. Returns the reply (None
+        if Gemini is needed), the cache scopes to store Gemini's answer under, and the account data.
+        """
+        if self.intent_router is not None:
+            reply = await self._answer_locally(user_input, session, transactions)
+            if reply is not None:
+                return reply, None, transactions
+
+        cache_scopes = None
+        if self.response_cache is not None and self.response_cache.cacheable(user_input):
+            if transactions is None:
+                transactions = await self.fetch_account_data(session.account_id)
+            cache_scopes = await self._cache_scopes(session.account_id, transactions)
+            reply = self.response_cache.get(user_input, cache_scopes)
+            if reply is not None:
+                print(f"[Cache] Answered session {session.call_sid} from the response cache")
+                self.record_exchange(session, user_input, reply)
+                return reply, None, transactions
+        return None, cache_scopes, transactions
+
+    async def _gemini_request(self, user_input: str, session: CallSession,
+                              transactions: Optional[Dict[str, Any]]) -> tuple:
+        """The session's chat and the message to send it"""
+        chat = self.get_chat(session)
+        self._trim_history(chat)
+        if self.function_calling:
+            # Gemini asks for account data itself; anything prefetched is already in the account cache
+            transactions = None
+        elif transactions is None:
+            transactions = await self.fetch_account_data(session.account_id)
+        if transactions is not None:
+            session.has_account_data = True
+        message = self._build_message(user_input, session.user_name, session.user_id, session.account_id, transactions)
+        print(f"Message sent to Gemini for session {session.call_sid}")
+        return chat, message
+
+    async def _run_tools(self, session: CallSession, calls: List[Any], tools_used: set) -> List[Dict[str, Any]]:
+        """Run one round of function calls. Calls requested in the same response are independent, so they run concurrently."""
+        print(f"[Gemini] Session {session.call_sid} called {', '.join(call.name for call in calls)}")
+        tools_used.update(call.name for call in calls)
+        # Tool results become part of the chat, and so of every later answer in it
+        session.has_account_data = True
+        return list(await asyncio.gather(*(self._run_tool(session.call_sid, session.account_id, call) for call in calls)))
+
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        """Text of one streamed chunk, skipping function call parts"""
+        try:
+            parts = chunk.candidates[0].content.parts
+        except (AttributeError, IndexError):
+            return ''
+        return ''.join(part.text for part in parts if 'text' in part)
+
+    async def _run_tool(self, session_id: str, account_id: str, call) -> Dict[str, Any]:
+        """Execute one function call against the caller's account"""
+        key = self._tool_key(call)
+        cached = self._cached_tool_result(session_id, key)
+        if cached is not None:
+            return cached
+        args = dict(call.args)
+        try:
+            if call.name == 'get_account_balance':
+                result = await self.nessie_service.get_account_balance(account_id)
+            elif call.name == 'get_recent_transactions':
+                data = await self.nessie_service.get_recent_transactions(
+                    account_id, RECENT_TRANSACTION_COUNT, args.get('since'), args.get('until'))
+                result = self._transactions_tool_result(data, int(args.get('count') or 5))
+            elif call.name == 'transfer_funds':
+                result = await self.nessie_service.transfer_funds(account_id, str(args['to_account_id']), float(args['amount']))
+            else:
+                result = {'success': False, 'error': f"Unknown function: {call.name}"}
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        self._store_tool_result(session_id, key, result)
+        if call.name == 'transfer_funds' and result.get('success') and self.response_cache is not None:
+            self.response_cache.invalidate_account(account_id)
+            self.response_cache.invalidate_account(str(args['to_account_id']))
+        return result
+
+    async def _cache_scopes(self, account_id: str, transactions: Dict[str, Any]) -> List[str]:
+        """
+        Response cache scopes a caller may be answered from: shared generic answers, then their own.
+        Their own scope covers both the purchases and the balance, since answers may quote either.
+        """
+        if not transactions.get('success'):
+            return [GENERIC_SCOPE]
+        balance_info = await self.nessie_service.get_account_balance(account_id)
+        if not balance_info.get('success'):
+            return [GENERIC_SCOPE]
+        account_data = {'purchases': transactions['transactions'], 'balance': balance_info['balance']}
+        return [GENERIC_SCOPE, account_scope(account_id, account_data)]
+
+    def _cache_reply(self, user_input: str, session: CallSession, scopes: List[str], tools_used: set, reply: str):
+        """
+        Store a Gemini answer for repeats of the same question. Answers from a chat that has ever
+        held account data (or may have), or that address the caller by name, are only kept under the
+        caller's own account scope, since Gemini may have drawn on earlier turns without calling a function.
+        """
+        if '[HANGUP]' in reply or 'transfer_funds' in tools_used:
+            return
+        personal = (tools_used or not self.function_calling or session.has_account_data is not False
+                    or (session.user_name and session.user_name.lower() in reply.lower()))
+        if not personal:
+            self.response_cache.put(user_input, GENERIC_SCOPE, reply, RESPONSE_CACHE_TTL_SECONDS)
+        elif len(scopes) > 1:
+            self.response_cache.put(user_input, scopes[1], reply, RESPONSE_CACHE_ACCOUNT_TTL_SECONDS)
+
+    async def _answer_locally(self, user_input: str, session: CallSession,
+                              transactions: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Answer a recognized simple request without Gemini, or return None to fall back to it"""
+        intent = self.intent_router.classify(user_input, session.last_reply())
+        reply = await self._intent_reply(intent, session.account_id, transactions) if intent is not None else None
+        self.intent_router.record(intent if reply is not None else None)
+        if reply is None:
+            return None
+        print(f"[Intent] Answered '{intent.name}' ({intent.source}, {intent.confidence:.2f}) without Gemini")
+        self.record_exchange(session, user_input, reply)
+        return reply
+
+    async def _intent_reply(self, intent: Intent, account_id: str,
+                            transactions: Optional[Dict[str, Any]]) -> Optional[str]:
+        if intent.name == 'balance':
+            balance_info = await self.nessie_service.get_account_balance(account_id)
+            return self._format_balance_response(balance_info) if balance_info.get('success') else None
+        if intent.name == 'recent_purchases':
+            if transactions is None or not transactions.get('success'):
+                transactions = await self.fetch_account_data(account_id)
+            if not transactions.get('success'):
+                return None
+            return self._format_transactions_response(transactions['transactions'][:intent.slots['count']])
+        if intent.name == 'goodbye':
+            return GOODBYE_REPLY
+        return None
 
-gemini_service = GeminiService()
+async_gemini_service = AsyncGeminiService(nessie_service=async_nessie_service,
+                                          intent_router=intent_router if INTENT_ROUTER_ENABLED else None,
+                                          response_cache=response_cache if RESPONSE_CACHE_ENABLED else None)
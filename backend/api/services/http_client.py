@@ -0,0 +1,302 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+def _env(name: str, prefix: str, default: str) -> str:
+    """Read PREFIX_NAME, then HTTP_NAME, then the default."""
+    return os.getenv(f"{prefix}_{name}", os.getenv(f"HTTP_{name}", default))
+
+
+@dataclass
+class HttpClientConfig:
+    """Pooling, timeout and retry settings for one upstream service."""
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    max_connections: int = 50
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 60.0
+    max_retries: int = 2
+    backoff_factor: float = 0.25
+    max_backoff: float = 4.0
+    # POST is only retried for services where repeating a request is harmless (e.g. TTS),
+    # never for ones that move money.
+    retry_post: bool = False
+    retry_statuses: Tuple[int, ...] = RETRY_STATUSES
+
+    @classmethod
+    def from_env(cls, prefix: str, **overrides) -> 'HttpClientConfig':
+        """Build a config from PREFIX_* variables, falling back to HTTP_* and then the defaults."""
+        defaults = cls(**overrides)
+        return cls(
+            connect_timeout=float(_env('CONNECT_TIMEOUT', prefix, str(defaults.connect_timeout))),
+            read_timeout=float(_env('READ_TIMEOUT', prefix, str(defaults.read_timeout))),
+            max_connections=int(_env('MAX_CONNECTIONS', prefix, str(defaults.max_connections))),
+            max_keepalive_connections=int(_env('MAX_KEEPALIVE', prefix, str(defaults.max_keepalive_connections))),
+            keepalive_expiry=float(_env('KEEPALIVE_EXPIRY', prefix, str(defaults.keepalive_expiry))),
+            max_retries=int(_env('MAX_RETRIES', prefix, str(defaults.max_retries))),
+            backoff_factor=float(_env('BACKOFF_FACTOR', prefix, str(defaults.backoff_factor))),
+            max_backoff=defaults.max_backoff,
+            retry_post=defaults.retry_post,
+            retry_statuses=defaults.retry_statuses,
+        )
+
+    def backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Seconds to wait before retry number attempt (0-based), honouring Retry-After."""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        delay = min(self.backoff_factor * (2 ** attempt), self.max_backoff)
+        # Full jitter so many workers retrying at once don't stampede the upstream
+        return random.uniform(0, delay)
+
+
+@dataclass
+class HostStats:
+    requests: int = 0
+    retries: int = 0
+    errors: int = 0
+    in_flight: int = 0
+    total_seconds: float = 0.0
+    statuses: Dict[str, int] = field(default_factory=dict)
+
+    def record_status(self, status_code: int):
+        status_class = f"{status_code // 100}xx"
+        self.statuses[status_class] = self.statuses.get(status_class, 0) + 1
+
+
+class PoolStats:
+    """Per-host request counters shared by a client's sync and async paths."""
+
+    def __init__(self):
+        self._hosts: Dict[str, HostStats] = {}
+        self._lock = threading.Lock()
+
+    def host(self, host: str) -> HostStats:
+        with self._lock:
+            return self._hosts.setdefault(host, HostStats())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                host: {
+                    'requests': stats.requests,
+                    'retries': stats.retries,
+                    'errors': stats.errors,
+                    'in_flight': stats.in_flight,
+                    'avg_seconds': round(stats.total_seconds / stats.requests, 4) if stats.requests else 0.0,
+                    'statuses': dict(stats.statuses),
+                }
+                for host, stats in self._hosts.items()
+            }
+
+
+class RetryingAsyncTransport(httpx.AsyncBaseTransport):
+    """
+    Pooled keep-alive transport that retries transient failures with backoff and
+    records per-host statistics.
+
+    Connection failures are always safe to retry because nothing reached the
+    server. Retryable status codes are only retried for idempotent methods, or
+    POST when the config allows it.
+    """
+
+    def __init__(self, config: HttpClientConfig, stats: PoolStats):
+        self.config = config
+        self.stats = stats
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            )
+        )
+
+    def _may_retry_status(self, request: httpx.Request) -> bool:
+        return request.method in IDEMPOTENT_METHODS or (request.method == 'POST' and self.config.retry_post)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = self.stats.host(request.url.host)
+        host.in_flight += 1
+        started = time.perf_counter()
+        try:
+            attempt = 0
+            while True:
+                host.requests += 1
+                try:
+                    response = await self._transport.handle_async_request(request)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                    if attempt >= self.config.max_retries:
+                        host.errors += 1
+                        raise
+                else:
+                    host.record_status(response.status_code)
+                    if (response.status_code not in self.config.retry_statuses
+                            or attempt >= self.config.max_retries
+                            or not self._may_retry_status(request)):
+                        if response.status_code >= 500:
+                            host.errors += 1
+                        return response
+                    retry_after = response.headers.get('Retry-After')
+                    await response.aclose()
+                    await asyncio.sleep(self.config.backoff(attempt, retry_after))
+                    attempt += 1
+                    host.retries += 1
+                    continue
+
+                await asyncio.sleep(self.config.backoff(attempt))
+                attempt += 1
+                host.retries += 1
+        finally:
+            host.in_flight -= 1
+            host.total_seconds += time.perf_counter() - started
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+    def open_connections(self) -> int:
+        # httpx exposes no connection count; its transport's private _pool is the httpcore pool, whose
+        # connections list is public. Either may change in a later httpx, so report 0 rather than fail
+        pool = getattr(self._transport, '_pool', None)
+        try:
+            return len(getattr(pool, 'connections', None) or [])
+        except TypeError:
+            return 0
+
+
+class TimeoutSession(requests.Session):
+    """requests.Session that applies a default timeout and records per-host statistics."""
+
+    def __init__(self, config: HttpClientConfig, stats: PoolStats):
+        super().__init__()
+        self.config = config
+        self.stats = stats
+        allowed_methods = IDEMPOTENT_METHODS | ({'POST'} if config.retry_post else set())
+        adapter = HTTPAdapter(
+            pool_connections=config.max_keepalive_connections,
+            pool_maxsize=config.max_connections,
+            max_retries=Retry(
+                total=config.max_retries,
+                connect=config.max_retries,
+                status=config.max_retries,
+                backoff_factor=config.backoff_factor,
+                status_forcelist=config.retry_statuses,
+                allowed_methods=allowed_methods,
+                raise_on_status=False,
+                respect_retry_after_header=True,
+            ),
+        )
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (self.config.connect_timeout, self.config.read_timeout))
+        host = self.stats.host(requests.utils.urlparse(url).hostname or '')
+        host.in_flight += 1
+        host.requests += 1
+        started = time.perf_counter()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            host.errors += 1
+            raise
+        finally:
+            host.in_flight -= 1
+            host.total_seconds += time.perf_counter() - started
+        host.record_status(response.status_code)
+        if response.status_code >= 500:
+            host.errors += 1
+        return response
+
+
+class HttpClientRegistry:
+    """
+    One pooled client per upstream service, created on first use.
+
+    Services take an optional client/session in their constructor and fall back
+    to the registry, so tests and stand-ins can inject their own.
+    """
+
+    def __init__(self):
+        self._configs: Dict[str, HttpClientConfig] = {}
+        self._stats: Dict[str, PoolStats] = {}
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._sessions: Dict[str, TimeoutSession] = {}
+        self._lock = threading.Lock()
+
+    def _setup(self, name: str, config: Optional[HttpClientConfig], **config_overrides) -> Tuple[HttpClientConfig, PoolStats]:
+        if name not in self._configs:
+            self._configs[name] = config or HttpClientConfig.from_env(name.upper(), **config_overrides)
+            self._stats[name] = PoolStats()
+        return self._configs[name], self._stats[name]
+
+    def async_client(self, name: str, config: HttpClientConfig = None, retry_post: bool = False,
+                     **client_kwargs) -> httpx.AsyncClient:
+        """Pooled async client for a service. Extra kwargs (auth, headers, ...) go to httpx."""
+        with self._lock:
+            client = self._async_clients.get(name)
+            if client is None or client.is_closed:
+                config, stats = self._setup(name, config, retry_post=retry_post)
+                client = httpx.AsyncClient(
+                    transport=RetryingAsyncTransport(config, stats),
+                    timeout=httpx.Timeout(config.read_timeout, connect=config.connect_timeout),
+                    **client_kwargs
+                )
+                self._async_clients[name] = client
+            return client
+
+    def session(self, name: str, config: HttpClientConfig = None, retry_post: bool = False) -> requests.Session:
+        """Pooled keep-alive requests.Session for a service."""
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is None:
+                config, stats = self._setup(name, config, retry_post=retry_post)
+                session = TimeoutSession(config, stats)
+                self._sessions[name] = session
+            return session
+
+    def stats(self) -> Dict[str, Any]:
+        """Configuration, open connections and per-host counters for every client."""
+        with self._lock:
+            report = {}
+            for name, config in self._configs.items():
+                client = self._async_clients.get(name)
+                transport = getattr(client, '_transport', None) if client else None
+                report[name] = {
+                    'max_connections': config.max_connections,
+                    'max_keepalive_connections': config.max_keepalive_connections,
+                    'open_connections': transport.open_connections() if isinstance(transport, RetryingAsyncTransport) else 0,
+                    'hosts': self._stats[name].snapshot(),
+                }
+            return report
+
+    async def aclose(self):
+        """Close every pooled client, e.g. on application shutdown."""
+        with self._lock:
+            clients = list(self._async_clients.values())
+            sessions = list(self._sessions.values())
+            self._async_clients.clear()
+            self._sessions.clear()
+        for client in clients:
+            await client.aclose()
+        for session in sessions:
+            session.close()
+
+
+http_clients = HttpClientRegistry()
@@ -0,0 +1,204 @@
+import os
+import re
+import math
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Set to false to send every turn to Gemini
+INTENT_ROUTER_ENABLED = os.getenv('INTENT_ROUTER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Enables the bag-of-words model for utterances the rules don't recognize
+INTENT_MODEL_ENABLED = os.getenv('INTENT_MODEL_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Intents below this confidence go to Gemini
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv('INTENT_CONFIDENCE_THRESHOLD', '0.85'))
+# Purchases read out when the caller doesn't say how many, and the most we read at once
+INTENT_DEFAULT_PURCHASES = 5
+INTENT_MAX_PURCHASES = 10
+
+NUMBER_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+    'a couple': 2, 'a few': 3,
+}
+
+# Each rule is matched against the normalized utterance (lowercase, punctuation replaced by spaces)
+INTENT_RULES = {
+    'balance': [
+        r'\bbalance\b',
+        r'\bhow much (money )?(do i have|have i got|is (there )?in my (account|checking|savings))\b',
+    ],
+    'recent_purchases': [
+        r'\b(last|latest|recent|most recent)\b( \w+){0,3} (purchases?|transactions?|charges?)\b',
+        r'\bwhat did i (buy|spend money on) (recently|lately)$',
+    ],
+    'goodbye': [
+        r'^((no|nope|nah) )?(that s all|that s it|that is all|nothing else|i m done|i m good)( thanks| thank you)*( bye| goodbye)?$',
+        r'^((no|nope|nah) )?(ok |okay )?(thanks |thank you )?(bye|goodbye|good bye)( now)?$',
+    ],
+}
+# A bare "no" answers whatever was asked last. It only ends the call when the open question is
+# "anything else?"; after a question of the assistant's own ("shall I transfer $50?") it goes to Gemini.
+DECLINE_PATTERN = r'^(no|nope|nah)( thanks| thank you| i m good| i m fine)*$'
+# Anything that mentions these needs more than a canned answer
+INTENT_BLOCKLIST = r'\b(transfer|send|pay|move|why|should|advice|tips?|budget|save|saving|habits?|unusual|categor\w*)\b'
+
+# Examples the optional model is trained on; 'other' covers requests that need Gemini
+INTENT_EXAMPLES = {
+    'balance': [
+        "what's my balance", "how much money do i have", "check my balance", "account balance please",
+        "how much is in my account", "what do i have in checking", "tell me my balance",
+        "how much money is left", "what's left in my account", "current balance",
+    ],
+    'recent_purchases': [
+        "read my last five purchases", "what were my recent transactions", "list my latest charges",
+        "what did i buy recently", "show my recent purchases", "what are my last transactions",
+        "tell me my most recent purchases", "what did i spend money on lately", "recent charges on my card",
+    ],
+    'goodbye': [
+        "no thanks", "that's all", "nothing else", "goodbye", "no that's it thank you", "i'm good thanks bye",
+        "nope", "that is all for today", "no i'm done",
+    ],
+    'other': [
+        "analyze my spending habits", "do you have any budgeting tips", "transfer fifty dollars to savings",
+        "why was i charged twice", "how can i save more money", "what category do i spend the most on",
+        "is there anything unusual in my account", "can you help me with a loan", "what is my interest rate",
+        "give me advice on managing my finances", "send money to my friend", "how do i open a new account",
+    ],
+}
+
+
+def normalize(text: str) -> str:
+    return ' '.join(re.sub(r"[^a-z0-9]+", ' ', text.lower()).split())
+
+
+@dataclass
+class Intent:
+    name: str
+    confidence: float
+    source: str  # 'rule' or 'model'
+    slots: Dict[str, Any] = field(default_factory=dict)
+
+
+class NaiveBayesIntentModel:
+    """Tiny multinomial naive Bayes over words and word pairs. Trains in microseconds from INTENT_EXAMPLES."""
+
+    def __init__(self, examples: Dict[str, List[str]] = None):
+        examples = examples or INTENT_EXAMPLES
+        self.word_counts = {intent: Counter() for intent in examples}
+        self.totals = {}
+        self.priors = {}
+        vocabulary = set()
+        total_examples = sum(len(texts) for texts in examples.values())
+        for intent, texts in examples.items():
+            for text in texts:
+                features = self._features(text)
+                self.word_counts[intent].update(features)
+                vocabulary.update(features)
+            self.totals[intent] = sum(self.word_counts[intent].values())
+            self.priors[intent] = math.log(len(texts) / total_examples)
+        self.vocabulary_size = len(vocabulary)
+
+    @staticmethod
+    def _features(text: str) -> List[str]:
+        words = normalize(text).split()
+        return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """Most likely intent and its posterior probability."""
+        features = self._features(text)
+        scores = {}
+        for intent, counts in self.word_counts.items():
+            denominator = self.totals[intent] + self.vocabulary_size
+            scores[intent] = self.priors[intent] + sum(math.log((counts[f] + 1) / denominator) for f in features)
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / normalizer
+
+
+class IntentRouter:
+    """
+    Recognizes simple banking requests that can be answered from Nessie with a template,
+    so they skip the Gemini round trip. Keyword and pattern rules come first; the optional
+    model only handles what they miss. Everything else falls back to Gemini.
+    """
+
+    def __init__(self, use_model: bool = INTENT_MODEL_ENABLED, threshold: float = INTENT_CONFIDENCE_THRESHOLD):
+        self.rules = {intent: [re.compile(p) for p in patterns] for intent, patterns in INTENT_RULES.items()}
+        self.blocklist = re.compile(INTENT_BLOCKLIST)
+        self.decline = re.compile(DECLINE_PATTERN)
+        self.model = NaiveBayesIntentModel() if use_model else None
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._turns = 0
+        self._bypassed = defaultdict(int)
+
+    @staticmethod
+    def _purchase_count(text: str) -> int:
+        match = re.search(r'\b(\d+)\b', text)
+        if match:
+            count = int(match.group(1))
+        elif re.search(r'\b(purchase|transaction|charge)\b', text):
+            # "my last purchase"
+            count = 1
+        else:
+            count = next((n for word, n in NUMBER_WORDS.items() if re.search(rf'\b{word}\b', text)),
+                         INTENT_DEFAULT_PURCHASES)
+        return max(1, min(count, INTENT_MAX_PURCHASES))
+
+    def classify(self, text: str, previous_reply: Optional[str] = None) -> Optional[Intent]:
+        """
+        Return a confident intent for an utterance, or None if it should go to Gemini. previous_reply
+        is the assistant's last answer; if it asked a question, a bare "no" is an answer to it.
+        """
+        text = normalize(text)
+        if not text or self.blocklist.search(text):
+            return None
+
+        asked_question = bool(previous_reply) and previous_reply.rstrip().endswith('?')
+        if self.decline.search(text):
+            if asked_question:
+                return None
+            matched = ['goodbye']
+        else:
+            matched = [intent for intent, patterns in self.rules.items() if any(p.search(text) for p in patterns)]
+        if len(matched) == 1:
+            intent = Intent(matched[0], 0.95, 'rule')
+        elif not matched and self.model is not None:
+            name, confidence = self.model.predict(text)
+            if name == 'other' or (name == 'goodbye' and asked_question):
+                return None
+            intent = Intent(name, confidence, 'model')
+        else:
+            # Nothing recognized, or several intents at once
+            return None
+
+        if intent.confidence < self.threshold:
+            return None
+        if intent.name == 'recent_purchases':
+            intent.slots['count'] = self._purchase_count(text)
+        return intent
+
+    def record(self, intent: Optional[Intent]):
+        """Count a turn, and whether it was answered without Gemini."""
+        with self._lock:
+            self._turns += 1
+            if intent is not None:
+                self._bypassed[intent.name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            bypassed = sum(self._bypassed.values())
+            return {
+                'turns': self._turns,
+                'bypassed': bypassed,
+                'bypass_rate': bypassed / self._turns if self._turns else 0.0,
+                'by_intent': dict(self._bypassed),
+                'model_enabled': self.model is not None,
+            }
+
+
+intent_router = IntentRouter()
@@ -0,0 +1,137 @@
+import os
+import json
+import base64
+import asyncio
+import itertools
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+from dotenv import load_dotenv
+from api.utils.audio_codec import PcmToUlawConverter
+
+load_dotenv()
+
+# ElevenLabs output format requested for streamed replies. ulaw_8000 is what Twilio plays natively;
+# pcm_8000/pcm_16000/... are converted to 8 kHz mu-law here.
+MEDIA_STREAM_TTS_FORMAT = os.getenv('MEDIA_STREAM_TTS_FORMAT', 'ulaw_8000')
+# Bytes of 8 kHz mu-law per media message (160 bytes = 20 ms, Twilio's own frame size)
+MEDIA_FRAME_BYTES = int(os.getenv('MEDIA_FRAME_BYTES', '160'))
+
+
+class MediaStreamSession:
+    """
+    One bidirectional Twilio Media Stream (<Connect><Stream>) over a WebSocket.
+
+    Works with any socket object exposing async receive_text/send_text, so it runs
+    against Starlette's WebSocket in production and a local fake peer in tests.
+    Replies are streamed from ElevenLabs and forwarded as 8 kHz mu-law media
+    messages as soon as each chunk arrives, instead of waiting for a whole file.
+    """
+
+    def __init__(self, websocket, tts_service, output_format: str = MEDIA_STREAM_TTS_FORMAT,
+                 frame_bytes: int = MEDIA_FRAME_BYTES):
+        self.websocket = websocket
+        self.tts_service = tts_service
+        self.output_format = output_format
+        self.frame_bytes = frame_bytes
+        self.stream_sid: Optional[str] = None
+        self.call_sid: Optional[str] = None
+        self.parameters: Dict[str, str] = {}
+        # Called with each decoded chunk of caller audio (8 kHz mu-law)
+        self.on_media: Optional[Callable[[bytes], Awaitable[None]]] = None
+        self.stopped = asyncio.Event()
+        self._marks: Dict[str, asyncio.Event] = {}
+        self._mark_ids = itertools.count(1)
+
+    async def wait_for_start(self):
+        """Read protocol messages until Twilio's 'start' event identifies the call."""
+        while True:
+            message = json.loads(await self.websocket.receive_text())
+            event = message.get('event')
+            if event == 'start':
+                start = message['start']
+                self.stream_sid = message.get('streamSid') or start.get('streamSid')
+                self.call_sid = start.get('callSid')
+                self.parameters = start.get('customParameters') or {}
+                return
+            if event == 'stop':
+                self.stopped.set()
+                raise ConnectionError("Media stream stopped before it started")
+
+    async def receive_loop(self):
+        """Dispatch incoming caller audio, mark acknowledgements and the stop event."""
+        try:
+            while not self.stopped.is_set():
+                message = json.loads(await self.websocket.receive_text())
+                event = message.get('event')
+                if event == 'media':
+                    if self.on_media is not None:
+                        await self.on_media(base64.b64decode(message['media']['payload']))
+                elif event == 'mark':
+                    mark = self._marks.get(message.get('mark', {}).get('name'))
+                    if mark is not None:
+                        mark.set()
+                elif event == 'stop':
+                    break
+        finally:
+            self.stopped.set()
+
+    async def _send(self, message: dict):
+        await self.websocket.send_text(json.dumps(message))
+
+    async def send_audio(self, chunks: AsyncIterator[bytes]) -> int:
+        """Forward audio to the caller in fixed-size frames. Returns the number of bytes sent."""
+        converter = None
+        if self.output_format.startswith('pcm_'):
+            converter = PcmToUlawConverter(int(self.output_format.split('_')[1]))
+        elif not self.output_format.startswith('ulaw_8000'):
+            raise ValueError(f"Media streams need ulaw_8000 or pcm_* audio, not {self.output_format}")
+
+        pending = b''
+        sent = 0
+        async for chunk in chunks:
+            if self.stopped.is_set():
+                break
+            pending += converter.feed(chunk) if converter else chunk
+            while len(pending) >= self.frame_bytes:
+                frame, pending = pending[:self.frame_bytes], pending[self.frame_bytes:]
+                await self._send_frame(frame)
+                sent += len(frame)
+        if pending and not self.stopped.is_set():
+            await self._send_frame(pending)
+            sent += len(pending)
+        return sent
+
+    async def _send_frame(self, frame: bytes):
+        await self._send({
+            'event': 'media',
+            'streamSid': self.stream_sid,
+            'media': {'payload': base64.b64encode(frame).decode('ascii')}
+        })
+
+    async def mark(self) -> str:
+        """Queue a mark after the audio sent so far; Twilio echoes it once that audio has played."""
+        name = f"mark-{next(self._mark_ids)}"
+        self._marks[name] = asyncio.Event()
+        await self._send({'event': 'mark', 'streamSid': self.stream_sid, 'mark': {'name': name}})
+        return name
+
+    async def wait_for_mark(self, name: str, timeout: Optional[float] = None):
+        """Wait until the caller has heard everything up to a mark, or the stream stops."""
+        mark = self._marks[name]
+        waiters = [asyncio.ensure_future(mark.wait()), asyncio.ensure_future(self.stopped.wait())]
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+            self._marks.pop(name, None)
+
+    async def clear(self):
+        """Drop any audio Twilio has buffered but not played yet (e.g. when the caller barges in)."""
+        await self._send({'event': 'clear', 'streamSid': self.stream_sid})
+
+    async def play_text(self, text: str, wait: bool = True) -> int:
+        """Stream synthesized speech for text to the caller. Returns the number of audio bytes sent."""
+        sent = await self.send_audio(self.tts_service.text_to_speech_stream(text, self.output_format))
+        if wait and not self.stopped.is_set():
+            await self.wait_for_mark(await self.mark())
+        return sent
@@ -1,48 +1,133 @@
 import os
-from typing import Dict, Any
+import heapq
+import itertools
+from typing import Dict, Any, List, Optional
+import httpx
 import requests
 from datetime import datetime
 from dotenv import load_dotenv
+from .http_client import http_clients
+from .account_cache import AccountCache, account_cache
+from api.utils.json_stream import JsonArrayParser
+from api.utils.metrics import track
 
 load_dotenv()
 
+# With STANDINS_URL set, requests go to the fake Nessie API in standins/server.py
+STANDINS_URL = os.getenv('STANDINS_URL', '').rstrip('/')
+NESSIE_BASE_URL = os.getenv('NESSIE_BASE_URL', f"{STANDINS_URL}/nessie" if STANDINS_URL else 'http://api.nessieisreal.com')
+# Purchase lists are parsed as they download, this many bytes at a time
+PURCHASE_STREAM_CHUNK_BYTES = 16384
+
+
+class RecentPurchases:
+    """
+    Keeps the `count` most recent purchases (by date, then id) out of a stream of them,
+    optionally limited to a date range and to purchases older than a cursor.
+    Memory stays proportional to `count` however long the account's history is.
+    """
+
+    def __init__(self, count: int, since: Optional[str] = None, until: Optional[str] = None,
+                 cursor: Optional[str] = None):
+        self.count = max(0, count)
+        self.since = since
+        self.until = until
+        self.before = tuple(cursor.split('|', 1)) if cursor else None
+        self.matched = 0
+        self._heap = []
+        self._order = itertools.count()
+
+    @staticmethod
+    def _key(purchase: Dict[str, Any]) -> tuple:
+        return (purchase.get('purchase_date') or '', purchase.get('_id') or '')
+
+    def add(self, purchase: Dict[str, Any]):
+        if not isinstance(purchase, dict):
+            return
+        key = self._key(purchase)
+        # Dates are ISO formatted, so string comparison orders them correctly
+        if (self.since and key[0] < self.since) or (self.until and key[0] > self.until):
+            return
+        if self.before and key >= self.before:
+            return
+        self.matched += 1
+        if not self.count:
+            return
+        entry = (key, next(self._order), purchase)
+        if len(self._heap) < self.count:
+            heapq.heappush(self._heap, entry)
+        elif key > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def result(self) -> Dict[str, Any]:
+        """Selected purchases newest first, plus a cursor for the next (older) page if there is one"""
+        purchases = [purchase for _, _, purchase in sorted(self._heap, reverse=True)]
+        next_cursor = None
+        if purchases and self.matched > len(purchases):
+            next_cursor = '|'.join(self._key(purchases[-1]))
+        return {'success': True, 'data': purchases, 'next_cursor': next_cursor}
+
+
 class NessieBankService:
-    def __init__(self):
+    def __init__(self, session: requests.Session = None, cache: AccountCache = None):
         self.api_key = os.getenv('NESSIE_API_KEY')
-        self.base_url = 'http://api.nessieisreal.com'
+        self.base_url = NESSIE_BASE_URL
+        # Transfers must never be sent twice, so POSTs are not retried
+        self.session = session or http_clients.session('nessie')
+        # Shared by the sync and async services so a transfer through either invalidates both
+        self.cache = cache or account_cache
 
-    def _fetch_nessie(self, endpoint: str, method: str = 'GET', data: Dict = None) -> Dict[str, Any]:
+    def _fetch_nessie(self, endpoint: str, method: str = 'GET', data: Dict = None,
+                      stage: str = 'nessie_account') -> Dict[str, Any]:
         """Helper function for making authenticated API calls"""
         url = f"{self.base_url}{endpoint}?key={self.api_key}"
-        
-        try:
-            if method == 'GET':
-                response = requests.get(url)
-            elif method == 'POST':
-                response = requests.post(url, json=data)
-            else:
-                raise ValueError(f"Unsupported HTTP method: {method}")
-
-            if not response.ok:
-                error_data = response.json()
-                error_message = error_data.get('message', f"API request failed with status {response.status_code}")
-                print(f"[Nessie] Error for endpoint {endpoint}: {error_message}")
-                return {'success': False, 'error': error_message, 'status': response.status_code}
 
-            # Handle 204 No Content
-            if response.status_code == 204:
-                return {'success': True, 'data': {}}
+        with track(stage) as span:
+            try:
+                if method == 'GET':
+                    response = self.session.get(url)
+                elif method == 'POST':
+                    response = self.session.post(url, json=data)
+                else:
+                    raise ValueError(f"Unsupported HTTP method: {method}")
 
-            return {'success': True, 'data': response.json()}
+                span.add_bytes(received=len(response.content))
+                result = self._parse_response(endpoint, response)
 
-        except requests.exceptions.RequestException as e:
-            return {'success': False, 'error': str(e)}
+            except requests.exceptions.RequestException as e:
+                result = {'success': False, 'error': str(e)}
+            span.error = not result['success']
+            return result
 
-    def get_account_balance(self, account_id: str) -> Dict[str, Any]:
-        """Get the balance for a specific account"""
-        print(f"[Nessie] Getting balance for account: {account_id}")
-        result = self._fetch_nessie(f"/accounts/{account_id}")
+    @staticmethod
+    def _parse_response(endpoint: str, response) -> Dict[str, Any]:
+        """
+        Shape a requests or httpx response into the service's result dict. Bodies that aren't
+        JSON (e.g. a proxy's HTML error page) become failed results rather than exceptions.
+        """
+        if response.status_code >= 400:
+            try:
+                error_data = response.json()
+            except ValueError:
+                error_data = None
+            if not isinstance(error_data, dict):
+                error_data = {}
+            error_message = error_data.get('message', f"API request failed with status {response.status_code}")
+            print(f"[Nessie] Error for endpoint {endpoint}: {error_message}")
+            return {'success': False, 'error': error_message, 'status': response.status_code}
+
+        # Handle 204 No Content
+        if response.status_code == 204:
+            return {'success': True, 'data': {}}
+
+        try:
+            return {'success': True, 'data': response.json()}
+        except ValueError as e:
+            print(f"[Nessie] Invalid response for endpoint {endpoint}: {e}")
+            return {'success': False, 'error': f"Invalid response: {e}"}
 
+    @staticmethod
+    def _balance_result(account_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
         if result['success']:
             account = result['data']
             return {
@@ -56,39 +141,36 @@ class NessieBankService:
             error_msg = 'Account not found.' if result.get('status') == 404 else result.get('error')
             return {'success': False, 'error': error_msg}
 
-    def get_recent_transactions(self, account_id: str, count: int = 5) -> Dict[str, Any]:
-        """Get recent transactions for an account"""
-        print(f"[Nessie] Getting {count} recent transactions for account: {account_id}")
-        # result = requests.get(f"{self.base_url}/accounts/{account_id}/purchases?key={self.api_key}")
-        result = requests.get("http://api.nessieisreal.com/accounts/68f42d2a9683f20dd51a02cd/purchases?key=304c4f4ba37b99aca211e38cdbcc8b2a")
-        #result = self._fetch_nessie(f"/accounts/{account_id}/purchases")
-        result = result.json()
-        # print(f"Result: {result}")
-        if result:
-            print("Result is a success")
-            # all_purchases = result['data']
-            transactions = []
-            
-            for p in result:
-                transactions.append({
-                    'id': p['_id'],
-                    'date': p['purchase_date'],
-                    'description': p.get('description', f"Merchant {p['merchant_id']}"),
-                    'amount': -p['amount'],  # Negative for debits
-                    'type': 'debit'
-                })
-            
-            return {'success': True, 'accountId': account_id, 'transactions': transactions}
+    @staticmethod
+    def _to_transactions(purchases: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        transactions = []
+        for p in purchases:
+            transactions.append({
+                'id': p['_id'],
+                'date': p['purchase_date'],
+                'description': p.get('description', f"Merchant {p['merchant_id']}"),
+                'amount': -p['amount'],  # Negative for debits
+                'merchantId': p.get('merchant_id'),
+                'type': 'debit'
+            })
+        return transactions
+
+    @classmethod
+    def _transactions_result(cls, account_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        if result['success']:
+            return {
+                'success': True,
+                'accountId': account_id,
+                'transactions': cls._to_transactions(result['data']),
+                'nextCursor': result.get('next_cursor')
+            }
         else:
-            print("Result is a failure")
             error_msg = 'Account not found.' if result.get('status') == 404 else result.get('error')
             return {'success': False, 'error': error_msg}
 
-    def transfer_funds(self, from_account_id: str, to_account_id: str, amount: float) -> Dict[str, Any]:
-        """Transfer funds between accounts"""
-        print(f"[Nessie] Transferring {amount} from {from_account_id} to {to_account_id}")
-        
-        transfer_data = {
+    @staticmethod
+    def _transfer_payload(from_account_id: str, to_account_id: str, amount: float) -> Dict[str, Any]:
+        return {
             'medium': 'balance',
             'payee_id': to_account_id,
             'amount': amount,
@@ -96,12 +178,14 @@ class NessieBankService:
             'description': f"Transfer from {from_account_id} to {to_account_id}"
         }
 
-        result = self._fetch_nessie(
-            f"/accounts/{from_account_id}/transfers",
-            method='POST',
-            data=transfer_data
-        )
+    def _invalidate_transfer(self, from_account_id: str, to_account_id: str, result: Dict[str, Any]):
+        """A completed transfer changes both balances, so forget what we cached for either account"""
+        if result['success']:
+            self.cache.invalidate(from_account_id)
+            self.cache.invalidate(to_account_id)
 
+    @staticmethod
+    def _transfer_result(result: Dict[str, Any]) -> Dict[str, Any]:
         if result['success']:
             response = result['data']
             return {
@@ -115,4 +199,160 @@ class NessieBankService:
                         else result.get('error'))
             return {'success': False, 'error': error_msg}
 
+    def get_account_balance(self, account_id: str) -> Dict[str, Any]:
+        """Get the balance for a specific account"""
+        print(f"[Nessie] Getting balance for account: {account_id}")
+        result = self.cache.get_or_load('account', account_id, lambda: self._fetch_nessie(f"/accounts/{account_id}"))
+        return self._balance_result(account_id, result)
+
+    def _fetch_recent_purchases(self, account_id: str, selector: RecentPurchases) -> Dict[str, Any]:
+        """
+        Stream an account's purchases, keeping only what the selector wants.
+        Nessie has no server-side limit or ordering for purchases, so the list is parsed
+        as it downloads and never materialized in full.
+        """
+        endpoint = f"/accounts/{account_id}/purchases"
+        with track('nessie_purchases') as span:
+            try:
+                with self.session.get(f"{self.base_url}{endpoint}?key={self.api_key}", stream=True) as response:
+                    if response.status_code >= 400:
+                        span.error = True
+                        return self._parse_response(endpoint, response)
+                    parser = JsonArrayParser()
+                    for chunk in response.iter_content(chunk_size=PURCHASE_STREAM_CHUNK_BYTES):
+                        span.add_bytes(received=len(chunk))
+                        for purchase in parser.feed(chunk):
+                            selector.add(purchase)
+                    parser.close()
+            except requests.exceptions.RequestException as e:
+                span.error = True
+                return {'success': False, 'error': str(e)}
+            except ValueError as e:
+                span.error = True
+                return {'success': False, 'error': f"Invalid purchases response: {e}"}
+        return selector.result()
+
+    def get_recent_transactions(self, account_id: str, count: int = 5, since: Optional[str] = None,
+                                until: Optional[str] = None, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Get the `count` most recent transactions for an account, newest first.
+        `since`/`until` (YYYY-MM-DD, inclusive) restrict the date range, and passing a previous
+        result's `nextCursor` as `cursor` returns the next older page.
+        """
+        print(f"[Nessie] Getting {count} recent transactions for account: {account_id}")
+        result = self.cache.get_or_load(
+            'purchases', account_id,
+            lambda: self._fetch_recent_purchases(account_id, RecentPurchases(count, since, until, cursor)),
+            variant=(count, since, until, cursor)
+        )
+        return self._transactions_result(account_id, result)
+
+    def transfer_funds(self, from_account_id: str, to_account_id: str, amount: float) -> Dict[str, Any]:
+        """Transfer funds between accounts"""
+        print(f"[Nessie] Transferring {amount} from {from_account_id} to {to_account_id}")
+
+        result = self._fetch_nessie(
+            f"/accounts/{from_account_id}/transfers",
+            method='POST',
+            data=self._transfer_payload(from_account_id, to_account_id, amount),
+            stage='nessie_transfer'
+        )
+        self._invalidate_transfer(from_account_id, to_account_id, result)
+        return self._transfer_result(result)
+
+
+class AsyncNessieBankService(NessieBankService):
+    """
+    Non-blocking variant of NessieBankService for use from async request handlers.
+    Requests share one pooled client, so connections are reused across calls.
+    """
+
+    def __init__(self, client: httpx.AsyncClient = None, cache: AccountCache = None):
+        super().__init__(cache=cache)
+        self._client = client
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client or http_clients.async_client('nessie')
+
+    async def _fetch_nessie(self, endpoint: str, method: str = 'GET', data: Dict = None,
+                            stage: str = 'nessie_account') -> Dict[str, Any]:
+        """Helper function for making authenticated API calls"""
+        url = f"{self.base_url}{endpoint}"
+        params = {'key': self.api_key}
+
+        with track(stage) as span:
+            try:
+                if method == 'GET':
+                    response = await self.client.get(url, params=params)
+                elif method == 'POST':
+                    response = await self.client.post(url, params=params, json=data)
+                else:
+                    raise ValueError(f"Unsupported HTTP method: {method}")
+
+                span.add_bytes(received=len(response.content))
+                result = self._parse_response(endpoint, response)
+
+            except httpx.HTTPError as e:
+                result = {'success': False, 'error': str(e)}
+            span.error = not result['success']
+            return result
+
+    async def get_account_balance(self, account_id: str) -> Dict[str, Any]:
+        """Get the balance for a specific account"""
+        print(f"[Nessie] Getting balance for account: {account_id}")
+        result = await self.cache.get_or_load_async('account', account_id,
+                                                    lambda: self._fetch_nessie(f"/accounts/{account_id}"))
+        return self._balance_result(account_id, result)
+
+    async def _fetch_recent_purchases(self, account_id: str, selector: RecentPurchases) -> Dict[str, Any]:
+        """Stream an account's purchases, keeping only what the selector wants"""
+        endpoint = f"/accounts/{account_id}/purchases"
+        with track('nessie_purchases') as span:
+            try:
+                async with self.client.stream('GET', f"{self.base_url}{endpoint}",
+                                              params={'key': self.api_key}) as response:
+                    if response.status_code >= 400:
+                        span.error = True
+                        await response.aread()
+                        return self._parse_response(endpoint, response)
+                    parser = JsonArrayParser()
+                    async for chunk in response.aiter_bytes(PURCHASE_STREAM_CHUNK_BYTES):
+                        span.add_bytes(received=len(chunk))
+                        for purchase in parser.feed(chunk):
+                            selector.add(purchase)
+                    parser.close()
+            except httpx.HTTPError as e:
+                span.error = True
+                return {'success': False, 'error': str(e)}
+            except ValueError as e:
+                span.error = True
+                return {'success': False, 'error': f"Invalid purchases response: {e}"}
+        return selector.result()
+
+    async def get_recent_transactions(self, account_id: str, count: int = 5, since: Optional[str] = None,
+                                      until: Optional[str] = None, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get the `count` most recent transactions for an account, newest first (see NessieBankService)"""
+        print(f"[Nessie] Getting {count} recent transactions for account: {account_id}")
+        result = await self.cache.get_or_load_async(
+            'purchases', account_id,
+            lambda: self._fetch_recent_purchases(account_id, RecentPurchases(count, since, until, cursor)),
+            variant=(count, since, until, cursor)
+        )
+        return self._transactions_result(account_id, result)
+
+    async def transfer_funds(self, from_account_id: str, to_account_id: str, amount: float) -> Dict[str, Any]:
+        """Transfer funds between accounts"""
+        print(f"[Nessie] Transferring {amount} from {from_account_id} to {to_account_id}")
+
+        result = await self._fetch_nessie(
+            f"/accounts/{from_account_id}/transfers",
+            method='POST',
+            data=self._transfer_payload(from_account_id, to_account_id, amount),
+            stage='nessie_transfer'
+        )
+        self._invalidate_transfer(from_account_id, to_account_id, result)
+        return self._transfer_result(result)
+
 nessie_service = NessieBankService()
+async_nessie_service = AsyncNessieBankService()
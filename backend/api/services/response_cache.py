@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import math
+import time
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+from .intent_router import normalize
+
+load_dotenv()
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000'))
+# Generic answers can live longer than answers built from an account's data
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '600'))
+RESPONSE_CACHE_ACCOUNT_TTL_SECONDS = int(os.getenv('RESPONSE_CACHE_ACCOUNT_TTL_SECONDS', '120'))
+# Nearest-neighbour matching of paraphrases, on top of exact matching of normalized text
+RESPONSE_CACHE_SEMANTIC = os.getenv('RESPONSE_CACHE_SEMANTIC', 'false').lower() in ('1', 'true', 'yes')
+RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.9'))
+RESPONSE_CACHE_EMBEDDING_DIMS = 512
+# Shorter utterances ("yes", "do it") mean different things at different points in a call
+RESPONSE_CACHE_MIN_WORDS = 3
+# Requests that act on the account are never answered from the cache
+RESPONSE_CACHE_BLOCKLIST = re.compile(r'\b(transfer|send|pay|move|yes|no|confirm|cancel)\b')
+
+GENERIC_SCOPE = 'generic'
+
+
+def account_scope(account_id: str, account_data: Dict[str, Any]) -> str:
+    """Scope for answers that depend on one account's data, changing whenever that data changes"""
+    fingerprint = hashlib.sha256(json.dumps(account_data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return f"account:{account_id}:{fingerprint}"
+
+
+def embed(text: str, dims: int = RESPONSE_CACHE_EMBEDDING_DIMS) -> List[float]:
+    """
+    Unit-length hashed bag of words and character trigrams. Cheap and local, and close
+    enough for matching paraphrases of short questions.
+    """
+    vector = [0.0] * dims
+    words = text.split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    features += [word[i:i + 3] for word in words for i in range(max(1, len(word) - 2))]
+    for feature in features:
+        h = zlib.crc32(feature.encode())
+        vector[h % dims] += 1.0 if h & 0x80000000 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class ResponseCache:
+    """
+    Gemini answers keyed by normalized caller text within a scope.
+
+    Generic answers (no account data involved) share the GENERIC_SCOPE across callers.
+    Anything built from account data is stored under account_scope(), which includes the
+    account ID and a fingerprint of its data (purchases and balance), so it is only ever
+    served back to the same account while that data is unchanged. Entries expire by TTL
+    and by LRU beyond max_entries.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, semantic: bool = RESPONSE_CACHE_SEMANTIC,
+                 similarity: float = RESPONSE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.semantic = semantic
+        self.similarity = similarity
+        # (scope, normalized text) -> (reply, expires_at, embedding); least recently used first
+        self._entries: "OrderedDict[tuple[str, str], tuple[str, float, Optional[List[float]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0}
+
+    @staticmethod
+    def cacheable(text: str) -> bool:
+        """Whether a caller utterance may be answered from, or stored in, the cache"""
+        normalized = normalize(text)
+        return len(normalized.split()) >= RESPONSE_CACHE_MIN_WORDS and not RESPONSE_CACHE_BLOCKLIST.search(normalized)
+
+    def get(self, text: str, scopes: List[str]) -> Optional[str]:
+        """Cached reply for text in the first scope that has one, trying exact matches before paraphrases"""
+        normalized = normalize(text)
+        now = time.time()
+        with self._lock:
+            for scope in scopes:
+                entry = self._live_entry((scope, normalized), now)
+                if entry is not None:
+                    self._entries.move_to_end((scope, normalized))
+                    self._stats['exact_hits'] += 1
+                    return entry[0]
+            if self.semantic:
+                reply = self._nearest(normalized, scopes, now)
+                if reply is not None:
+                    self._stats['semantic_hits'] += 1
+                    return reply
+            self._stats['misses'] += 1
+            return None
+
+    def _live_entry(self, key: tuple, now: float):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _nearest(self, normalized: str, scopes: List[str], now: float) -> Optional[str]:
+        query = embed(normalized)
+        # Amounts and counts must match exactly; "last 3" and "last 5" embed almost identically
+        numbers = re.findall(r'\d+', normalized)
+        best_key, best_score = None, self.similarity
+        for key, (_, expires_at, vector) in self._entries.items():
+            if key[0] not in scopes or expires_at <= now or vector is None:
+                continue
+            if re.findall(r'\d+', key[1]) != numbers:
+                continue
+            score = sum(a * b for a, b in zip(query, vector))
+            if score >= best_score:
+                best_key, best_score = key, score
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key][0]
+
+    def put(self, text: str, scope: str, reply: str, ttl_seconds: int):
+        normalized = normalize(text)
+        vector = embed(normalized) if self.semantic else None
+        with self._lock:
+            self._entries[(scope, normalized)] = (reply, time.time() + ttl_seconds, vector)
+            self._entries.move_to_end((scope, normalized))
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_account(self, account_id: str):
+        """Forget every answer built from an account's data, e.g. after a transfer"""
+        prefix = f"account:{account_id}:"
+        with self._lock:
+            stale = [key for key in self._entries if key[0].startswith(prefix)]
+            for key in stale:
+                del self._entries[key]
+            self._stats['invalidations'] += len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats['exact_hits'] + self._stats['semantic_hits'] + self._stats['misses']
+            hits = lookups - self._stats['misses']
+            return {
+                **self._stats,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'semantic': self.semantic,
+            }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')  # 'memory' or 'sqlite'
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', './sessions.db')
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', '1800'))
+SESSION_HISTORY_LIMIT = int(os.getenv('SESSION_HISTORY_LIMIT', '20'))
+SESSION_PURGE_INTERVAL_SECONDS = int(os.getenv('SESSION_PURGE_INTERVAL_SECONDS', '60'))
+
+
+@dataclass
+class CallSession:
+    """Everything we know about one phone call, keyed by Twilio's CallSid."""
+    call_sid: str
+    user_name: str = ""
+    user_id: str = ""
+    account_id: str = ""
+    verified: bool = False
+    security_attempts: int = 0
+    history: List[Dict[str, str]] = field(default_factory=list)
+    # AI reply waiting to be streamed once Twilio opens the call's media stream
+    pending_reply: str = ""
+    # FILLER_AUDIO turn running in the background: when it started (0 if none) and, once done,
+    # its TwiML, so whichever worker Twilio's /turn-result reaches can collect it
+    turn_started_at: float = 0.0
+    turn_result: str = ""
+    # Whether the call's Gemini chat has held the caller's account data (tool results, intent
+    # replies, prefetched transactions); its answers may draw on it even in turns that call no function.
+    # None when unknown, e.g. for a session saved before this was tracked
+    has_account_data: Optional[bool] = None
+    created_at: float = field(default_factory=time.time)
+
+    def add_turn(self, role: str, text: str):
+        """Append a conversation turn, keeping only the most recent SESSION_HISTORY_LIMIT."""
+        self.history.append({'role': role, 'text': text})
+        del self.history[:-SESSION_HISTORY_LIMIT]
+
+    def last_reply(self) -> Optional[str]:
+        """Text of the assistant's last answer, or None before the first one."""
+        for turn in reversed(self.history):
+            if turn['role'] == 'assistant' and turn['text']:
+                return turn['text']
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'CallSession':
+        known = {name: data[name] for name in cls.__dataclass_fields__ if name in data}
+        return cls(**known)
+
+
+class MemorySessionBackend:
+    """Sessions kept in this process only. Fine for a single uvicorn worker."""
+
+    def __init__(self):
+        self._sessions: Dict[str, tuple[Dict[str, Any], float]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, call_sid: str, now: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._sessions.get(call_sid)
+            if entry is None:
+                return None
+            data, expires_at = entry
+            if expires_at <= now:
+                del self._sessions[call_sid]
+                return None
+            return data
+
+    def store(self, call_sid: str, data: Dict[str, Any], expires_at: float):
+        with self._lock:
+            self._sessions[call_sid] = (data, expires_at)
+
+    def delete(self, call_sid: str):
+        with self._lock:
+            self._sessions.pop(call_sid, None)
+
+    def purge_expired(self, now: float) -> int:
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._sessions.items() if expires_at <= now]
+            for sid in expired:
+                del self._sessions[sid]
+            return len(expired)
+
+
+class SQLiteSessionBackend:
+    """Sessions in a SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path: str = SESSION_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS call_sessions ("
+                "call_sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_call_sessions_expiry ON call_sessions (expires_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, call_sid: str, now: float) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT data FROM call_sessions WHERE call_sid = ? AND expires_at > ?", (call_sid, now)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def store(self, call_sid: str, data: Dict[str, Any], expires_at: float):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO call_sessions (call_sid, data, expires_at) VALUES (?, ?, ?)",
+                (call_sid, json.dumps(data), expires_at)
+            )
+
+    def delete(self, call_sid: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM call_sessions WHERE call_sid = ?", (call_sid,))
+
+    def purge_expired(self, now: float) -> int:
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM call_sessions WHERE expires_at <= ?", (now,)).rowcount
+
+
+class SessionStore:
+    """Call sessions with TTL eviction on top of a pluggable backend."""
+
+    def __init__(self, backend, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, call_sid: str) -> Optional[CallSession]:
+        """Return the live session for a call, or None if it never existed or expired."""
+        if not call_sid:
+            return None
+        data = self.backend.load(call_sid, time.time())
+        return CallSession.from_dict(data) if data is not None else None
+
+    def get_or_create(self, call_sid: str) -> CallSession:
+        session = self.get(call_sid)
+        if session is None:
+            session = CallSession(call_sid=call_sid, has_account_data=False)
+            self.save(session)
+        return session
+
+    def save(self, session: CallSession):
+        """Persist a session and push its expiry out by another TTL."""
+        self.backend.store(session.call_sid, session.to_dict(), time.time() + self.ttl_seconds)
+
+    def delete(self, call_sid: str):
+        self.backend.delete(call_sid)
+
+    def purge_expired(self) -> int:
+        return self.backend.purge_expired(time.time())
+
+    async def run_purger(self, interval_seconds: int = SESSION_PURGE_INTERVAL_SECONDS):
+        """Evict expired sessions forever. Meant to run as a background task."""
+        while True:
+            try:
+                await asyncio.to_thread(self.purge_expired)
+            except Exception as e:
+                print(f"[Sessions] Error purging expired sessions: {e}")
+            await asyncio.sleep(interval_seconds)
+
+
+def create_session_store(backend: str = SESSION_BACKEND) -> SessionStore:
+    if backend == 'memory':
+        return SessionStore(MemorySessionBackend())
+    if backend == 'sqlite':
+        return SessionStore(SQLiteSessionBackend(SESSION_DB_PATH))
+    raise ValueError(f"Unsupported session backend: {backend}")
+
+
+session_store = create_session_store()
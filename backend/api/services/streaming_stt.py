@@ -0,0 +1,188 @@
+import os
+import asyncio
+from array import array
+from collections import deque
+from typing import Awaitable, Callable, Optional
+from dotenv import load_dotenv
+from api.utils.audio_codec import ulaw_to_pcm16, wav_container
+
+load_dotenv()
+
+# RMS level (16-bit PCM) above which a 20 ms frame counts as speech
+STT_VAD_THRESHOLD = int(os.getenv('STT_VAD_THRESHOLD', '500'))
+# Consecutive voiced time needed before we decide the caller started talking
+STT_VAD_START_MS = int(os.getenv('STT_VAD_START_MS', '60'))
+# Trailing silence that ends an utterance
+STT_END_SILENCE_MS = int(os.getenv('STT_END_SILENCE_MS', '700'))
+# Utterances are cut off at this length even if the caller keeps talking
+STT_MAX_UTTERANCE_MS = int(os.getenv('STT_MAX_UTTERANCE_MS', '30000'))
+# How much new speech accumulates between partial transcripts
+STT_PARTIAL_INTERVAL_MS = int(os.getenv('STT_PARTIAL_INTERVAL_MS', '1000'))
+# Audio kept from just before speech starts, so the first syllable isn't clipped
+STT_PREROLL_MS = int(os.getenv('STT_PREROLL_MS', '200'))
+
+FRAME_MS = 20
+FRAME_BYTES = 160  # 20 ms of 8 kHz mu-law
+
+
+def frame_rms(pcm: bytes) -> float:
+    samples = array('h', pcm)
+    if not samples:
+        return 0.0
+    return (sum(s * s for s in samples) / len(samples)) ** 0.5
+
+
+class EnergyVAD:
+    """Frame-energy voice activity detector that reports when an utterance starts and ends."""
+
+    def __init__(self, threshold: int = STT_VAD_THRESHOLD, start_ms: int = STT_VAD_START_MS,
+                 end_silence_ms: int = STT_END_SILENCE_MS, max_utterance_ms: int = STT_MAX_UTTERANCE_MS):
+        self.threshold = threshold
+        self.start_frames = max(1, start_ms // FRAME_MS)
+        self.end_frames = max(1, end_silence_ms // FRAME_MS)
+        self.max_frames = max(1, max_utterance_ms // FRAME_MS)
+        self.reset()
+
+    def reset(self):
+        self.in_speech = False
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._utterance_frames = 0
+
+    def process(self, pcm_frame: bytes) -> Optional[str]:
+        """Feed one 20 ms PCM frame. Returns 'start', 'end' or None."""
+        voiced = frame_rms(pcm_frame) >= self.threshold
+        if not self.in_speech:
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.start_frames:
+                self.in_speech = True
+                self._silent_run = 0
+                self._utterance_frames = self._voiced_run
+                return 'start'
+            return None
+
+        self._utterance_frames += 1
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run >= self.end_frames or self._utterance_frames >= self.max_frames:
+            self.reset()
+            return 'end'
+        return None
+
+
+class StreamingTranscriber:
+    """
+    Turns a live stream of caller audio into partial and final transcripts.
+
+    Caller audio (8 kHz mu-law, as delivered by Twilio Media Streams) is segmented
+    with a VAD. While the caller is talking, the utterance so far is transcribed
+    every STT_PARTIAL_INTERVAL_MS and reported through on_partial. When the VAD
+    detects end of utterance the whole utterance is transcribed once more and the
+    final text is queued for next_final(), so the AI turn can start immediately
+    instead of waiting for Twilio to finish and upload a recording.
+    """
+
+    def __init__(self, stt_service, on_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+                 vad: EnergyVAD = None, partial_interval_ms: int = STT_PARTIAL_INTERVAL_MS,
+                 preroll_ms: int = STT_PREROLL_MS):
+        self.stt_service = stt_service
+        self.on_partial = on_partial
+        self.vad = vad or EnergyVAD()
+        self.partial_interval_bytes = max(FRAME_BYTES, partial_interval_ms // FRAME_MS * FRAME_BYTES)
+        self.paused = False
+        self._preroll = deque(maxlen=max(1, preroll_ms // FRAME_MS))
+        self._utterance = bytearray()
+        self._pending = b''
+        self._last_partial_at = 0
+        self._partial_task: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self._finals: asyncio.Queue = asyncio.Queue()
+
+    async def feed(self, ulaw: bytes):
+        """Feed caller audio as it arrives. Never blocks on transcription."""
+        if self.paused:
+            return
+        self._pending += ulaw
+        while len(self._pending) >= FRAME_BYTES:
+            frame, self._pending = self._pending[:FRAME_BYTES], self._pending[FRAME_BYTES:]
+            self._process_frame(frame)
+
+    def _process_frame(self, frame: bytes):
+        event = self.vad.process(ulaw_to_pcm16(frame))
+        if event == 'start':
+            self._utterance = bytearray(b''.join(self._preroll))
+            self._last_partial_at = 0
+        self._preroll.append(frame)
+
+        if self.vad.in_speech or event == 'end':
+            self._utterance += frame
+
+        if event == 'end':
+            utterance = bytes(self._utterance)
+            self._utterance = bytearray()
+            self._spawn(self._finalize(utterance))
+        elif (self.vad.in_speech and self.on_partial is not None
+              and len(self._utterance) - self._last_partial_at >= self.partial_interval_bytes
+              and (self._partial_task is None or self._partial_task.done())):
+            self._last_partial_at = len(self._utterance)
+            self._partial_task = self._spawn(self._emit_partial(bytes(self._utterance)))
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _transcribe(self, ulaw: bytes) -> str:
+        audio = wav_container(ulaw_to_pcm16(ulaw), sample_rate=8000, encoding='pcm16')
+        return (await self.stt_service.speech_to_text(audio, filename='utterance.wav',
+                                                      content_type='audio/wav')).strip()
+
+    async def _emit_partial(self, ulaw: bytes):
+        try:
+            text = await self._transcribe(ulaw)
+            if text:
+                await self.on_partial(text)
+        except Exception as e:
+            print(f"[STT] Partial transcription failed: {e}")
+
+    async def _finalize(self, ulaw: bytes):
+        # The final transcript supersedes any partial still in flight
+        if self._partial_task is not None and not self._partial_task.done():
+            self._partial_task.cancel()
+        try:
+            text = await self._transcribe(ulaw)
+        except Exception as e:
+            print(f"[STT] Final transcription failed: {e}")
+            text = ''
+        if text:
+            await self._finals.put(text)
+
+    async def next_final(self) -> Optional[str]:
+        """Wait for the next complete utterance. Returns None once the stream is closed."""
+        return await self._finals.get()
+
+    def reset(self):
+        """
+        Discard buffered audio and anything heard before now, e.g. after the assistant finishes
+        speaking: transcriptions still in flight are cancelled and unread finals dropped, so speech
+        from before the reply isn't answered as the next turn.
+        """
+        self.vad.reset()
+        self._preroll.clear()
+        self._utterance = bytearray()
+        self._pending = b''
+        for task in list(self._tasks):
+            task.cancel()
+        closed = False
+        while not self._finals.empty():
+            closed = self._finals.get_nowait() is None or closed
+        if closed:
+            # Keep close()'s wake-up for next_final
+            self._finals.put_nowait(None)
+
+    def close(self):
+        """Stop transcribing and wake anyone waiting in next_final."""
+        self.paused = True
+        for task in list(self._tasks):
+            task.cancel()
+        self._finals.put_nowait(None)
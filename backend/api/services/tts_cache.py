@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+from .elevenlabs_service import AUDIO_FILE_EXTENSION
+
+load_dotenv()
+
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', './audio')
+TTS_CACHE_MEMORY_BYTES = int(os.getenv('TTS_CACHE_MEMORY_BYTES', str(32 * 1024 * 1024)))
+
+# Cached files are named by the sha256 of their synthesis parameters
+CACHE_FILENAME_RE = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+
+class TTSCache:
+    """
+    Content-addressed cache for synthesized speech.
+
+    Audio is keyed by a hash of the text and every parameter that changes the
+    synthesized output (voice, model, voice settings). Entries live in a
+    byte-bounded in-memory LRU tier backed by files on disk, so fixed prompts
+    are synthesized once per deployment rather than once per call.
+    """
+
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_memory_bytes: int = TTS_CACHE_MEMORY_BYTES,
+                 extension: str = 'mp3'):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.extension = extension
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key_for(text: str, params: Dict[str, Any]) -> str:
+        """Hash the text together with the synthesis parameters."""
+        payload = json.dumps({'text': text, 'params': params}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def filename_for(self, key: str) -> str:
+        return f"{key}.{self.extension}"
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def _remember(self, filename: str, audio: bytes):
+        """Insert into the memory tier, evicting least recently used entries over budget."""
+        if len(audio) > self.max_memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(filename, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._memory[filename] = audio
+            self._memory_bytes += len(audio)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _read_memory(self, filename: str) -> Optional[bytes]:
+        with self._lock:
+            audio = self._memory.get(filename)
+            if audio is not None:
+                self._memory.move_to_end(filename)
+                self.hits['memory'] += 1
+            return audio
+
+    def _read_disk(self, filename: str) -> Optional[bytes]:
+        try:
+            with open(self._path(filename), 'rb') as f:
+                audio = f.read()
+        except FileNotFoundError:
+            return None
+
+        self.hits['disk'] += 1
+        self._remember(filename, audio)
+        return audio
+
+    def read(self, filename: str) -> Optional[bytes]:
+        """Return cached audio by filename from memory, falling back to disk."""
+        if not CACHE_FILENAME_RE.match(filename):
+            return None
+        audio = self._read_memory(filename)
+        return audio if audio is not None else self._read_disk(filename)
+
+    async def read_async(self, filename: str) -> Optional[bytes]:
+        """Like read, but disk access happens off the event loop."""
+        if not CACHE_FILENAME_RE.match(filename):
+            return None
+        audio = self._read_memory(filename)
+        return audio if audio is not None else await asyncio.to_thread(self._read_disk, filename)
+
+    def write(self, filename: str, audio: bytes):
+        """Store audio in both tiers. The file is written atomically."""
+        tmp_path = f"{self._path(filename)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(audio)
+        os.replace(tmp_path, self._path(filename))
+        self._remember(filename, audio)
+
+    def get_or_synthesize(self, text: str, tts_service) -> str:
+        """Return the cache filename for text, synthesizing it on a miss."""
+        key = self.key_for(text, tts_service.synthesis_params())
+        filename = self.filename_for(key)
+        if self.read(filename) is not None:
+            return filename
+
+        self.misses += 1
+        audio_content = tts_service.text_to_speech(text)
+        self.write(filename, audio_content)
+        return filename
+
+    async def lookup_async(self, text: str, tts_service) -> Optional[str]:
+        """Return the cache filename for text if it is already cached, counting a miss otherwise."""
+        filename = self.filename_for(self.key_for(text, tts_service.synthesis_params()))
+        if await self.read_async(filename) is not None:
+            return filename
+        self.misses += 1
+        return None
+
+    async def store_async(self, text: str, tts_service, audio: bytes) -> str:
+        """Cache audio synthesized elsewhere (e.g. in a batch) and return its filename."""
+        filename = self.filename_for(self.key_for(text, tts_service.synthesis_params()))
+        await asyncio.to_thread(self.write, filename, audio)
+        return filename
+
+    async def get_or_synthesize_async(self, text: str, tts_service) -> str:
+        """Async variant of get_or_synthesize for services whose text_to_speech is a coroutine."""
+        filename = await self.lookup_async(text, tts_service)
+        if filename is not None:
+            return filename
+        audio_content = await tts_service.text_to_speech(text)
+        return await self.store_async(text, tts_service, audio_content)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'hits': dict(self.hits),
+                'misses': self.misses,
+            }
+
+
+tts_cache = TTSCache(extension=AUDIO_FILE_EXTENSION)
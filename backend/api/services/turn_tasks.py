@@ -0,0 +1,85 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Finished turns nobody collected (e.g. the caller hung up during the filler) are dropped after this long
+TURN_RESULT_TTL_SECONDS = int(os.getenv('TURN_RESULT_TTL_SECONDS', '120'))
+
+
+class TurnTasks:
+    """
+    Conversation turns running in the background, keyed by CallSid. A webhook starts the
+    turn and can answer Twilio before it finishes; a later webhook for the same call
+    collects the result. Tasks live in this process; a webhook reaching another worker
+    collects the turn from the call session instead (see wait_for_session_turn in main).
+    """
+
+    def __init__(self, result_ttl_seconds: int = TURN_RESULT_TTL_SECONDS):
+        self.result_ttl_seconds = result_ttl_seconds
+        # call_sid -> (task, started at)
+        self._tasks: Dict[str, tuple[asyncio.Task, float]] = {}
+
+    def start(self, call_sid: str, turn: Awaitable[str]) -> asyncio.Task:
+        """Run a turn in the background, replacing any earlier turn of the same call."""
+        self._purge_stale(time.time())
+        previous = self._tasks.pop(call_sid, None)
+        if previous is not None:
+            previous[0].cancel()
+        task = asyncio.ensure_future(turn)
+        self._tasks[call_sid] = (task, time.time())
+        return task
+
+    async def wait(self, call_sid: str, timeout: float) -> Optional[str]:
+        """
+        The turn's result if it finishes within timeout, removing it from the registry.
+        None if it is still running (it keeps running) or there is no turn for the call.
+        """
+        self._purge_stale(time.time())
+        entry = self._tasks.get(call_sid)
+        if entry is None:
+            return None
+        task = entry[0]
+        try:
+            result = await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if self._tasks.get(call_sid, (None,))[0] is task:
+            del self._tasks[call_sid]
+        return result
+
+    def has_turn(self, call_sid: str) -> bool:
+        return call_sid in self._tasks
+
+    def cancel(self, call_sid: str):
+        """
+        Stop a call's turn once the call is over, so a caller who hung up during the filler doesn't
+        keep Gemini, Nessie and TTS busy. A turn that ends its own call is left to return its TwiML.
+        """
+        entry = self._tasks.get(call_sid)
+        if entry is None:
+            return
+        try:
+            current = asyncio.current_task()
+        except RuntimeError:
+            current = None
+        if entry[0] is current:
+            return
+        del self._tasks[call_sid]
+        entry[0].cancel()
+
+    def _purge_stale(self, now: float):
+        for call_sid, (task, started_at) in list(self._tasks.items()):
+            if task.done() and now - started_at > self.result_ttl_seconds:
+                del self._tasks[call_sid]
+
+    def stats(self) -> Dict[str, int]:
+        self._purge_stale(time.time())
+        running = sum(1 for task, _ in self._tasks.values() if not task.done())
+        return {'running': running, 'uncollected': len(self._tasks) - running}
+
+
+turn_tasks = TurnTasks()
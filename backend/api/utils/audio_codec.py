@@ -0,0 +1,134 @@
+# G.711 mu-law and PCM helpers for telephone audio (Twilio Media Streams use 8 kHz mu-law)
+import struct
+from array import array
+from typing import Tuple
+
+ULAW_BIAS = 0x84
+ULAW_CLIP = 8159
+# Upper bound of each mu-law segment for 14-bit magnitudes
+ULAW_SEGMENT_ENDS = (0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF)
+
+
+def _encode_ulaw_sample(sample: int) -> int:
+    # Same algorithm as the reference G.711 implementation (and audioop.lin2ulaw)
+    sample >>= 2
+    if sample < 0:
+        sample, mask = -sample, 0x7F
+    else:
+        mask = 0xFF
+    sample = min(sample, ULAW_CLIP) + (ULAW_BIAS >> 2)
+    for segment, end in enumerate(ULAW_SEGMENT_ENDS):
+        if sample <= end:
+            return ((segment << 4) | ((sample >> (segment + 1)) & 0x0F)) ^ mask
+    return 0x7F ^ mask
+
+
+def _decode_ulaw_byte(value: int) -> int:
+    value = ~value & 0xFF
+    sign = value & 0x80
+    exponent = (value >> 4) & 0x07
+    mantissa = value & 0x0F
+    sample = (((mantissa << 3) + ULAW_BIAS) << exponent) - ULAW_BIAS
+    return -sample if sign else sample
+
+
+# Lookup tables: every 16-bit sample to its mu-law byte, and every mu-law byte back to 16-bit
+_ULAW_ENCODE = bytes(_encode_ulaw_sample(s - 65536 if s >= 32768 else s) for s in range(65536))
+_ULAW_DECODE = array('h', (_decode_ulaw_byte(b) for b in range(256)))
+
+
+def pcm16_to_ulaw(pcm: bytes) -> bytes:
+    """Encode little-endian signed 16-bit PCM as mu-law, one byte per sample."""
+    samples = array('H', pcm[:len(pcm) - len(pcm) % 2])
+    return bytes(_ULAW_ENCODE[s] for s in samples)
+
+
+def ulaw_to_pcm16(ulaw: bytes) -> bytes:
+    """Decode mu-law bytes to little-endian signed 16-bit PCM."""
+    return array('h', (_ULAW_DECODE[b] for b in ulaw)).tobytes()
+
+
+def downsample_pcm16(pcm: bytes, factor: int) -> bytes:
+    """Reduce the sample rate by an integer factor, averaging each group of samples."""
+    if factor == 1:
+        return pcm
+    samples = array('h', pcm[:len(pcm) - len(pcm) % (2 * factor)])
+    return array('h', (sum(samples[i:i + factor]) // factor for i in range(0, len(samples), factor))).tobytes()
+
+
+class PcmToUlawConverter:
+    """
+    Incrementally converts a 16-bit PCM stream at sample_rate into 8 kHz mu-law.
+    Network chunks can split samples, so any partial frame is carried to the next call.
+    """
+
+    def __init__(self, sample_rate: int):
+        if sample_rate % 8000:
+            raise ValueError(f"Unsupported PCM sample rate for telephony: {sample_rate}")
+        self.factor = sample_rate // 8000
+        self._remainder = b''
+
+    def feed(self, chunk: bytes) -> bytes:
+        data = self._remainder + chunk
+        usable = len(data) - len(data) % (2 * self.factor)
+        self._remainder = data[usable:]
+        return pcm16_to_ulaw(downsample_pcm16(data[:usable], self.factor))
+
+
+def wav_container(audio: bytes, sample_rate: int = 8000, encoding: str = 'ulaw') -> bytes:
+    """Wrap raw mono mu-law or 16-bit PCM audio in a WAV header."""
+    if encoding == 'ulaw':
+        format_tag, bits_per_sample = 7, 8
+    elif encoding == 'pcm16':
+        format_tag, bits_per_sample = 1, 16
+    else:
+        raise ValueError(f"Unsupported WAV encoding: {encoding}")
+    block_align = bits_per_sample // 8
+    # Non-PCM formats carry a cbSize field, so their fmt chunk is 18 bytes
+    fmt_chunk = struct.pack('<HHIIHH', format_tag, 1, sample_rate, sample_rate * block_align,
+                            block_align, bits_per_sample)
+    if format_tag != 1:
+        fmt_chunk += struct.pack('<H', 0)
+    body = (b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt_chunk)) + fmt_chunk
+            + b'data' + struct.pack('<I', len(audio)) + audio)
+    if len(audio) % 2:
+        body += b'\x00'
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+# Containers for audio played with <Play>, by file extension
+AUDIO_CONTENT_TYPES = {'mp3': 'audio/mpeg', 'wav': 'audio/wav'}
+
+
+def output_format_parts(output_format: str) -> Tuple[str, int, int]:
+    """Split an ElevenLabs output format such as mp3_44100_128 into codec, sample rate and kbps (0 if absent)."""
+    parts = output_format.split('_')
+    codec = parts[0]
+    if codec not in ('mp3', 'ulaw', 'pcm') or len(parts) < 2:
+        raise ValueError(f"Unsupported output format for playback: {output_format}")
+    return codec, int(parts[1]), int(parts[2]) if len(parts) > 2 else 0
+
+
+def audio_file_extension(output_format: str) -> str:
+    """MP3 is stored as-is; raw mu-law and PCM are stored in a WAV container."""
+    return 'mp3' if output_format_parts(output_format)[0] == 'mp3' else 'wav'
+
+
+def audio_byte_rate(output_format: str) -> int:
+    """Bytes per second of audio in an output format."""
+    codec, sample_rate, kbps = output_format_parts(output_format)
+    if codec == 'mp3':
+        return kbps * 1000 // 8
+    return sample_rate if codec == 'ulaw' else sample_rate * 2
+
+
+def playable_audio(audio: bytes, output_format: str) -> bytes:
+    """Wrap synthesized audio in the container its file extension promises."""
+    codec, sample_rate, _ = output_format_parts(output_format)
+    if codec == 'mp3':
+        return audio
+    return wav_container(audio, sample_rate=sample_rate, encoding='ulaw' if codec == 'ulaw' else 'pcm16')
+
+
+def audio_content_type(filename: str) -> str:
+    return AUDIO_CONTENT_TYPES.get(filename.rsplit('.', 1)[-1], 'application/octet-stream')
@@ -44,3 +44,18 @@ merchant_id_map = {
     "Barnes & Noble": "68f42d299683f20dd51a02ca",
     "Chipotle": "68f42d299683f20dd51a02cb"
 }
+
+merchant_category_map = {
+    "68f42d289683f20dd51a02c0": "Coffee Shop",
+    "68f42d289683f20dd51a02c1": "Retail",
+    "68f42d299683f20dd51a02c2": "Retail",
+    "68f42d299683f20dd51a02c3": "Electronics",
+    "68f42d299683f20dd51a02c4": "Restaurant",
+    "68f42d299683f20dd51a02c5": "Retail",
+    "68f42d299683f20dd51a02c6": "Electronics",
+    "68f42d299683f20dd51a02c7": "Grocery",
+    "68f42d299683f20dd51a02c8": "Transportation",
+    "68f42d299683f20dd51a02c9": "Transportation",
+    "68f42d299683f20dd51a02ca": "Bookstore",
+    "68f42d299683f20dd51a02cb": "Restaurant"
+}
@@ -0,0 +1,420 @@
+# Customer lookup by spoken first name, loaded lazily from a JSON, JSONL or SQLite file
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterator, Optional, Set
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# .json (a list of customers), .jsonl (one customer per line) or .db/.sqlite (a 'customers' table with
+# columns name, customer_id, account_id and security, a JSON object of question -> answer; names are
+# stored lowercase and indexed). Empty or missing: the maps generated into customer_data.py.
+CUSTOMER_DIRECTORY_PATH = os.getenv('CUSTOMER_DIRECTORY_PATH', '')
+# How often lookups check whether the file changed and reload it
+CUSTOMER_DIRECTORY_RELOAD_SECONDS = float(os.getenv('CUSTOMER_DIRECTORY_RELOAD_SECONDS', '5'))
+# Most spelling edits between what STT heard and a customer's name for a fuzzy match
+CUSTOMER_NAME_MAX_DISTANCE = int(os.getenv('CUSTOMER_NAME_MAX_DISTANCE', '2'))
+# Names shorter than this (heard or on file) only match exactly: "tim" is one edit from "tom", and
+# Soundex, which ignores vowels, gives them the same key
+CUSTOMER_NAME_FUZZY_MIN_LENGTH = 4
+
+
+@dataclass
+class Customer:
+    name: str
+    customer_id: str
+    account_id: str = ""
+    # question -> answer
+    security: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class NameMatch:
+    customer: Customer
+    heard: str
+    method: str  # 'exact', 'phonetic' or 'fuzzy'
+    distance: int
+
+
+def normalize_name(text: str) -> str:
+    """Letters only, lowercase, as names are keyed in the directory."""
+    return ''.join(filter(str.isalpha, text)).lower()
+
+
+SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for letter in letters}
+
+
+def soundex(name: str) -> str:
+    """American Soundex code, e.g. 'robert' and 'rupert' -> 'R163'."""
+    if not name:
+        return ''
+    code = name[0].upper()
+    previous = SOUNDEX_CODES.get(name[0], '')
+    for letter in name[1:]:
+        digit = SOUNDEX_CODES.get(letter, '')
+        if digit and digit != '0' and digit != previous:
+            code += digit
+        # h and w don't separate letters with the same code; vowels do
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def metaphone(name: str) -> str:
+    """
+    Simplified Metaphone key: groups letters by how they are pronounced in English,
+    so spellings STT commonly confuses ("katherine"/"catherine", "jon"/"john") collide.
+    """
+    word = name
+    for prefix, replacement in (('kn', 'n'), ('gn', 'n'), ('pn', 'n'), ('wr', 'r'), ('ae', 'e'), ('x', 's'), ('wh', 'w')):
+        if word.startswith(prefix):
+            word = replacement + word[len(prefix):]
+            break
+    key = ''
+    i = 0
+    while i < len(word):
+        c = word[i]
+        nxt = word[i + 1] if i + 1 < len(word) else ''
+        prev = word[i - 1] if i else ''
+        if c == prev and c != 'c':
+            i += 1
+            continue
+        if c in 'aeiou':
+            code = c.upper() if i == 0 else ''
+        elif c == 'b':
+            code = '' if prev == 'm' and not nxt else 'B'
+        elif c == 'c':
+            if nxt == 'h':
+                # "christopher", "schmidt"
+                code = 'K' if word[i + 2:i + 3] == 'r' or prev == 's' else 'X'
+                i += 1
+            elif nxt in 'iey':
+                code = 'S'
+            else:
+                code = 'K'
+        elif c == 'd':
+            code = 'J' if nxt == 'g' and word[i + 2:i + 3] in ('e', 'i', 'y') else 'T'
+        elif c == 'g':
+            if nxt == 'h' and word[i + 2:i + 3] not in ('a', 'e', 'i', 'o', 'u', ''):
+                code = ''
+            elif nxt == 'n':
+                code = ''
+            elif nxt in 'iey':
+                code = 'J'
+            else:
+                code = 'K'
+        elif c == 'h':
+            code = 'H' if nxt in 'aeiou' and prev not in 'cgpst' else ''
+        elif c == 'k':
+            code = '' if prev == 'c' else 'K'
+        elif c == 'p':
+            if nxt == 'h':
+                code, i = 'F', i + 1
+            else:
+                code = 'P'
+        elif c == 'q':
+            code = 'K'
+        elif c == 's':
+            if nxt == 'h':
+                code, i = 'X', i + 1
+            else:
+                code = 'S'
+        elif c == 't':
+            if nxt == 'h':
+                code, i = '0', i + 1
+            else:
+                code = 'T'
+        elif c == 'v':
+            code = 'F'
+        elif c in 'wy':
+            code = c.upper() if nxt in 'aeiou' else ''
+        elif c == 'x':
+            code = 'KS'
+        elif c == 'z':
+            code = 'S'
+        else:
+            code = c.upper()
+        key += code
+        i += 1
+    return key
+
+
+def deletions(name: str) -> Set[str]:
+    """The name with each single letter removed, plus the name itself."""
+    return {name} | {name[:i] + name[i + 1:] for i in range(len(name))}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Damerau-Levenshtein distance (adjacent swaps count as one edit), or limit + 1 once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _customer_from_record(record: dict) -> Customer:
+    security = record.get('security') or {}
+    if isinstance(security, str):
+        security = json.loads(security)
+    return Customer(
+        name=normalize_name(record['name']),
+        customer_id=record['customer_id'],
+        account_id=record.get('account_id') or "",
+        security=security
+    )
+
+
+def _module_records() -> Iterator[dict]:
+    from api.utils import customer_data
+    for name, customer_id in customer_data.customer_id_map.items():
+        yield {
+            'name': name,
+            'customer_id': customer_id,
+            'account_id': customer_data.customer_account_id_map.get(name, ""),
+            'security': customer_data.customer_security_map.get(name) or {}
+        }
+
+
+def _file_records(path: str) -> Iterator[dict]:
+    if path.endswith('.jsonl'):
+        with open(path) as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # e.g. a line cut short by a crashed seeding run; one bad line shouldn't hide every customer
+                    print(f"[Customers] Skipping malformed line {number} of {path}")
+    else:
+        with open(path) as f:
+            data = json.load(f)
+        yield from data['customers'] if isinstance(data, dict) else data
+
+
+class _NameIndex:
+    """Lookup structures over the directory's distinct names. Built once per load."""
+
+    def __init__(self, names: Set[str], max_distance: int):
+        self.names = names
+        self.max_distance = max_distance
+        # Filled in by CustomerDirectory.security_questions on first use
+        self.questions: Optional[FrozenSet[str]] = None
+        self.by_sound: Dict[str, Set[str]] = defaultdict(set)
+        # Every name under itself and each one-letter deletion. Looking up the query's variants with
+        # up to max_distance deletions finds every name within one edit and most within two;
+        # the phonetic keys catch most of the rest.
+        self.by_deletion: Dict[str, Set[str]] = defaultdict(set)
+        for name in names:
+            self.by_sound['s' + soundex(name)].add(name)
+            self.by_sound['m' + metaphone(name)].add(name)
+            for key in deletions(name):
+                self.by_deletion[key].add(name)
+
+    def candidates(self, heard: str) -> Set[str]:
+        found = set(self.by_sound.get('s' + soundex(heard), ())) | set(self.by_sound.get('m' + metaphone(heard), ()))
+        variants = {heard}
+        for _ in range(self.max_distance):
+            variants = set().union(*(deletions(variant) for variant in variants))
+        for key in variants:
+            found |= self.by_deletion.get(key, set())
+        return found
+
+
+class CustomerDirectory:
+    """
+    Customers keyed by first name, matched against what STT heard. Exact names hit a dict;
+    otherwise candidates come from phonetic keys (Soundex, Metaphone) and a deletion index,
+    and the closest by edit distance wins. Only distinct names are indexed, so lookups stay
+    fast as the directory grows to hundreds of thousands of customers.
+
+    The source is loaded on first use. JSON and JSONL files are held in memory; for SQLite
+    only the names are, and customers are read from the database when matched. The file is
+    reloaded when it changes, checked at most every reload_seconds.
+    """
+
+    def __init__(self, path: str = CUSTOMER_DIRECTORY_PATH, reload_seconds: float = CUSTOMER_DIRECTORY_RELOAD_SECONDS,
+                 max_distance: int = CUSTOMER_NAME_MAX_DISTANCE):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._customers: Optional[Dict[str, Customer]] = None
+        self._index: Optional[_NameIndex] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._reloading = False
+
+    @property
+    def _sqlite(self) -> bool:
+        return self.path.endswith(('.db', '.sqlite', '.sqlite3'))
+
+    def _source_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.path) if self.path else None
+        except OSError:
+            return None
+
+    def _ensure_loaded(self):
+        """Load on first use; later, reload in a background thread when the source has changed."""
+        now = time.time()
+        if self._index is not None and (self._reloading or now - self._checked_at < self.reload_seconds):
+            return
+        with self._lock:
+            if self._index is not None and (self._reloading or now - self._checked_at < self.reload_seconds):
+                return
+            self._checked_at = now
+            mtime = self._source_mtime()
+            if self._index is None:
+                self._load(mtime)
+            elif mtime != self._mtime:
+                # Lookups keep using the current data until the new load is swapped in
+                self._reloading = True
+                threading.Thread(target=self._reload_in_background, args=(mtime,), daemon=True).start()
+
+    def _reload_in_background(self, mtime: Optional[float]):
+        try:
+            loaded = self._read(mtime)
+            with self._lock:
+                self._swap(*loaded)
+        except Exception as e:
+            print(f"[Customers] Error reloading {self.path}: {e}")
+        finally:
+            self._reloading = False
+
+    def _load(self, mtime: Optional[float]):
+        """Caller holds the lock."""
+        self._swap(*self._read(mtime))
+
+    def _read(self, mtime: Optional[float]) -> tuple:
+        """Build fresh structures from the source, without touching the ones in use."""
+        started = time.perf_counter()
+        customers, db = None, None
+        if self._sqlite and mtime is not None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            names = {normalize_name(row[0]) for row in db.execute("SELECT name FROM customers")}
+        else:
+            records = _file_records(self.path) if mtime is not None else _module_records()
+            customers = {}
+            for record in records:
+                customer = _customer_from_record(record)
+                # Names are the key callers are identified by; the first customer with a name keeps it
+                customers.setdefault(customer.name, customer)
+            names = set(customers)
+        index = _NameIndex(names, self.max_distance)
+        source = self.path if mtime is not None else 'customer_data.py'
+        print(f"[Customers] Loaded {len(names)} names from {source} in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return customers, db, index, mtime
+
+    def _swap(self, customers, db, index, mtime):
+        """Swap in a load as one step, so lookups see either the old data or the new. Caller holds the lock."""
+        if self._db is not None:
+            self._db.close()
+        self._customers, self._db, self._index, self._mtime = customers, db, index, mtime
+
+    def reload(self):
+        """Reload the source now instead of waiting for the next change check."""
+        with self._lock:
+            self._checked_at = time.time()
+            self._load(self._source_mtime())
+
+    def get(self, name: str) -> Optional[Customer]:
+        """The customer with exactly this name."""
+        self._ensure_loaded()
+        name = normalize_name(name)
+        if self._customers is not None:
+            return self._customers.get(name)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT name, customer_id, account_id, security FROM customers WHERE name = ? LIMIT 1",
+                (name,)
+            ).fetchone()
+        if row is None:
+            return None
+        return _customer_from_record(dict(zip(('name', 'customer_id', 'account_id', 'security'), row)))
+
+    def match(self, heard: str) -> Optional[NameMatch]:
+        """
+        The customer whose name best matches a transcribed name: exact, then same sound,
+        then fewest edits. Short names only match exactly. None if nothing is close enough,
+        or two names are equally close.
+        """
+        heard = normalize_name(heard)
+        if not heard:
+            return None
+        self._ensure_loaded()
+        index = self._index
+        if heard in index.names:
+            return self._match(heard, heard, 'exact', 0)
+
+        if len(heard) < CUSTOMER_NAME_FUZZY_MIN_LENGTH:
+            return None
+
+        max_distance = self.max_distance
+        sound = (soundex(heard), metaphone(heard))
+        ranked = []
+        for name in index.candidates(heard):
+            if len(name) < CUSTOMER_NAME_FUZZY_MIN_LENGTH:
+                continue
+            same_sound = soundex(name) == sound[0] or metaphone(name) == sound[1]
+            distance = edit_distance(heard, name, max(max_distance, 2 if same_sound else 0))
+            if distance <= max_distance or (same_sound and distance <= 2):
+                # Sounding alike outranks a smaller spelling difference
+                ranked.append((0 if same_sound else 1, distance, name))
+        if not ranked:
+            return None
+        ranked.sort()
+        best = ranked[0]
+        if len(ranked) > 1 and ranked[1][:2] == best[:2]:
+            print(f"[Customers] '{heard}' is ambiguous between '{best[2]}' and '{ranked[1][2]}'")
+            return None
+        return self._match(best[2], heard, 'phonetic' if best[0] == 0 else 'fuzzy', best[1])
+
+    def _match(self, name: str, heard: str, method: str, distance: int) -> Optional[NameMatch]:
+        customer = self.get(name)
+        # None if a reload removed the customer in the meantime
+        return NameMatch(customer, heard, method, distance) if customer is not None else None
+
+    def security_questions(self) -> FrozenSet[str]:
+        """Every distinct security question, e.g. to pre-synthesize them. Computed once per load."""
+        self._ensure_loaded()
+        index = self._index
+        if index.questions is None:
+            if self._customers is not None:
+                questions = {q for customer in self._customers.values() for q in customer.security}
+            else:
+                with self._lock:
+                    rows = self._db.execute("SELECT DISTINCT security FROM customers").fetchall()
+                questions = {q for (security,) in rows for q in json.loads(security or '{}')}
+            index.questions = frozenset(questions)
+        return index.questions
+
+    def names(self) -> FrozenSet[str]:
+        """Every customer name, e.g. to pick simulated callers from."""
+        self._ensure_loaded()
+        return frozenset(self._index.names)
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._index.names)
+
+
+customer_directory = CustomerDirectory()
@@ -0,0 +1,58 @@
+# Incremental parsing of large JSON arrays, so responses can be consumed item by item as they download
+import json
+import codecs
+from typing import Any, List
+
+
+class JsonArrayParser:
+    """
+    Parses a top-level JSON array fed in arbitrary byte chunks, returning each
+    element as soon as it is complete. Only the unparsed tail is kept in memory.
+    """
+
+    def __init__(self, encoding: str = 'utf-8'):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder(encoding)()
+        self._buffer = ''
+        self.started = False
+        self.finished = False
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Add the next chunk and return the elements it completed."""
+        if self.finished:
+            return []
+        buffer = self._buffer + self._text.decode(chunk)
+        items = []
+        pos = 0
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or (self.started and buffer[pos] == ',')):
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not self.started:
+                if buffer[pos] != '[':
+                    raise ValueError("Expected a JSON array")
+                self.started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                self.finished = True
+                pos += 1
+                break
+            try:
+                item, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The element continues in the next chunk
+                break
+            if end == len(buffer) and not isinstance(item, (dict, list, str)):
+                # A number or literal at the very end may still be cut short
+                break
+            items.append(item)
+            pos = end
+        self._buffer = buffer[pos:]
+        return items
+
+    def close(self):
+        """Raise if the stream ended before the array did."""
+        if not self.finished:
+            raise ValueError("JSON array ended unexpectedly")
@@ -0,0 +1,273 @@
+# Prometheus-format metrics for webhooks and external calls, and per-call trace IDs
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Sequence, Tuple
+from starlette.routing import Match
+
+# Seconds; spans everything from a cache hit to a slow Gemini turn
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# The webhook a piece of work belongs to; background tasks inherit it from the handler that started them
+_endpoint: ContextVar[str] = ContextVar('metrics_endpoint', default='background')
+_trace_id: ContextVar[str] = ContextVar('trace_id', default='')
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return '\n'.join(lines + self.samples())
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: a count per bucket (not cumulative), the sum and the total count
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        lines = []
+        names = self.labelnames + ('le',)
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (le,))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'assistant_stage_duration_seconds', "Latency of external calls, by stage and the webhook they served",
+    ('stage', 'endpoint'))
+STAGE_IN_FLIGHT = registry.gauge(
+    'assistant_stage_in_flight', "External calls currently running, by stage", ('stage',))
+STAGE_ERRORS = registry.counter(
+    'assistant_stage_errors_total', "External calls that raised or got an error response", ('stage', 'endpoint'))
+STAGE_BYTES = registry.counter(
+    'assistant_stage_bytes_total', "Bytes sent to and received from external services", ('stage', 'direction'))
+REQUEST_SECONDS = registry.histogram(
+    'assistant_request_duration_seconds', "Webhook handling time", ('endpoint', 'method', 'status'))
+REQUESTS_IN_FLIGHT = registry.gauge(
+    'assistant_requests_in_flight', "Webhooks being handled and media streams open", ('endpoint',))
+REQUEST_ERRORS = registry.counter(
+    'assistant_request_errors_total', "Webhooks that failed with a 5xx or an exception", ('endpoint',))
+RESPONSE_BYTES = registry.counter(
+    'assistant_response_bytes_total', "Response body bytes sent, e.g. audio served to Twilio", ('endpoint',))
+
+
+def trace_id_for(call_sid: str) -> str:
+    """A stable 32-hex-digit trace ID for a call, so every log line and record of one call shares it."""
+    return hashlib.sha256(call_sid.encode()).hexdigest()[:32] if call_sid else ''
+
+
+def bind_call(call_sid: str) -> str:
+    """Tag the current request (and the background work it starts) with the call's trace ID."""
+    trace_id = trace_id_for(call_sid)
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+def current_trace_id() -> str:
+    return _trace_id.get()
+
+
+def current_endpoint() -> str:
+    return _endpoint.get()
+
+
+class StageSpan:
+    """One external call being tracked. Callers add byte counts and flag error responses."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.error = False
+
+    def add_bytes(self, sent: int = 0, received: int = 0):
+        if sent:
+            STAGE_BYTES.inc(sent, stage=self.stage, direction='sent')
+        if received:
+            STAGE_BYTES.inc(received, stage=self.stage, direction='received')
+
+
+@contextmanager
+def track(stage: str) -> Iterator[StageSpan]:
+    """Time an external call and count it in flight; exceptions count as errors, cancellation doesn't."""
+    span = StageSpan(stage)
+    endpoint = _endpoint.get()
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    started = time.perf_counter()
+    try:
+        yield span
+    except Exception:
+        span.error = True
+        raise
+    finally:
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, endpoint=endpoint)
+        if span.error:
+            STAGE_ERRORS.inc(stage=stage, endpoint=endpoint)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Record a latency measured elsewhere, e.g. the time to the first chunk of a stream."""
+    STAGE_SECONDS.observe(seconds, stage=stage, endpoint=_endpoint.get())
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every webhook and counting open media streams, labeled by route
+    path (not the raw URL, so /audio/{filename} is one series). Responses of requests bound
+    to a call carry its trace ID in X-Trace-Id.
+    """
+
+    def __init__(self, app, routes: list):
+        self.app = app
+        self.routes = routes
+
+    def _endpoint(self, scope) -> str:
+        partial = None
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        return partial or 'unmatched'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        endpoint_token = _endpoint.set(endpoint)
+        trace_token = _trace_id.set('')
+        status = 500
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                trace_id = _trace_id.get()
+                if trace_id:
+                    message['headers'] = list(message.get('headers', [])) + [(b'x-trace-id', trace_id.encode())]
+            elif message['type'] == 'http.response.body':
+                RESPONSE_BYTES.inc(len(message.get('body', b'')), endpoint=endpoint)
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException:
+            status = 500
+            if scope['type'] == 'websocket':
+                REQUEST_ERRORS.inc(endpoint=endpoint)
+            raise
+        finally:
+            REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+            if scope['type'] == 'http':
+                REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint,
+                                        method=scope['method'], status=str(status))
+                if status >= 500:
+                    REQUEST_ERRORS.inc(endpoint=endpoint)
+            _trace_id.reset(trace_token)
+            _endpoint.reset(endpoint_token)
@@ -1,17 +1,32 @@
+"""
+Creates customers, accounts and purchases in the Nessie API.
+
+    python -m api.utils.nessie_generation
+        Three demo customers and the merchants, written to customer_data.py.
+
+    python -m api.utils.nessie_generation --customers 20000 --years 3 --output customers.jsonl
+        Bulk seeding for load tests (see seed_customers): concurrent, resumable and deterministic.
+        Output is JSONL, or SQLite for a .db/.sqlite path; either can be CUSTOMER_DIRECTORY_PATH.
+"""
 import requests
 import json
-from datetime import datetime, timedelta
+import math
+import sqlite3
+import asyncio
+import argparse
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional, Set
+import httpx
 from dotenv import load_dotenv
 import os
 import random
+from api.services.http_client import http_clients
+from api.services.nessie_service import NESSIE_BASE_URL
 
 load_dotenv()
 API_KEY = os.getenv('NESSIE_API_KEY')
-if not API_KEY:
-    print("Error: NESSIE_API_KEY not found in .env file or environment.")
-    exit()
 
-BASE_URL = 'http://api.nessieisreal.com'
+BASE_URL = NESSIE_BASE_URL
 HEADERS = {'Content-Type': 'application/json', 'Accept': 'application/json'}
 PARAMS = {'key': API_KEY}
 
@@ -22,6 +37,7 @@ customer_id_map = {}
 customer_account_id_map = {}
 customer_security_map = {}
 merchant_id_map = {}
+merchant_category_map = {}
 
 SECURITY_ANSWERS = {
     "Alice": {
@@ -162,6 +178,7 @@ def create_merchant(merchant):
         merchant_id = response.json().get('objectCreated', {}).get('_id')
         if merchant_id:
             merchant_id_map[merchant['name']] = merchant_id
+            merchant_category_map[merchant_id] = merchant['category']
             print(f"Created merchant '{merchant['name']}' with ID {merchant_id}")
             return merchant_id
     except requests.exceptions.RequestException as e:
@@ -188,7 +205,7 @@ def create_purchases(account_id, num_purchases=10):
             print(f"Error creating purchase {i+1} for account {account_id}: {e}")
             break
 
-def main():
+def create_demo_data():
     # Step 1: create merchants
     for merchant in MERCHANTS:
         create_merchant(merchant)
@@ -218,10 +235,325 @@ def main():
             f.write(f"customer_id_map = {json.dumps(customer_id_map, indent=4)}\n\n")
             f.write(f"customer_account_id_map = {json.dumps(customer_account_id_map, indent=4)}\n\n")
             f.write(f"customer_security_map = {json.dumps(customer_security_map, indent=4)}\n\n")
-            f.write(f"merchant_id_map = {json.dumps(merchant_id_map, indent=4)}\n")
+            f.write(f"merchant_id_map = {json.dumps(merchant_id_map, indent=4)}\n\n")
+            f.write(f"merchant_category_map = {json.dumps(merchant_category_map, indent=4)}\n")
         print(f"Customer data written to {CUSTOMER_DATA_FILE}")
     except IOError as e:
         print(f"Error writing file: {e}")
 
+# --- Bulk seeding ---
+
+# Customer names are built from these, so every seed index gets a distinct, pronounceable name
+NAME_SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ne', 'so', 'ti', 'va', 'de', 'li', 'ma', 'no', 'ri', 'sa',
+                  'te', 'vo', 'be', 'da', 'fi', 'go', 'ha', 'je', 'ku', 'la', 'me', 'ni', 'pa', 'ro',
+                  'su', 'ta', 've', 'yo', 'zi', 'an', 'el', 'or', 'is', 'um', 'ar', 'en']
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+              "Martinez", "Lopez", "Wilson", "Anderson", "Taylor", "Thomas", "Moore", "Jackson", "Lee"]
+PET_NAMES = ["Bobby", "Max", "Whiskers", "Bella", "Charlie", "Luna", "Rocky", "Daisy", "Milo", "Coco",
+             "Buddy", "Ginger", "Oscar", "Pepper", "Shadow", "Sunny"]
+CITIES = ["Austin", "San Francisco", "New York", "Chicago", "Seattle", "Boston", "Denver", "Miami",
+          "Atlanta", "Portland", "Phoenix", "Dallas", "Nashville", "Detroit", "Houston", "Philadelphia"]
+SECURITY_QUESTIONS = list(SECURITY_ANSWERS["Alice"])
+# Median purchase amount per merchant category; amounts are lognormal around it
+CATEGORY_MEDIAN_AMOUNTS = {
+    "Coffee Shop": 6, "Restaurant": 14, "Grocery": 55, "Retail": 40, "Electronics": 180,
+    "Transportation": 18, "Bookstore": 22
+}
+# Customers are written and synced to the output after each batch
+SEED_BATCH_SIZE = 200
+SEED_CONCURRENCY = 32
+
+
+def seeded_name(index: int, seed: int) -> str:
+    """The customer name for a seed index: distinct for every index, and the same for every run with this seed."""
+    syllables = NAME_SYLLABLES[:]
+    random.Random(seed).shuffle(syllables)
+    base = len(syllables)
+    # Two-syllable names first, then three, and so on
+    length, first = 2, 0
+    while index >= first + base ** length:
+        first += base ** length
+        length += 1
+    offset = index - first
+    parts = []
+    for _ in range(length):
+        offset, digit = divmod(offset, base)
+        parts.append(syllables[digit])
+    return ''.join(parts)
+
+
+def customer_plan(index: int, seed: int, years: float, purchases_per_month: float, end_date: date,
+                  merchants: Dict[str, str], categories: Dict[str, str]) -> dict:
+    """
+    Everything about one seeded customer, derived only from the seed and index, so a
+    resumed or re-run seeding creates the same customers whatever order they finish in.
+    """
+    rng = random.Random(f"{seed}:{index}")
+    name = seeded_name(index, seed)
+    answers = [rng.choice(LAST_NAMES), rng.choice(PET_NAMES), rng.choice(CITIES)]
+    # Each customer favours a few merchants
+    merchant_names = sorted(merchants)
+    weights = [rng.random() ** 3 for _ in merchant_names]
+    days = max(1, int(years * 365))
+    count = max(0, round(rng.gauss(purchases_per_month, purchases_per_month / 4) * days / 30))
+    purchases = []
+    for _ in range(count):
+        merchant_name = rng.choices(merchant_names, weights)[0]
+        category = categories.get(merchants[merchant_name], 'Retail')
+        median = CATEGORY_MEDIAN_AMOUNTS.get(category, 30)
+        purchases.append({
+            "merchant_id": merchants[merchant_name],
+            "medium": "balance",
+            "purchase_date": (end_date - timedelta(days=rng.randrange(days))).isoformat(),
+            "status": "completed",
+            "amount": round(median * math.exp(rng.gauss(0, 0.6)), 2),
+            "description": f"{merchant_name} purchase"
+        })
+    purchases.sort(key=lambda p: p['purchase_date'])
+    return {
+        'index': index,
+        'name': name,
+        'last_name': rng.choice(LAST_NAMES),
+        'security': dict(zip(SECURITY_QUESTIONS, answers)),
+        'balance': round(rng.uniform(100, 25000), 2),
+        'purchases': purchases
+    }
+
+
+class SeedOutput:
+    """
+    Seeded customers in the format customer_directory reads: JSONL, or SQLite for a .db/.sqlite
+    path. It doubles as the checkpoint; indices already in it are skipped on resume. A sidecar
+    .meta.json records the seed settings, so a resume can't silently mix two different datasets.
+    """
+
+    def __init__(self, path: str, settings: dict):
+        self.path = path
+        self._check_settings(settings)
+        self.sqlite = path.endswith(('.db', '.sqlite', '.sqlite3'))
+        if self.sqlite:
+            self._db = sqlite3.connect(path)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS customers (
+                seed_index INTEGER PRIMARY KEY, name TEXT NOT NULL, customer_id TEXT NOT NULL,
+                account_id TEXT, security TEXT, purchases INTEGER)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS customers_name ON customers (name)")
+            self._db.commit()
+        else:
+            self._drop_unfinished_line(path)
+            self._file = open(path, 'a')
+
+    @staticmethod
+    def _drop_unfinished_line(path: str):
+        """Cut a last line left unfinished by a crash, so the next record starts on a line of its own."""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            end = position = f.seek(0, os.SEEK_END)
+            while position > 0:
+                step = min(4096, position)
+                f.seek(position - step)
+                newline = f.read(step).rfind(b'\n')
+                if newline != -1:
+                    position += newline + 1 - step
+                    break
+                position -= step
+            if position < end:
+                print(f"[Seed] Dropping an unfinished last line from {path}")
+                f.truncate(position)
+
+    @staticmethod
+    def previous_settings(path: str) -> Optional[dict]:
+        """The settings an existing output was seeded with, if any."""
+        try:
+            with open(f"{path}.meta.json") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _check_settings(self, settings: dict):
+        previous = self.previous_settings(self.path)
+        if previous is None:
+            with open(f"{self.path}.meta.json", 'w') as f:
+                json.dump(settings, f)
+        elif previous != settings:
+            raise ValueError(f"{self.path} was seeded with {previous}, not {settings}; use another output path")
+
+    def done(self) -> Set[int]:
+        """Seed indices already written."""
+        if self.sqlite:
+            return {row[0] for row in self._db.execute("SELECT seed_index FROM customers")}
+        done = set()
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)['index'])
+                except (ValueError, KeyError):
+                    # Not a seeded customer record; that index is seeded again
+                    pass
+        return done
+
+    def write(self, record: dict):
+        if self.sqlite:
+            self._db.execute(
+                "INSERT OR REPLACE INTO customers VALUES (?, ?, ?, ?, ?, ?)",
+                (record['index'], record['name'], record['customer_id'], record['account_id'],
+                 json.dumps(record['security']), record['purchases'])
+            )
+        else:
+            self._file.write(json.dumps(record) + '\n')
+
+    def sync(self):
+        """Make everything written so far durable; called after every batch."""
+        if self.sqlite:
+            self._db.commit()
+        else:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self.sync()
+        if self.sqlite:
+            self._db.close()
+        else:
+            self._file.close()
+
+
+class Seeder:
+    """
+    Creates planned customers with at most `concurrency` Nessie requests in flight. A customer
+    is written to the output only once its account and every purchase exist, so a customer
+    that fails part-way is created again on the next run (the partial one stays in Nessie).
+    """
+
+    def __init__(self, client: httpx.AsyncClient, output: SeedOutput, concurrency: int = SEED_CONCURRENCY,
+                 purchase_client: httpx.AsyncClient = None):
+        self.client = client
+        # Purchases may go through a client that retries POSTs; see seed_customers
+        self.purchase_client = purchase_client or client
+        self.output = output
+        self._slots = asyncio.Semaphore(concurrency)
+        self.created = 0
+        self.failed = 0
+        self.requests = 0
+
+    async def _post(self, path: str, payload: dict, client: httpx.AsyncClient = None) -> str:
+        """POST one object and return its ID."""
+        async with self._slots:
+            self.requests += 1
+            response = await (client or self.client).post(f"{BASE_URL}{path}", params=PARAMS, json=payload)
+        response.raise_for_status()
+        object_id = response.json().get('objectCreated', {}).get('_id')
+        if not object_id:
+            raise ValueError(f"No ID in response to POST {path}")
+        return object_id
+
+    async def seed_customer(self, plan: dict):
+        try:
+            customer_id = await self._post('/customers', {
+                "first_name": plan['name'].capitalize(),
+                "last_name": plan['last_name'],
+                "address": {"street_number": str(100 + plan['index'] % 900), "street_name": "Main St",
+                            "city": "Anytown", "state": "VA", "zip": "12345"}
+            })
+            account_id = await self._post(f'/customers/{customer_id}/accounts', {
+                "type": "Checking",
+                "nickname": f"{plan['name'].capitalize()}'s Checking",
+                "rewards": 0,
+                "balance": plan['balance']
+            })
+            for purchase in plan['purchases']:
+                await self._post(f'/accounts/{account_id}/purchases', purchase, self.purchase_client)
+        except (httpx.HTTPError, ValueError) as e:
+            self.failed += 1
+            print(f"Error seeding customer {plan['index']} ({plan['name']}): {e}")
+            return
+        self.output.write({
+            'index': plan['index'],
+            'name': plan['name'],
+            'customer_id': customer_id,
+            'account_id': account_id,
+            'security': plan['security'],
+            'purchases': len(plan['purchases'])
+        })
+        self.created += 1
+
+
+async def seed_customers(customers: int, output_path: str, seed: int = 0, years: float = 1.0,
+                         purchases_per_month: float = 10.0, end_date: Optional[date] = None,
+                         concurrency: int = SEED_CONCURRENCY, batch_size: int = SEED_BATCH_SIZE,
+                         max_failures: int = 100):
+    """
+    Seed customers 0..customers-1 into Nessie in batches, skipping any already in the output.
+    Purchases go to the merchants in customer_data.py, which the app knows by ID. Stops early
+    after max_failures failed customers; run again with the same arguments to resume.
+    """
+    from api.utils import customer_data
+    merchants, categories = customer_data.merchant_id_map, customer_data.merchant_category_map
+    if not merchants:
+        raise ValueError("customer_data.py has no merchants; run without --customers first to create them")
+
+    if end_date is None:
+        # A resumed run keeps the original end date, even on a later day
+        previous = SeedOutput.previous_settings(output_path)
+        end_date = date.fromisoformat(previous['end_date']) if previous else date.today()
+    settings = {'seed': seed, 'years': years, 'purchases_per_month': purchases_per_month,
+                'end_date': end_date.isoformat()}
+    output = SeedOutput(output_path, settings)
+    # A retried customer or account POST that had gone through would leave a duplicate in Nessie,
+    # so only purchases, where a duplicate in seeded data is harmless, are retried
+    client = http_clients.async_client('nessie_seed')
+    purchase_client = http_clients.async_client('nessie_seed_purchases', retry_post=True)
+    seeder = Seeder(client, output, concurrency, purchase_client)
+    todo = sorted(set(range(customers)) - output.done())
+    print(f"Seeding {len(todo)} of {customers} customers into {output_path} ({customers - len(todo)} already done)")
+    started = datetime.now()
+    try:
+        for start in range(0, len(todo), batch_size):
+            batch = todo[start:start + batch_size]
+            plans = [customer_plan(i, seed, years, purchases_per_month, end_date, merchants, categories)
+                     for i in batch]
+            await asyncio.gather(*(seeder.seed_customer(plan) for plan in plans))
+            output.sync()
+            elapsed = (datetime.now() - started).total_seconds()
+            print(f"[Seed] {seeder.created}/{len(todo)} customers, {seeder.requests} requests "
+                  f"({seeder.requests / max(elapsed, 0.001):.0f}/s), {seeder.failed} failed")
+            if seeder.failed >= max_failures:
+                print(f"[Seed] Stopping after {seeder.failed} failures; run again to resume")
+                break
+    finally:
+        output.close()
+        await http_clients.aclose()
+    return seeder
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, help="bulk-seed this many customers instead of the demo data")
+    parser.add_argument('--output', default='customers.jsonl', help=".jsonl, or .db/.sqlite for SQLite")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--years', type=float, default=1.0, help="years of purchase history per customer")
+    parser.add_argument('--purchases-per-month', type=float, default=10.0)
+    parser.add_argument('--end-date', type=date.fromisoformat, default=None,
+                        help="last purchase date (YYYY-MM-DD, default today); recorded so resumes match")
+    parser.add_argument('--concurrency', type=int, default=SEED_CONCURRENCY, help="Nessie requests in flight")
+    parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE)
+    parser.add_argument('--max-failures', type=int, default=100)
+    args = parser.parse_args()
+
+    if not API_KEY:
+        print("Error: NESSIE_API_KEY not found in .env file or environment.")
+        return
+    if args.customers is None:
+        create_demo_data()
+        return
+    try:
+        asyncio.run(seed_customers(
+            args.customers, args.output, seed=args.seed, years=args.years,
+            purchases_per_month=args.purchases_per_month, end_date=args.end_date,
+            concurrency=args.concurrency, batch_size=args.batch_size, max_failures=args.max_failures
+        ))
+    except ValueError as e:
+        print(f"Error: {e}")
+
 if __name__ == "__main__":
     main()
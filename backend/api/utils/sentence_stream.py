@@ -0,0 +1,51 @@
+# Splitting streamed model output into speakable sentences, so each can be synthesized as soon as it is complete
+import re
+from typing import List
+
+HANGUP_TOKEN = "[HANGUP]"
+# Shorter sentences are joined to the next one; tiny fragments sound choppy when synthesized alone
+SENTENCE_MIN_CHARS = 20
+# End punctuation (with closing quotes or brackets) followed by whitespace, or a line break
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+["\')\]]*\s+|\n+')
+ABBREVIATIONS = re.compile(r'\b(Mr|Mrs|Ms|Dr|St|Jr|Sr|vs|etc|approx|e\.g|i\.e)$', re.IGNORECASE)
+
+
+class SentenceSplitter:
+    """
+    Turns text fed in arbitrary chunks into whole sentences. A sentence is only emitted once
+    the whitespace after it has arrived, so "$12." followed by "50" is never cut, and anything
+    after the last boundary stays buffered. That also means a [HANGUP] token split across
+    chunks ("[HANG" + "UP]") is reassembled before it could be spoken; it is removed from the
+    text and reported through the hangup attribute.
+    """
+
+    def __init__(self, min_chars: int = SENTENCE_MIN_CHARS):
+        self.min_chars = min_chars
+        self.hangup = False
+        self._buffer = ''
+
+    def feed(self, chunk: str) -> List[str]:
+        """Add the next piece of text and return the sentences it completed."""
+        self._buffer += chunk
+        if HANGUP_TOKEN in self._buffer:
+            self.hangup = True
+            self._buffer = self._buffer.replace(HANGUP_TOKEN, ' ')
+
+        sentences = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(self._buffer):
+            sentence = self._buffer[start:match.end()].strip()
+            if ABBREVIATIONS.search(self._buffer[start:match.start()]) or len(sentence) < self.min_chars:
+                continue
+            sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def close(self) -> List[str]:
+        """Return whatever is left once the stream has ended."""
+        rest = self._buffer.replace(HANGUP_TOKEN, ' ').strip()
+        if HANGUP_TOKEN in self._buffer:
+            self.hangup = True
+        self._buffer = ''
+        return [rest] if rest else []
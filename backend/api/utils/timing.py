@@ -0,0 +1,86 @@
+# Per-stage timings for request pipelines, so overlapping stages and the critical path can be inspected
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, List
+from api.utils.metrics import current_trace_id
+
+# How many finished pipelines to keep for /stats/turns
+TURN_TIMINGS_KEPT = int(os.getenv('TURN_TIMINGS_KEPT', '100'))
+
+
+class StageTimer:
+    """Start and end offsets of each named stage of one pipeline run."""
+
+    def __init__(self, label: str):
+        self.label = label
+        # Of the call being handled, so timings can be matched with its metrics and logs
+        self.trace_id = current_trace_id()
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.stages: Dict[str, tuple[float, float]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter() - self._origin
+        try:
+            yield
+        finally:
+            self.stages[name] = (start, time.perf_counter() - self._origin)
+
+    async def run(self, name: str, awaitable: Awaitable) -> Any:
+        """Await something as a named stage. Stages run concurrently keep their own spans."""
+        with self.stage(name):
+            return await awaitable
+
+    def mark(self, name: str):
+        """Record a point in time, e.g. when the first sentence of a reply was ready."""
+        now = time.perf_counter() - self._origin
+        self.stages.setdefault(name, (now, now))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._origin
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'label': self.label,
+            'trace_id': self.trace_id,
+            'started_at': self.started_at,
+            'total_ms': round(self.elapsed() * 1000, 1),
+            'stages': {
+                name: {
+                    'start_ms': round(start * 1000, 1),
+                    'end_ms': round(end * 1000, 1),
+                    'duration_ms': round((end - start) * 1000, 1)
+                }
+                for name, (start, end) in sorted(self.stages.items(), key=lambda item: item[1])
+            }
+        }
+
+    def summary(self) -> str:
+        spans = ', '.join(f"{name} {start * 1000:.0f}-{end * 1000:.0f}ms"
+                          for name, (start, end) in sorted(self.stages.items(), key=lambda item: item[1]))
+        trace = f" [trace {self.trace_id}]" if self.trace_id else ''
+        return f"{self.label}{trace}: {spans} (total {self.elapsed() * 1000:.0f}ms)"
+
+
+class TimingLog:
+    """The most recent finished pipeline timings."""
+
+    def __init__(self, maxlen: int = TURN_TIMINGS_KEPT):
+        self._entries = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, timer: StageTimer):
+        print(f"[Timing] {timer.summary()}")
+        with self._lock:
+            self._entries.append(timer.to_dict())
+
+    def recent(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._entries)
+
+
+turn_timings = TimingLog()
@@ -0,0 +1,161 @@
+# Compact spending summaries of an account's transactions, sent to Gemini instead of the raw transaction list
+import os
+import math
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List
+from api.utils.customer_data import merchant_id_map, merchant_category_map
+
+# Rough upper bound on the summary's size in the prompt
+SUMMARY_TOKEN_BUDGET = int(os.getenv('SUMMARY_TOKEN_BUDGET', '300'))
+# Purchases this many standard deviations above the account's mean are flagged
+SUMMARY_ANOMALY_Z_SCORE = float(os.getenv('SUMMARY_ANOMALY_Z_SCORE', '2.5'))
+# Purchases this many times a merchant's usual amount are flagged
+SUMMARY_MERCHANT_SPIKE_RATIO = 3.0
+# Histories spanning more days than this are bucketed by month instead of by week
+SUMMARY_WEEKLY_SPAN_DAYS = 62
+# Average characters per token for English text and numbers
+CHARS_PER_TOKEN = 4
+
+merchant_names = {merchant_id: name for name, merchant_id in merchant_id_map.items()}
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _parse_date(value: str):
+    try:
+        return date.fromisoformat(value[:10])
+    except (TypeError, ValueError):
+        return None
+
+
+def summarize_transactions(transactions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Category and merchant totals, date-bucketed spend and anomaly flags for a list of
+    transactions (as returned by NessieBankService). Totals are accumulated in one pass
+    and anomalies in a second, so the cost is linear in the history length.
+    """
+    count = 0
+    total = 0.0
+    sum_squares = 0.0
+    by_category = defaultdict(float)
+    by_merchant = defaultdict(lambda: [0.0, 0])
+    by_day = defaultdict(float)
+    seen_charges = set()
+    duplicates = []
+    rows = []
+
+    for transaction in transactions:
+        spend = -transaction.get('amount', 0.0)
+        merchant_id = transaction.get('merchantId')
+        merchant = merchant_names.get(merchant_id) or transaction.get('description') or 'Unknown'
+        category = merchant_category_map.get(merchant_id, 'Other')
+        day = _parse_date(transaction.get('date'))
+
+        count += 1
+        total += spend
+        sum_squares += spend * spend
+        by_category[category] += spend
+        merchant_totals = by_merchant[merchant]
+        merchant_totals[0] += spend
+        merchant_totals[1] += 1
+        if day is not None:
+            by_day[day] += spend
+
+        charge = (merchant, round(spend, 2), day)
+        if charge in seen_charges:
+            duplicates.append(charge)
+        seen_charges.add(charge)
+        rows.append((day, merchant, spend))
+
+    if not count:
+        return {'count': 0}
+
+    mean = total / count
+    std = math.sqrt(max(sum_squares / count - mean * mean, 0.0))
+    anomalies = []
+    for day, merchant, spend in rows:
+        merchant_total, merchant_count = by_merchant[merchant]
+        typical = (merchant_total - spend) / (merchant_count - 1) if merchant_count > 2 else None
+        if std and (spend - mean) / std >= SUMMARY_ANOMALY_Z_SCORE:
+            anomalies.append((day, merchant, spend, f"{(spend - mean) / std:.1f} sd above average"))
+        elif typical and spend >= SUMMARY_MERCHANT_SPIKE_RATIO * typical:
+            anomalies.append((day, merchant, spend, f"{spend / typical:.1f}x usual at this merchant"))
+    for merchant, spend, day in duplicates:
+        anomalies.append((day, merchant, spend, "possible duplicate charge"))
+
+    days = sorted(by_day)
+    weekly = bool(days) and (days[-1] - days[0]).days <= SUMMARY_WEEKLY_SPAN_DAYS
+    buckets = defaultdict(float)
+    for day in days:
+        if weekly:
+            year, week, _ = day.isocalendar()
+            buckets[f"{year}-W{week:02d}"] += by_day[day]
+        else:
+            buckets[day.strftime('%Y-%m')] += by_day[day]
+
+    recent = sorted((row for row in rows if row[0] is not None), key=lambda row: row[0], reverse=True)
+    return {
+        'count': count,
+        'first_date': days[0].isoformat() if days else None,
+        'last_date': days[-1].isoformat() if days else None,
+        'total': total,
+        'average': mean,
+        'categories': sorted(by_category.items(), key=lambda item: item[1], reverse=True),
+        'merchants': sorted(((name, totals[0], totals[1]) for name, totals in by_merchant.items()),
+                            key=lambda item: item[1], reverse=True),
+        'bucket': 'week' if weekly else 'month',
+        'buckets': sorted(buckets.items()),
+        'anomalies': sorted(anomalies, key=lambda item: item[2], reverse=True),
+        'recent': recent,
+    }
+
+
+def render_summary(summary: Dict[str, Any], token_budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """Render a summary as short text lines, shortening the longest sections until it fits the budget."""
+    if not summary.get('count'):
+        return "No transactions on record."
+
+    limits = {'categories': 6, 'merchants': 5, 'buckets': 6, 'anomalies': 4, 'recent': 5}
+    # Least useful sections are shortened first
+    trim_order = ['recent', 'buckets', 'merchants', 'categories', 'anomalies']
+
+    def render() -> str:
+        lines = [
+            f"{summary['count']} purchases {summary['first_date']} to {summary['last_date']}, "
+            f"total ${summary['total']:.2f}, average ${summary['average']:.2f}"
+        ]
+        sections = [
+            ('categories', "By category", lambda c: f"{c[0]} ${c[1]:.0f} ({c[1] / (summary['total'] or 1):.0%})"),
+            ('merchants', "Top merchants", lambda m: f"{m[0]} ${m[1]:.0f}/{m[2]}x"),
+            ('buckets', f"Spend by {summary['bucket']}", lambda b: f"{b[0]} ${b[1]:.0f}"),
+            ('anomalies', "Flags", lambda a: f"{a[0]} {a[1]} ${a[2]:.2f} {a[3]}"),
+            ('recent', "Latest", lambda r: f"{r[0]} {r[1]} ${r[2]:.2f}"),
+        ]
+        for key, title, fmt in sections:
+            items = summary[key][-limits[key]:] if key == 'buckets' else summary[key][:limits[key]]
+            if items:
+                lines.append(f"{title}: " + "; ".join(fmt(item) for item in items))
+        return "\n".join(lines)
+
+    text = render()
+    while estimate_tokens(text) > token_budget and any(limits.values()):
+        key = next((k for k in trim_order if limits[k] > 1), None) or next(k for k in trim_order if limits[k])
+        limits[key] -= 1
+        text = render()
+    return text
+
+
+def transactions_for_prompt(result: Dict[str, Any], token_budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """The account-data part of a Gemini message: a compact summary plus how much smaller it is than the raw data."""
+    if not result.get('success'):
+        return f"Transactions unavailable ({result.get('error', 'unknown error')})."
+    transactions = result.get('transactions', [])
+    text = render_summary(summarize_transactions(transactions), token_budget)
+    raw_tokens = estimate_tokens(repr(result))
+    summary_tokens = estimate_tokens(text)
+    reduction = 1 - summary_tokens / raw_tokens if raw_tokens else 0
+    return (f"{text}\n(Summarized locally from {len(transactions)} transactions: about {summary_tokens} tokens "
+            f"instead of {raw_tokens} for the raw list, {reduction:.0%} smaller.)")
@@ -0,0 +1,80 @@
+"""
+Compare ElevenLabs output formats for audio played with <Play>: bytes per utterance, synthesis
+latency, and how long the file takes to fetch.
+
+    python -m api.utils.tts_format_comparison --formats mp3_44100_128 ulaw_8000 --repeat 3
+
+Runs against the real API with ELEVENLABS_API_KEY, or against the stand-ins with STANDINS_URL.
+"""
+import time
+import asyncio
+import argparse
+import statistics
+from typing import Dict, List
+from api.services.elevenlabs_service import AsyncElevenLabsService
+from api.services.http_client import http_clients
+from api.utils.audio_codec import audio_byte_rate, audio_file_extension
+
+DEFAULT_FORMATS = ['mp3_44100_128', 'mp3_22050_32', 'ulaw_8000', 'pcm_8000', 'pcm_16000']
+SAMPLE_TEXTS = [
+    "Let me check that for you.",
+    "Hello, thank you for calling. To get started, please say your first name.",
+    "Your checking balance is $2,418.55. You spent $312.40 on restaurants this month, "
+    "which is about 20 percent more than last month.",
+]
+
+
+def transcoded_by_twilio(output_format: str) -> str:
+    """Phone calls carry 8 kHz mu-law; anything else is converted when Twilio plays it."""
+    if output_format == 'ulaw_8000':
+        return 'no'
+    if output_format == 'pcm_8000':
+        return 'encode only'
+    return 'yes'
+
+
+async def measure(service: AsyncElevenLabsService, output_format: str, repeat: int) -> Dict[str, float]:
+    sizes, latencies = [], []
+    for _ in range(repeat):
+        for text in SAMPLE_TEXTS:
+            started = time.perf_counter()
+            audio = await service.text_to_speech(text, output_format)
+            latencies.append(time.perf_counter() - started)
+            sizes.append(len(audio))
+    return {
+        'bytes': statistics.mean(sizes),
+        'latency_p50': statistics.median(latencies),
+        'latency_max': max(latencies),
+    }
+
+
+async def compare(formats: List[str], repeat: int, link_mbps: float):
+    service = AsyncElevenLabsService()
+    print(f"{len(SAMPLE_TEXTS)} utterances x {repeat}; fetch time at {link_mbps:g} Mbps\n")
+    print(f"{'format':<16}{'file':>6}{'bytes/s':>9}{'avg bytes':>11}{'vs mp3':>8}"
+          f"{'tts p50 ms':>12}{'tts max ms':>12}{'fetch ms':>10}  transcoded")
+    baseline = None
+    try:
+        for output_format in formats:
+            result = await measure(service, output_format, repeat)
+            baseline = baseline or result['bytes']
+            fetch_ms = result['bytes'] * 8 / (link_mbps * 1e6) * 1000
+            print(f"{output_format:<16}{audio_file_extension(output_format):>6}{audio_byte_rate(output_format):>9}"
+                  f"{result['bytes']:>11.0f}{result['bytes'] / baseline:>7.0%} "
+                  f"{result['latency_p50'] * 1000:>11.0f}{result['latency_max'] * 1000:>12.0f}{fetch_ms:>10.1f}"
+                  f"  {transcoded_by_twilio(output_format)}")
+    finally:
+        await http_clients.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--formats', nargs='+', default=DEFAULT_FORMATS, help="the first is the baseline")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--link-mbps', type=float, default=10.0, help="bandwidth for the fetch time estimate")
+    args = parser.parse_args()
+    asyncio.run(compare(args.formats, args.repeat, args.link_mbps))
+
+
+if __name__ == "__main__":
+    main()
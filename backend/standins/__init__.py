@@ -0,0 +1,11 @@
+"""
+Local stand-ins for the services the assistant calls, for benchmarking and testing the call
+flow without accounts or network access:
+
+- server.py: one HTTP server faking the Nessie API, ElevenLabs TTS/STT and Twilio recordings
+- fake_gemini.py: an in-process replacement for the Gemini API behind google.generativeai
+- media_peer.py: a fake Twilio Media Streams peer for the stream and duplex voice modes
+- bench.py: drives simulated calls through api.main and reports latency percentiles
+
+Latency, error rates and payload sizes are set per service in config.py.
+"""
@@ -0,0 +1,228 @@
+"""
+Drive simulated calls through the app and report latency percentiles per endpoint.
+
+    python -m standins.bench --spawn --calls 50 --concurrency 10 --turns 3
+
+--spawn starts the stand-in server and the app (pointed at it with STANDINS_URL) as
+subprocesses; without it, both must already be running at --standins-url and --app-url.
+Each call walks the webhooks Twilio would: /voice, the name and security answer
+recordings, then --turns questions and a goodbye, following /turn-result redirects,
+fetching the audio it is told to play and joining media streams.
+"""
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import argparse
+import itertools
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Optional
+from xml.etree import ElementTree
+import httpx
+from dotenv import load_dotenv
+from twilio.request_validator import RequestValidator
+from api.utils.customer_directory import customer_directory
+from standins.server import recording_url
+
+load_dotenv()
+
+QUESTIONS = [
+    "What's my balance?",
+    "How much did I spend on restaurants this month?",
+    "Can you give me some budgeting tips?",
+    "What were my recent transactions?",
+]
+GOODBYE = "No thanks, that's all. Bye."
+
+_call_ids = itertools.count(1)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Bench:
+    def __init__(self, app_url: str, standins_url: str, turns: int, auth_token: str):
+        self.app_url = app_url.rstrip('/')
+        # The app checks signatures against its public URL, which is the app URL unless set otherwise
+        self.public_url = (os.getenv('PUBLIC_BASE_URL') or self.app_url).rstrip('/')
+        self.standins_url = standins_url
+        self.turns = turns
+        self.validator = RequestValidator(auth_token)
+        self.client = httpx.AsyncClient(timeout=60)
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.completed = 0
+        customers = [customer_directory.get(name) for name in sorted(customer_directory.names())]
+        self.customers = [c for c in customers if c is not None and c.security]
+
+    async def post(self, path: str, params: dict) -> Optional[ElementTree.Element]:
+        """POST a signed webhook and return the parsed TwiML."""
+        url = self.app_url + path
+        headers = {'X-Twilio-Signature': self.validator.compute_signature(self.public_url + path, params)}
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(url, data=params, headers=headers)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.errors[path] += 1
+            print(f"[Bench] POST {path} failed: {e}")
+            return None
+        self.timings[f"POST {path}"].append(time.perf_counter() - started)
+        return ElementTree.fromstring(response.text)
+
+    async def play(self, url: str):
+        """Fetch audio the way Twilio does for <Play>. Only the path is used, since the URL carries the public host."""
+        path = re.sub(r'^https?://[^/]+', '', url)
+        started = time.perf_counter()
+        try:
+            (await self.client.get(self.app_url + path)).raise_for_status()
+        except httpx.HTTPError as e:
+            self.errors['GET /audio'] += 1
+            print(f"[Bench] GET {path} failed: {e}")
+            return
+        self.timings['GET /audio'].append(time.perf_counter() - started)
+
+    async def join_stream(self, stream: ElementTree.Element, call_sid: str):
+        from standins.media_peer import MediaPeer
+        parameters = {p.get('name'): p.get('value') for p in stream.iter('Parameter')}
+        url = self.app_url.replace('http', 'ws', 1) + '/media-stream'
+        turns = self.turns if parameters.get('converse') == '1' else 0
+        # Twilio signs the handshake with the stream URL from the TwiML and no parameters
+        headers = {'X-Twilio-Signature': self.validator.compute_signature(stream.get('url'), {})}
+        try:
+            peer = await MediaPeer(url, call_sid, parameters, turns=turns, headers=headers).run()
+        except Exception as e:
+            self.errors['WS /media-stream'] += 1
+            print(f"[Bench] Media stream for {call_sid} failed: {e!r}")
+            return
+        self.timings['WS /media-stream first audio'].extend(peer.first_audio)
+
+    async def follow(self, twiml: Optional[ElementTree.Element], call_sid: str) -> Optional[str]:
+        """
+        Play out one TwiML document: fetch audio, join streams and follow redirects.
+        Returns the action of the <Record> to answer next, or None when the call ended.
+        """
+        while twiml is not None:
+            for verb in twiml:
+                if verb.tag == 'Play':
+                    await self.play(verb.text)
+                elif verb.tag == 'Connect':
+                    for stream in verb.iter('Stream'):
+                        await self.join_stream(stream, call_sid)
+                elif verb.tag == 'Record':
+                    return verb.get('action')
+                elif verb.tag == 'Hangup':
+                    return None
+                elif verb.tag == 'Redirect':
+                    twiml = await self.post(verb.text, {'CallSid': call_sid})
+                    break
+            else:
+                return None
+        return None
+
+    async def call(self):
+        call_sid = f"CAstandin{next(_call_ids):024d}"
+        customer = random.choice(self.customers)
+        answer = next(iter(customer.security.values()))
+        questions = random.sample(QUESTIONS, min(self.turns, len(QUESTIONS)))
+        questions += random.choices(QUESTIONS, k=self.turns - len(questions))
+        said = [customer.name, answer] + questions + [GOODBYE]
+
+        action = await self.follow(await self.post('/voice', {'CallSid': call_sid, 'From': '+15550100'}), call_sid)
+        for text in said:
+            if action is None:
+                break
+            params = {'CallSid': call_sid, 'RecordingUrl': recording_url(self.standins_url, text)}
+            action = await self.follow(await self.post(action, params), call_sid)
+        self.completed += 1
+
+    async def run(self, calls: int, concurrency: int):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                await self.call()
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(one() for _ in range(calls)))
+        finally:
+            await self.client.aclose()
+        self.report(time.perf_counter() - started)
+
+    def report(self, elapsed: float):
+        print(f"\n{self.completed} calls in {elapsed:.1f}s")
+        print(f"{'endpoint':<36}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for name in sorted(set(self.timings) | set(self.errors)):
+            values = self.timings.get(name, [])
+            row = [percentile(values, p) * 1000 for p in (50, 95, 99)] if values else [0, 0, 0]
+            print(f"{name:<36}{len(values):>7}{row[0]:>9.0f}{row[1]:>9.0f}{row[2]:>9.0f}{self.errors.get(name, 0):>8}")
+
+
+def wait_until_healthy(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} while starting")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become healthy within {timeout:.0f}s")
+
+
+def spawn(app_url: str, standins_url: str) -> list:
+    """Start the stand-in server and the app pointed at it."""
+    standins_port = standins_url.rsplit(':', 1)[1].strip('/')
+    app_port = app_url.rsplit(':', 1)[1].strip('/')
+    # Placeholder credentials; the stand-ins don't check them
+    for name in ('ELEVENLABS_API_KEY', 'ELEVENLABS_VOICE_ID', 'NESSIE_API_KEY', 'GOOGLE_API_KEY',
+                 'TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN'):
+        os.environ.setdefault(name, 'standin')
+    os.environ.setdefault('PUBLIC_BASE_URL', app_url)
+    env = dict(os.environ, STANDINS_URL=standins_url)
+    processes = [
+        subprocess.Popen([sys.executable, '-m', 'standins.server', '--port', standins_port], env=env),
+        subprocess.Popen([sys.executable, '-m', 'uvicorn', 'api.main:app', '--port', app_port, '--log-level', 'warning'], env=env),
+    ]
+    try:
+        wait_until_healthy(standins_url, processes[0])
+        wait_until_healthy(app_url, processes[1])
+    except Exception:
+        for process in processes:
+            process.terminate()
+        raise
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--standins-url', default=os.getenv('STANDINS_URL') or 'http://127.0.0.1:8900')
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=5)
+    parser.add_argument('--turns', type=int, default=3, help="questions per call before saying goodbye")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--spawn', action='store_true', help="start the stand-in server and the app")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    processes = spawn(args.app_url, args.standins_url) if args.spawn else []
+    try:
+        bench = Bench(args.app_url, args.standins_url, args.turns, os.getenv('TWILIO_AUTH_TOKEN') or '')
+        asyncio.run(bench.run(args.calls, args.concurrency))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import math
+import random
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+@dataclass
+class ServiceProfile:
+    """
+    How one stand-in behaves: a latency distribution, how often it fails, and payload sizes.
+    Every field can be set with STANDIN_<SERVICE>_<FIELD>, e.g. STANDIN_NESSIE_LATENCY_MS=150.
+    """
+    # Median latency; for streamed responses this is the time to the first chunk
+    latency_ms: float = 0.0
+    # Spread around the median: the half-width for 'uniform', the standard deviation for 'normal',
+    # and for 'lognormal' the distance to the 84th percentile
+    jitter_ms: float = 0.0
+    distribution: str = 'lognormal'  # 'fixed', 'uniform', 'normal' or 'lognormal'
+    # Share of requests answered with a 503
+    error_rate: float = 0.0
+    # Service-specific size: purchases per account, audio bytes per character, recording bytes, ...
+    payload_size: int = 0
+
+    @classmethod
+    def from_env(cls, service: str, **defaults) -> 'ServiceProfile':
+        profile = cls(**defaults)
+        prefix = f"STANDIN_{service.upper()}_"
+        return cls(
+            latency_ms=float(os.getenv(prefix + 'LATENCY_MS', profile.latency_ms)),
+            jitter_ms=float(os.getenv(prefix + 'JITTER_MS', profile.jitter_ms)),
+            distribution=os.getenv(prefix + 'DISTRIBUTION', profile.distribution),
+            error_rate=float(os.getenv(prefix + 'ERROR_RATE', profile.error_rate)),
+            payload_size=int(os.getenv(prefix + 'PAYLOAD_SIZE', profile.payload_size)),
+        )
+
+    def delay(self) -> float:
+        """One sampled latency, in seconds."""
+        median, spread = self.latency_ms, self.jitter_ms
+        if self.distribution == 'fixed' or not spread:
+            ms = median
+        elif self.distribution == 'uniform':
+            ms = random.uniform(median - spread, median + spread)
+        elif self.distribution == 'normal':
+            ms = random.gauss(median, spread)
+        elif median > 0:
+            # Long right tail, like real API latencies
+            ms = median * math.exp(random.gauss(0, math.log1p(spread / median)))
+        else:
+            ms = 0.0
+        return max(ms, 0.0) / 1000
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+
+NESSIE = ServiceProfile.from_env('nessie', latency_ms=120, jitter_ms=60, payload_size=200)
+# payload_size: audio bytes per character of text (about 1 KB/char for 128 kbps MP3 speech)
+TTS = ServiceProfile.from_env('tts', latency_ms=350, jitter_ms=150, payload_size=1000)
+# Streamed TTS: latency to the first chunk, then audio is paced at STANDIN_TTS_STREAM_SPEED x real time
+TTS_STREAM = ServiceProfile.from_env('tts_stream', latency_ms=250, jitter_ms=100, payload_size=530)
+STT = ServiceProfile.from_env('stt', latency_ms=400, jitter_ms=200)
+# payload_size: bytes of audio per recording
+TWILIO = ServiceProfile.from_env('twilio', latency_ms=80, jitter_ms=40, payload_size=48000)
+# latency: time to the first token; payload_size: sentences per reply
+GEMINI = ServiceProfile.from_env('gemini', latency_ms=600, jitter_ms=300, payload_size=3)
+
+TTS_STREAM_SPEED = float(os.getenv('STANDIN_TTS_STREAM_SPEED', '4'))
+GEMINI_TOKENS_PER_SECOND = float(os.getenv('STANDIN_GEMINI_TOKENS_PER_SECOND', '150'))
+# What fake STT hears when the audio doesn't carry a transcript (e.g. live media stream audio)
+STT_DEFAULT_TEXT = os.getenv('STANDIN_STT_DEFAULT_TEXT', "How much did I spend on restaurants this month?")
@@ -0,0 +1,149 @@
+"""
+In-process stand-in for the Gemini API. use_fake_gemini() swaps the API clients of a
+genai.GenerativeModel, so request building, function calling, streaming and chat history
+all still run through google.generativeai; only the network call is replaced.
+"""
+import time
+import random
+import asyncio
+from typing import AsyncIterator, Iterator, List
+import google.ai.generativelanguage as glm
+from google.api_core import exceptions
+from standins import config
+
+# Characters per streamed chunk, and per token when pacing the stream
+CHUNK_CHARS = 60
+CHARS_PER_TOKEN = 4
+
+GOODBYE_WORDS = ('bye', "that's all", 'that s all', 'no thanks', 'nothing else')
+SPENDING_WORDS = ('spend', 'spent', 'purchase', 'transaction', 'bought', 'categor', 'habit', 'restaurant')
+FILLER_SENTENCES = [
+    "Most of your spending goes to dining and retail, which is typical for this time of year.",
+    "Setting a weekly limit for restaurants could free up a noticeable amount each month.",
+    "Nothing in your recent activity looks unusual.",
+    "Your grocery spending has been steady over the last few weeks.",
+    "Moving a small fixed amount to savings right after payday is an easy habit to keep.",
+    "Subscriptions are worth reviewing every few months, since they add up quietly.",
+]
+
+
+def _caller_words(content: glm.Content) -> str:
+    """What the caller said, without the instructions AsyncGeminiService wraps around it."""
+    text = ''.join(part.text for part in content.parts if 'text' in part)
+    if 'User Input: ' in text:
+        text = text.split('User Input: ', 1)[1].split(' (User:', 1)[0]
+    return text
+
+
+def _filler(seed: str, sentences: int) -> str:
+    rng = random.Random(seed)
+    return ' '.join(rng.sample(FILLER_SENTENCES, min(sentences, len(FILLER_SENTENCES))))
+
+
+def _answer_function_results(content: glm.Content) -> str:
+    sentences = []
+    for part in content.parts:
+        if 'function_response' not in part:
+            continue
+        response = dict(part.function_response.response)
+        if not response.get('success'):
+            sentences.append("I'm sorry, I couldn't reach your account just now.")
+        elif part.function_response.name == 'get_account_balance':
+            sentences.append(f"Your {response.get('nickname', 'account')} balance is ${response.get('balance', 0):,.2f}.")
+        elif part.function_response.name == 'transfer_funds':
+            sentences.append("The transfer has been submitted.")
+        else:
+            sentences.append("I've looked through your recent purchases.")
+    return ' '.join(sentences)
+
+
+def reply_parts(request: glm.GenerateContentRequest) -> List[glm.Part]:
+    """What the fake model answers: function calls for account questions when tools are declared, otherwise text."""
+    last = request.contents[-1]
+    extra = max(config.GEMINI.payload_size - 1, 0)
+    if any('function_response' in part for part in last.parts):
+        text = _answer_function_results(last)
+        return [glm.Part(text=f"{text} {_filler(text, extra)}".strip())]
+
+    said = _caller_words(last)
+    lowered = said.lower()
+    if any(word in lowered for word in GOODBYE_WORDS):
+        return [glm.Part(text="Thank you for calling. Have a great day. [HANGUP]")]
+    if request.tools:
+        if 'balance' in lowered:
+            return [glm.Part(function_call=glm.FunctionCall(name='get_account_balance', args={}))]
+        if any(word in lowered for word in SPENDING_WORDS):
+            return [glm.Part(function_call=glm.FunctionCall(name='get_recent_transactions', args={'count': 5}))]
+    return [glm.Part(text=_filler(said, config.GEMINI.payload_size) or "How can I help you today?")]
+
+
+def _response(parts: List[glm.Part], finished: bool = True) -> glm.GenerateContentResponse:
+    finish_reason = glm.Candidate.FinishReason.STOP if finished else glm.Candidate.FinishReason.FINISH_REASON_UNSPECIFIED
+    return glm.GenerateContentResponse(candidates=[
+        glm.Candidate(index=0, content=glm.Content(role='model', parts=parts), finish_reason=finish_reason)
+    ])
+
+
+def _chunks(parts: List[glm.Part]) -> List[tuple]:
+    """The streamed chunks of a reply, each with the delay before it."""
+    first_delay = config.GEMINI.delay()
+    if len(parts) != 1 or 'text' not in parts[0]:
+        return [(first_delay, _response(parts))]
+    text = parts[0].text
+    pieces = [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)] or ['']
+    chunks = []
+    for i, piece in enumerate(pieces):
+        delay = first_delay if i == 0 else len(piece) / CHARS_PER_TOKEN / config.GEMINI_TOKENS_PER_SECOND
+        chunks.append((delay, _response([glm.Part(text=piece)], finished=i == len(pieces) - 1)))
+    return chunks
+
+
+def _check_failure():
+    if config.GEMINI.fails():
+        raise exceptions.ServiceUnavailable("Stand-in injected failure")
+
+
+class FakeGenerativeClient:
+    def generate_content(self, request: glm.GenerateContentRequest) -> glm.GenerateContentResponse:
+        parts = reply_parts(request)
+        time.sleep(sum(delay for delay, _ in _chunks(parts)))
+        _check_failure()
+        return _response(parts)
+
+    def stream_generate_content(self, request: glm.GenerateContentRequest) -> Iterator[glm.GenerateContentResponse]:
+        chunks = _chunks(reply_parts(request))
+        time.sleep(chunks[0][0])
+        _check_failure()
+
+        def stream():
+            for i, (delay, chunk) in enumerate(chunks):
+                if i:
+                    time.sleep(delay)
+                yield chunk
+        return stream()
+
+
+class FakeAsyncGenerativeClient:
+    async def generate_content(self, request: glm.GenerateContentRequest) -> glm.GenerateContentResponse:
+        parts = reply_parts(request)
+        await asyncio.sleep(sum(delay for delay, _ in _chunks(parts)))
+        _check_failure()
+        return _response(parts)
+
+    async def stream_generate_content(self, request: glm.GenerateContentRequest) -> AsyncIterator[glm.GenerateContentResponse]:
+        chunks = _chunks(reply_parts(request))
+        await asyncio.sleep(chunks[0][0])
+        _check_failure()
+
+        async def stream():
+            for i, (delay, chunk) in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(delay)
+                yield chunk
+        return stream()
+
+
+def use_fake_gemini(model):
+    """Answer a genai.GenerativeModel's requests with the stand-in instead of the Gemini API."""
+    model._client = FakeGenerativeClient()
+    model._async_client = FakeAsyncGenerativeClient()
@@ -0,0 +1,137 @@
+"""
+A fake Twilio Media Streams peer: connects to /media-stream the way Twilio does after a
+<Connect><Stream> verb, "plays" the audio it receives in real time (echoing marks once
+that audio would have been heard), and in duplex calls speaks turns of loud audio
+followed by silence so the server's voice activity detection ends each utterance.
+"""
+import json
+import time
+import base64
+import asyncio
+import itertools
+from typing import Dict, List, Optional
+import websockets
+
+FRAME_MS = 20
+FRAME_BYTES = 160  # 20 ms of 8 kHz mu-law
+# A full-scale square wave in mu-law, well above the server's VAD threshold
+SPEECH_FRAME = b'\x00\x80' * (FRAME_BYTES // 2)
+SILENCE_FRAME = b'\xff' * FRAME_BYTES
+# The assistant is done talking when every mark is echoed and no audio arrived for this long
+IDLE_SECONDS = 0.5
+
+_stream_ids = itertools.count(1)
+
+
+class MediaPeer:
+    def __init__(self, url: str, call_sid: str, parameters: Optional[Dict[str, str]] = None,
+                 turns: int = 0, speech_ms: int = 1200, silence_ms: int = 1000, timeout: float = 120,
+                 headers: Optional[Dict[str, str]] = None):
+        self.url = url
+        # Handshake headers, e.g. the X-Twilio-Signature Twilio sends
+        self.headers = headers or {}
+        self.call_sid = call_sid
+        self.parameters = parameters or {}
+        self.turns = turns
+        self.speech_ms = speech_ms
+        self.silence_ms = silence_ms
+        self.timeout = timeout
+        self.stream_sid = f"MZstandin{next(_stream_ids):024d}"
+        # Seconds from connecting, or from the end of each spoken turn, to the first reply audio
+        self.first_audio: List[float] = []
+        self.audio_bytes = 0
+        self._waiting_since: Optional[float] = None
+        self._last_audio = 0.0
+        self._playback_until = 0.0
+        self._pending_marks = 0
+
+    async def run(self) -> 'MediaPeer':
+        async with websockets.connect(self.url, extra_headers=self.headers) as ws:
+            await ws.send(json.dumps({'event': 'connected', 'protocol': 'Call', 'version': '1.0.0'}))
+            await ws.send(json.dumps({
+                'event': 'start',
+                'streamSid': self.stream_sid,
+                'start': {
+                    'streamSid': self.stream_sid,
+                    'callSid': self.call_sid,
+                    'tracks': ['inbound'],
+                    'mediaFormat': {'encoding': 'audio/x-mulaw', 'sampleRate': 8000, 'channels': 1},
+                    'customParameters': self.parameters
+                }
+            }))
+            self._waiting_since = time.perf_counter()
+            receiver = asyncio.create_task(self._receive(ws))
+            try:
+                await asyncio.wait_for(self._converse(ws, receiver), self.timeout)
+            finally:
+                receiver.cancel()
+        return self
+
+    async def _converse(self, ws, receiver: asyncio.Task):
+        for _ in range(self.turns):
+            if not await self._until_idle(receiver):
+                return
+            await self._speak(ws)
+        if self.turns:
+            # Hear the last reply out, then hang up
+            if await self._until_idle(receiver):
+                await ws.send(json.dumps({'event': 'stop', 'streamSid': self.stream_sid, 'stop': {'callSid': self.call_sid}}))
+        else:
+            # Stream mode: the server closes the stream once the reply has played
+            await asyncio.shield(receiver)
+
+    async def _until_idle(self, receiver: asyncio.Task) -> bool:
+        """Wait until the assistant has finished talking. False if the server closed the stream."""
+        while not receiver.done():
+            now = time.perf_counter()
+            if (self._waiting_since is None and not self._pending_marks
+                    and now - self._last_audio >= IDLE_SECONDS and now >= self._playback_until):
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    async def _speak(self, ws):
+        frames = [SPEECH_FRAME] * (self.speech_ms // FRAME_MS) + [SILENCE_FRAME] * (self.silence_ms // FRAME_MS)
+        started = time.perf_counter()
+        for i, frame in enumerate(frames):
+            await ws.send(json.dumps({
+                'event': 'media',
+                'streamSid': self.stream_sid,
+                'media': {'track': 'inbound', 'payload': base64.b64encode(frame).decode('ascii')}
+            }))
+            # Real time, like a phone line
+            await asyncio.sleep(max(0.0, started + (i + 1) * FRAME_MS / 1000 - time.perf_counter()))
+            if i == self.speech_ms // FRAME_MS - 1:
+                self._waiting_since = time.perf_counter()
+
+    async def _receive(self, ws):
+        try:
+            async for raw in ws:
+                message = json.loads(raw)
+                event = message.get('event')
+                now = time.perf_counter()
+                if event == 'media':
+                    audio = base64.b64decode(message['media']['payload'])
+                    if self._waiting_since is not None:
+                        self.first_audio.append(now - self._waiting_since)
+                        self._waiting_since = None
+                    self.audio_bytes += len(audio)
+                    self._last_audio = now
+                    self._playback_until = max(self._playback_until, now) + len(audio) / 8000
+                elif event == 'mark':
+                    self._pending_marks += 1
+                    asyncio.create_task(self._echo_mark(ws, message['mark']['name']))
+                elif event == 'clear':
+                    self._playback_until = now
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _echo_mark(self, ws, name: str):
+        """Twilio echoes a mark once the audio queued before it has played."""
+        try:
+            await asyncio.sleep(max(0.0, self._playback_until - time.perf_counter()))
+            await ws.send(json.dumps({'event': 'mark', 'streamSid': self.stream_sid, 'mark': {'name': name}}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._pending_marks -= 1
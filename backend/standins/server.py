@@ -0,0 +1,227 @@
+"""
+One HTTP server standing in for the Nessie API, ElevenLabs and Twilio recording downloads.
+
+    python -m standins.server --port 8900
+
+Then start the app with STANDINS_URL=http://127.0.0.1:8900 to point every service at it.
+"""
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+from datetime import date, timedelta
+from urllib.parse import quote
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from api.utils.audio_codec import audio_byte_rate
+from api.utils.customer_data import merchant_id_map
+from standins import config
+
+app = FastAPI()
+
+# Fake recordings carry the words they "contain", so fake STT can return them
+AUDIO_MARKER = b'STANDIN-AUDIO:'
+# Streamed TTS is sent in chunks of this many bytes
+TTS_STREAM_CHUNK_BYTES = 4000
+
+
+def fake_audio(text: str, size: int) -> bytes:
+    """Audio-sized bytes that fake STT transcribes as text."""
+    header = AUDIO_MARKER + text.encode() + b'\n'
+    return header + b'\0' * max(0, size - len(header))
+
+
+def transcript_of(audio: bytes) -> str:
+    if audio.startswith(AUDIO_MARKER):
+        return audio[len(AUDIO_MARKER):].split(b'\n', 1)[0].decode(errors='replace')
+    return config.STT_DEFAULT_TEXT
+
+
+def recording_url(base_url: str, text: str) -> str:
+    """URL of a fake Twilio recording of someone saying text."""
+    return f"{base_url.rstrip('/')}/twilio/recordings/{quote(text)}"
+
+
+async def behave(profile: config.ServiceProfile):
+    """Wait out a sampled latency; return an error response if this request should fail."""
+    await asyncio.sleep(profile.delay())
+    if profile.fails():
+        return JSONResponse({'message': 'Stand-in injected failure'}, status_code=503)
+    return None
+
+
+def _rng(*seed) -> random.Random:
+    return random.Random(hashlib.sha256('|'.join(map(str, seed)).encode()).hexdigest())
+
+
+def fake_purchases(account_id: str, count: int) -> list:
+    """The same purchase history for an account every time, spread over the last six months."""
+    rng = _rng('purchases', account_id)
+    merchants = list(merchant_id_map.items())
+    today = date.today()
+    purchases = []
+    for i in range(count):
+        name, merchant_id = rng.choice(merchants)
+        purchases.append({
+            '_id': f"{account_id[-8:]}p{i:06d}",
+            'type': 'merchant',
+            'merchant_id': merchant_id,
+            'payer_id': account_id,
+            'purchase_date': (today - timedelta(days=rng.randint(0, 180))).isoformat(),
+            'amount': round(rng.lognormvariate(3, 0.8), 2),
+            'status': 'executed',
+            'medium': 'balance',
+            'description': f"{name} purchase"
+        })
+    return purchases
+
+
+# --- Nessie ---
+
+@app.get("/nessie/accounts/{account_id}")
+async def nessie_account(account_id: str):
+    error = await behave(config.NESSIE)
+    if error:
+        return error
+    return {
+        '_id': account_id,
+        'type': 'Checking',
+        'nickname': 'Checking',
+        'rewards': 0,
+        'balance': round(_rng('balance', account_id).uniform(200, 20000), 2),
+        'customer_id': f"customer-{account_id}"
+    }
+
+
+@app.get("/nessie/accounts/{account_id}/purchases")
+async def nessie_purchases(account_id: str):
+    error = await behave(config.NESSIE)
+    if error:
+        return error
+
+    async def body():
+        # Chunked like a large real response, so the client's streaming parser is exercised
+        purchases = fake_purchases(account_id, config.NESSIE.payload_size)
+        yield b'['
+        for i, purchase in enumerate(purchases):
+            yield (b',' if i else b'') + json.dumps(purchase).encode()
+        yield b']'
+
+    return StreamingResponse(body(), media_type='application/json')
+
+
+def created(kind: str, obj: dict) -> JSONResponse:
+    """Nessie's reply to a POST that created an object, with a fresh 24-hex-digit ID."""
+    return JSONResponse({
+        'message': f"Created {kind}",
+        'code': 201,
+        'objectCreated': {'_id': f"{random.getrandbits(96):024x}", **obj}
+    }, status_code=201)
+
+
+@app.post("/nessie/accounts/{account_id}/transfers")
+async def nessie_transfer(account_id: str, request: Request):
+    error = await behave(config.NESSIE)
+    if error:
+        return error
+    return created('transfer', {'payer_id': account_id, 'status': 'pending', **await request.json()})
+
+
+# Creation endpoints used by nessie_generation.py, so bulk seeding can be rehearsed offline.
+# Nothing is stored: reads still return the generated data above.
+
+@app.post("/nessie/merchants")
+async def nessie_create_merchant(request: Request):
+    error = await behave(config.NESSIE)
+    return error or created('merchant', await request.json())
+
+
+@app.post("/nessie/customers")
+async def nessie_create_customer(request: Request):
+    error = await behave(config.NESSIE)
+    return error or created('customer', await request.json())
+
+
+@app.post("/nessie/customers/{customer_id}/accounts")
+async def nessie_create_account(customer_id: str, request: Request):
+    error = await behave(config.NESSIE)
+    return error or created('account', {'customer_id': customer_id, **await request.json()})
+
+
+@app.post("/nessie/accounts/{account_id}/purchases")
+async def nessie_create_purchase(account_id: str, request: Request):
+    error = await behave(config.NESSIE)
+    return error or created('purchase', {'payer_id': account_id, **await request.json()})
+
+
+# --- ElevenLabs ---
+
+@app.post("/elevenlabs/v1/text-to-speech/{voice_id}")
+async def elevenlabs_tts(voice_id: str, request: Request, output_format: str = 'mp3_44100_128'):
+    error = await behave(config.TTS)
+    if error:
+        return error
+    text = (await request.json()).get('text', '')
+    # payload_size is for 128 kbps MP3; other formats scale with their bitrate
+    size = len(text) * config.TTS.payload_size * audio_byte_rate(output_format) // audio_byte_rate('mp3_44100_128')
+    media_type = 'audio/mpeg' if output_format.startswith('mp3') else 'application/octet-stream'
+    return Response(fake_audio(text, size), media_type=media_type)
+
+
+@app.post("/elevenlabs/v1/text-to-speech/{voice_id}/stream")
+async def elevenlabs_tts_stream(voice_id: str, request: Request, output_format: str = 'mp3_44100_128'):
+    error = await behave(config.TTS_STREAM)
+    if error:
+        return error
+    text = (await request.json()).get('text', '')
+    # Silence in the requested encoding: 0xFF is mu-law zero, 0x00 is PCM zero
+    silence = b'\xff' if output_format.startswith('ulaw') else b'\0'
+    size = len(text) * config.TTS_STREAM.payload_size
+    bytes_per_second = 8000 if output_format.startswith('ulaw') else 16000
+
+    async def body():
+        sent = 0
+        while sent < size:
+            chunk = min(TTS_STREAM_CHUNK_BYTES, size - sent)
+            yield silence * chunk
+            sent += chunk
+            # Synthesis runs faster than real time, but not instantly
+            await asyncio.sleep(chunk / bytes_per_second / config.TTS_STREAM_SPEED)
+
+    return StreamingResponse(body(), media_type='audio/basic')
+
+
+@app.post("/elevenlabs/v1/speech-to-text")
+async def elevenlabs_stt(request: Request):
+    error = await behave(config.STT)
+    if error:
+        return error
+    form = await request.form()
+    upload = form.get('file')
+    audio = await upload.read() if upload is not None else b''
+    return {'language_code': 'en', 'text': transcript_of(audio)}
+
+
+# --- Twilio ---
+
+@app.get("/twilio/recordings/{text:path}")
+async def twilio_recording(text: str):
+    error = await behave(config.TWILIO)
+    if error:
+        return error
+    return Response(fake_audio(text, config.TWILIO.payload_size), media_type='audio/x-wav')
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
@@ -0,0 +1,48 @@
+"""
+Fixtures that run the app against the stand-in services, the way `standins.bench --spawn` does.
+Run from backend/: python -m pytest tests
+"""
+import socket
+import pytest
+from standins.bench import Bench, spawn
+
+# Placeholder credentials; the stand-ins don't check them
+CREDENTIALS = ('ELEVENLABS_API_KEY', 'ELEVENLABS_VOICE_ID', 'NESSIE_API_KEY', 'GOOGLE_API_KEY',
+               'TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def app_env():
+    """Environment for the spawned app; a test module overrides this to pick a voice mode."""
+    return {}
+
+
+@pytest.fixture(scope='module')
+def app(app_env):
+    """The app and the stand-in server as subprocesses. Yields (app_url, standins_url)."""
+    app_url, standins_url = f"http://127.0.0.1:{free_port()}", f"http://127.0.0.1:{free_port()}"
+    with pytest.MonkeyPatch.context() as mp:
+        for name in CREDENTIALS:
+            mp.setenv(name, 'standin')
+        mp.setenv('PUBLIC_BASE_URL', app_url)
+        for name, value in app_env.items():
+            mp.setenv(name, value)
+        processes = spawn(app_url, standins_url)
+        try:
+            yield app_url, standins_url
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+
+@pytest.fixture
+def bench(app):
+    app_url, standins_url = app
+    return lambda turns: Bench(app_url, standins_url, turns, 'standin')
@@ -0,0 +1,30 @@
+"""VOICE_MODE=duplex calls, driven end to end by standins.media_peer.MediaPeer."""
+import asyncio
+import httpx
+import pytest
+
+TURNS = 2
+
+
+@pytest.fixture(scope='module', params=['true', 'false'], ids=['gemini-streaming', 'gemini-whole'])
+def app_env(request):
+    return {
+        'VOICE_MODE': 'duplex',
+        'GEMINI_STREAMING': request.param,
+        # Slower than the peer's idle threshold, so any silence while the assistant is still
+        # synthesizing what it says next is taken as the caller's turn to speak
+        'STANDIN_TTS_STREAM_LATENCY_MS': '1000',
+        'STANDIN_TTS_STREAM_DISTRIBUTION': 'fixed',
+    }
+
+
+def test_every_turn_is_answered(app, bench):
+    app_url, _ = app
+    run = bench(TURNS)
+    asyncio.run(run.run(calls=1, concurrency=1))
+    assert run.completed == 1
+    assert not run.errors
+    # The greeting, then a reply to every turn the caller spoke
+    assert len(run.timings['WS /media-stream first audio']) == TURNS + 1
+    # Audio alone can't tell a reply from a prompt; every turn reaching Gemini means none was dropped
+    assert len(httpx.get(f"{app_url}/stats/turns").json()) == TURNS
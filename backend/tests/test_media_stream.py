@@ -0,0 +1,46 @@
+"""VOICE_MODE=stream: replies streamed over /media-stream, driven by standins.media_peer.MediaPeer."""
+import asyncio
+import httpx
+import pytest
+import websockets
+from twilio.request_validator import RequestValidator
+from standins.media_peer import MediaPeer
+
+
+@pytest.fixture(scope='module')
+def app_env():
+    return {'VOICE_MODE': 'stream'}
+
+
+def stream_url(app_url: str) -> str:
+    return app_url.replace('http', 'ws', 1) + '/media-stream'
+
+
+def signed(url: str) -> dict:
+    """Handshake headers as Twilio sends them: the stream URL signed with no parameters."""
+    return {'X-Twilio-Signature': RequestValidator('standin').compute_signature(url, {})}
+
+
+def test_replies_are_streamed(app, bench):
+    app_url, _ = app
+    run = bench(1)
+    asyncio.run(run.run(calls=1, concurrency=1))
+    assert run.completed == 1
+    assert not run.errors
+    # The answer to the question and the goodbye each arrive over a media stream
+    assert len(run.timings['WS /media-stream first audio']) == 2
+    assert len(httpx.get(f"{app_url}/stats/turns").json()) == 2
+
+
+def test_unsigned_handshake_is_refused(app):
+    app_url, _ = app
+    peer = MediaPeer(stream_url(app_url), 'CAunsigned', timeout=10)
+    with pytest.raises(websockets.InvalidStatusCode):
+        asyncio.run(peer.run())
+
+
+def test_stream_for_unknown_call_is_closed(app):
+    app_url, _ = app
+    url = stream_url(app_url)
+    peer = asyncio.run(MediaPeer(url, 'CAunknown', timeout=10, headers=signed(url)).run())
+    assert peer.audio_bytes == 0